@@ -0,0 +1,356 @@
+"""
+Benchmark the volume read and response paths of the plugin on synthetic volumes.
+
+Every case writes a base image and two segmentations of a given size and
+number of labels in a given format to a temporary directory. Each helper and
+route handler is timed over a few runs, then run once more under tracemalloc
+to record the peak of the memory allocated by Python and numpy. Girder models
+are replaced by stand-ins serving the files from the temporary directory, so
+no database or server is needed.
+
+    python benchmarks/run_benchmarks.py --sizes 64 128 256 --labels 4 32 \\
+        --output results.json --baseline previous-results.json
+"""
+import argparse
+import contextlib
+import importlib.metadata
+import inspect
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from unittest import mock
+
+import numpy as np
+import SimpleITK as sitk
+
+from girder.exceptions import FilePathException
+
+import girder_segmentation_viewer as plugin
+from girder_segmentation_viewer.cache import volume_cache
+from girder_segmentation_viewer.diff import diff_volume
+from girder_segmentation_viewer.histogram import intensity_histogram
+from girder_segmentation_viewer.mesh import label_meshes
+from girder_segmentation_viewer.metrics import compare_segmentations
+from girder_segmentation_viewer.morphometry import label_morphometrics
+from girder_segmentation_viewer.overlay import overlay_quantification
+from girder_segmentation_viewer.pyramid import downsample_volume
+from girder_segmentation_viewer.transport import volume_response
+
+from volumes import FORMATS, synthetic_case
+
+
+class FakeFileModel:
+    """
+    Stands in for the Girder File model, serving files from the local disk.
+    Files are either read in place, like in a filesystem assetstore, or only
+    through ``open``, like in GridFS or S3 assetstores.
+    """
+
+    def __init__(self, paths, local):
+        self.paths = paths
+        self.local = local
+        self.files = {}
+        for name, path in paths.items():
+            extension = os.path.basename(path).split('.', 1)[1]
+            self.files[name] = {
+                '_id': name,
+                'name': os.path.basename(path),
+                'exts': extension.split('.'),
+                'itemId': 'item',
+                'size': os.path.getsize(path),
+                'sha512': '%s:%d' % (path, os.path.getmtime(path)),
+            }
+
+    def load(self, id, **kwargs):
+        return self.files.get(str(id))
+
+    def open(self, file):
+        return open(self.paths[file['_id']], 'rb')
+
+    def getLocalFilePath(self, file):
+        if not self.local:
+            raise FilePathException('File is not on the local disk')
+        return self.paths[file['_id']]
+
+    def update(self, *args, **kwargs):
+        pass
+
+
+class FakeItemModel:
+    def __init__(self, item):
+        self.item = item
+
+    def load(self, id, **kwargs):
+        return self.item
+
+
+class FakeResultModel:
+    """
+    Stands in for the stored results, always computing them.
+    """
+
+    def get_or_compute(self, kind, files, compute):
+        return compute()
+
+
+def output_size(output):
+    """
+    Consume the output of a benchmark, streaming the body of responses.
+
+    :return: number of bytes of the output
+    """
+    if hasattr(output, 'nbytes'):
+        return output.nbytes
+    if callable(output):
+        return sum(memoryview(chunk).nbytes for chunk in output())
+    return len(json.dumps(output, default=str))
+
+
+def measure(function, repeat, setup=None):
+    """
+    Time a function over a few runs, then run it once more under tracemalloc.
+    Responses are consumed within the measures, like a server sending them.
+
+    :param function: function without arguments, returning a response or
+        an object with a size in bytes
+    :param repeat: number of timed runs
+    :param setup: function called before each run, outside of the measures
+    :return: dict with the time of each run, their median and minimum, the
+        peak of traced memory and the size of the output
+    """
+    seconds = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            output_size(function())
+            seconds.append(time.perf_counter() - start)
+
+    if setup:
+        setup()
+    tracemalloc.start()
+    with contextlib.redirect_stdout(io.StringIO()):
+        output_bytes = output_size(function())
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'seconds': seconds,
+        'median_seconds': statistics.median(seconds),
+        'min_seconds': min(seconds),
+        'peak_bytes': peak,
+        'output_bytes': output_bytes,
+    }
+
+
+def _handler(name):
+    """
+    Get a route handler without its access and parameter decorators.
+    """
+    return inspect.unwrap(getattr(plugin.SegmentationItem, name))
+
+
+def case_benchmarks(files, repeat):
+    """
+    Run the benchmarks of a case, with the Girder models replaced.
+
+    :param files: FakeFileModel of the case
+    :param repeat: number of timed runs of each benchmark
+    :return: dict mapping benchmark names to their measures
+    """
+    resource = plugin.SegmentationItem()
+    base, seg1, seg2 = (files.files[name] for name in ('base', 'seg1', 'seg2'))
+    read = plugin._read_image_with_sitk
+
+    def cold():
+        volume_cache.clear()
+        plugin._histograms.clear()
+
+    results = {
+        'helper.read_image_with_sitk.cold': measure(lambda: read(base)[1], repeat, cold),
+    }
+    # The other benchmarks start from decoded volumes, like after the first view
+    results['helper.read_image_with_sitk.warm'] = measure(lambda: read(base)[1], repeat)
+    base_image, base_array = read(base)
+    seg1_array = read(seg1)[1]
+    seg2_array = read(seg2)[1]
+    header = {'shape': base_image.GetSize()}
+
+    results.update({
+        'helper.response.json': measure(
+            lambda: volume_response(header, base_array, 'json'), repeat),
+        'helper.response.binary': measure(
+            lambda: volume_response(header, base_array, 'binary'), repeat),
+        'helper.response.rle': measure(
+            lambda: volume_response(header, seg1_array, 'rle'), repeat),
+        'helper.intensity_histogram': measure(lambda: intensity_histogram(base_array), repeat),
+        'helper.overlay_quantification': measure(
+            lambda: overlay_quantification(base_array, seg1_array), repeat),
+        'helper.diff_volume': measure(lambda: diff_volume(seg1_array, seg2_array), repeat),
+        'helper.compare_segmentations': measure(
+            lambda: compare_segmentations(seg1_array, seg2_array, base_image.GetSpacing()),
+            repeat),
+        'helper.label_morphometrics': measure(
+            lambda: label_morphometrics(
+                seg1_array, base_image.GetSpacing(), base_image.GetOrigin(),
+                base_image.GetDirection(), base_array), repeat),
+        'helper.label_meshes': measure(
+            lambda: label_meshes(
+                seg1_array, base_image.GetSpacing(), base_image.GetOrigin(),
+                base_image.GetDirection()), repeat),
+        'helper.downsample_volume.labels': measure(
+            lambda: downsample_volume(base_image, seg1_array, labels=True)[1], repeat),
+        'helper.downsample_volume.intensities': measure(
+            lambda: downsample_volume(base_image, base_array, labels=False)[1], repeat),
+    })
+
+    middle = base_image.GetSize()[2] // 2
+    routes = {
+        'route.base_image_data.json': lambda: _handler('get_base_image_data_json')(
+            resource, files.item, 'json', 0),
+        'route.base_image_data.binary': lambda: _handler('get_base_image_data_json')(
+            resource, files.item, 'binary', 0),
+        'route.segmentation_data.rle': lambda: _handler('get_seg_data_json')(
+            resource, seg1, 'rle', True, 0, False),
+        'route.diff_data.rle': lambda: _handler('get_seg_diff_data_json')(
+            resource, 'seg1', 'seg2', 'rle', 0, 'categories', None, False, None, None),
+        'route.morphometrics': lambda: _handler('get_seg_morphometrics')(
+            resource, seg1, True),
+        'route.meshes': lambda: _handler('get_seg_meshes')(
+            resource, seg1, plugin.MESH_TRIANGLES),
+        'route.batch': lambda: _handler('get_batch')(
+            resource, files.item, 'seg1', 'seg2', None, None),
+        'route.slice.binary': lambda: _handler('get_slice')(
+            resource, base, middle, 'axial', 'binary', 0),
+        'route.slab.histogram': lambda: _handler('get_slab')(
+            resource, base, middle, middle + 8, 'axial', 'binary', 0, True),
+        'route.render.overlay': lambda: _handler('render_slice')(
+            resource, seg1, middle, 'axial', 'overlay', None, None, 0.5, 'png'),
+    }
+    for name, route in routes.items():
+        results[name + '.cold'] = measure(route, repeat, cold)
+        results[name + '.warm'] = measure(route, repeat)
+    return results
+
+
+@contextlib.contextmanager
+def mocked_girder(files):
+    """
+    Replace the Girder models used by the plugin with the stand-ins of a case.
+    """
+    files.item = {
+        '_id': 'item',
+        'segmentation': {'base_image': {'_id': 'base'}},
+    }
+    with mock.patch.object(plugin, 'File', lambda: files), \
+            mock.patch.object(plugin, 'Item', lambda: FakeItemModel(files.item)), \
+            mock.patch.object(plugin, 'SegmentationResult', FakeResultModel), \
+            mock.patch.object(plugin, '_schedule_pyramid', lambda file: None):
+        yield
+
+
+def environment():
+    """
+    Describe what the results were measured with.
+    """
+    try:
+        version = importlib.metadata.version('segmentation-viewer')
+    except importlib.metadata.PackageNotFoundError:
+        version = None
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'version': version,
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'simpleitk': sitk.Version.VersionString(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+    }
+
+
+def run(sizes, label_counts, formats, repeat, local):
+    """
+    Run the benchmarks of every combination of size, number of labels and format.
+
+    :return: list of result records
+    """
+    records = []
+    # The cache is large enough for every volume of a case, the store is not used
+    volume_cache.resize(1024 ** 4)
+    with mock.patch.object(plugin.volume_store, 'path', None):
+        for size in sizes:
+            for labels in label_counts:
+                for extension in formats:
+                    with tempfile.TemporaryDirectory() as directory:
+                        files = FakeFileModel(
+                            synthetic_case(directory, size, labels, extension), local)
+                        with mocked_girder(files):
+                            measures = case_benchmarks(files, repeat)
+                    volume_cache.clear()
+                    for name, result in measures.items():
+                        records.append(dict(
+                            result, benchmark=name, size=size, labels=labels,
+                            format=extension, voxels=size ** 3))
+                        print('%-40s %4d^3 %4d labels %-7s %9.4f s %10.1f MiB' % (
+                            name, size, labels, extension, result['median_seconds'],
+                            result['peak_bytes'] / 1024 ** 2), file=sys.stderr)
+    return records
+
+
+def _record_key(record):
+    return record['benchmark'], record['size'], record['labels'], record['format']
+
+
+def compare(records, baseline):
+    """
+    Print the ratio of the median time of each benchmark to a previous run.
+
+    :param records: result records of this run
+    :param baseline: result records of a previous run
+    """
+    previous = {_record_key(record): record for record in baseline}
+    for record in records:
+        old = previous.get(_record_key(record))
+        if old and old['median_seconds']:
+            print('%-40s %4d^3 %4d labels %-7s %6.2fx' % (
+                _record_key(record) + (record['median_seconds'] / old['median_seconds'],)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[64, 128])
+    parser.add_argument('--labels', type=int, nargs='+', default=[4, 32])
+    parser.add_argument('--formats', nargs='+', choices=FORMATS, default=FORMATS)
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs of each benchmark')
+    parser.add_argument('--remote', action='store_true',
+                        help='read files through File().open instead of in place')
+    parser.add_argument('--output', default='benchmark-results.json')
+    parser.add_argument('--baseline', help='results of a previous run to compare with')
+    args = parser.parse_args(argv)
+
+    records = run(args.sizes, args.labels, args.formats, args.repeat, not args.remote)
+    with open(args.output, 'w') as fp:
+        json.dump({'environment': environment(), 'options': vars(args), 'results': records},
+                  fp, indent=2)
+    if args.baseline:
+        with open(args.baseline) as fp:
+            compare(records, json.load(fp)['results'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Synthetic volumes for the benchmarks: a smooth intensity image with noise and
+two segmentations of it made of spherical labels, the second one shifted and
+resized so the two disagree on part of the voxels.
+"""
+import os
+
+import numpy as np
+import SimpleITK as sitk
+
+# File extensions of the formats volumes are written in
+FORMATS = ['nii.gz', 'nrrd', 'mha']
+
+SPACING = (0.8, 0.8, 1.5)
+
+
+def intensity_volume(size, seed=0):
+    """
+    :param size: length of each side of the cubic volume
+    :param seed: seed of the noise
+    :return: int16 numpy array, with values in the range of a CT scan
+    """
+    rng = np.random.default_rng(seed)
+    z, y, x = np.ogrid[:size, :size, :size]
+    ramp = (x + y + z) * (2000 / (3 * size)) - 1000
+    noise = rng.normal(0, 50, (size, size, size))
+    return np.clip(ramp + noise, -1024, 3071).astype(np.int16)
+
+
+def _spheres(size, labels, rng):
+    centers = rng.uniform(0.2, 0.8, (labels, 3)) * size
+    radii = rng.uniform(0.04, 0.15, labels) * size
+    return centers, radii
+
+
+def label_volume(size, centers, radii):
+    """
+    Paint spheres into a label volume, each one over the bounding box it covers.
+
+    :param size: length of each side of the cubic volume
+    :param centers: (z, y, x) center of each sphere, in voxels
+    :param radii: radius of each sphere, in voxels
+    :return: uint8 numpy array, or uint16 for more than 255 labels
+    """
+    dtype = np.uint8 if len(radii) < 256 else np.uint16
+    array = np.zeros((size, size, size), dtype=dtype)
+    for label, (center, radius) in enumerate(zip(centers, radii), start=1):
+        first = np.maximum(np.floor(center - radius).astype(int), 0)
+        last = np.minimum(np.ceil(center + radius).astype(int) + 1, size)
+        if np.any(last <= first):
+            continue
+        z, y, x = np.ogrid[tuple(slice(a, b) for a, b in zip(first, last))]
+        inside = (z - center[0]) ** 2 + (y - center[1]) ** 2 + (x - center[2]) ** 2 <= radius ** 2
+        array[tuple(slice(a, b) for a, b in zip(first, last))][inside] = label
+    return array
+
+
+def write_volume(array, path):
+    """
+    Write a volume with SimpleITK, which picks the format from the extension.
+
+    :param array: numpy array
+    :param path: path of the file
+    """
+    image = sitk.GetImageFromArray(array)
+    image.SetSpacing(SPACING)
+    sitk.WriteImage(image, path, useCompression=path.endswith('.gz'))
+
+
+def synthetic_case(directory, size, labels, extension, seed=0):
+    """
+    Write the volumes of a benchmark case.
+
+    :param directory: directory the files are written to
+    :param size: length of each side of the cubic volumes
+    :param labels: number of labels of the segmentations
+    :param extension: one of FORMATS
+    :param seed: seed of the random volumes
+    :return: dict mapping 'base', 'seg1' and 'seg2' to the paths of the files
+    """
+    rng = np.random.default_rng(seed)
+    centers, radii = _spheres(size, labels, rng)
+    volumes = {
+        'base': intensity_volume(size, seed),
+        'seg1': label_volume(size, centers, radii),
+        'seg2': label_volume(size, centers + rng.normal(0, 0.02 * size, centers.shape),
+                             radii * rng.uniform(0.9, 1.1, radii.shape)),
+    }
+    paths = {}
+    for name, array in volumes.items():
+        paths[name] = os.path.join(directory, '%s.%s' % (name, extension))
+        write_volume(array, paths[name])
+    return paths
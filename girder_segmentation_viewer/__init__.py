@@ -1,29 +1,114 @@
+import hashlib
+import json
+import logging
+import os
 import tempfile
+import threading
+import time
 import shutil
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
 import numpy as np
+from pymongo import UpdateOne
 
 from girder.constants import TokenScope, AccessType
-from girder.exceptions import ValidationException
+from girder.exceptions import AccessException, FilePathException, ValidationException
 from girder.models.file import File
 from girder.models.folder import Folder
 from girder.models.item import Item
+from girder.models.setting import Setting
+from girder.utility.model_importer import ModelImporter
+from girder.utility.progress import ProgressContext
 from girder.plugin import GirderPlugin
 from girder import events
 from girder.api import access
 from girder.api.describe import Description, autoDescribeRoute
-from girder.api.rest import Resource, filtermodel
+from girder.api.rest import Resource, filtermodel, setResponseHeader
 import SimpleITK as sitk
 
+from .cache import image_array, volume_cache, volume_key
+from .cohort import CohortComparison, CohortRow, compare_cohort
+from .diff import DIFF_CATEGORIES, DIFF_MODES, diff_volume
+from .histogram import histogram_header, intensity_histogram
+from .ingest import ingestion_queue
+from .metrics import compare_segmentations
+from .mesh import MAX_MESH_TRIANGLES, MESH_TRIANGLES, label_meshes, mesh_body, mesh_response
+from .morphometry import label_morphometrics
+from .overlay import overlay_quantification
+from .probe import (HEADER_PROBE_SIZE, has_image_extension, has_image_signature,
+                    read_image_information, supports_region_reading)
+from .pyramid import downsample_volume, level_count
+from .render import (RENDER_FORMATS, RENDER_MODES, apply_window, auto_window, blend,
+                     cached_response, diff_colors, image_response, label_colors, render_etag)
+from .resample import crop, overlap_region, resample_volume, same_grid
+from .results import SegmentationResult
+from .settings import PluginSettings
+from .store import VolumeHeader, volume_store
+from . import telemetry
+from .telemetry import span, timed_route, timing_registry
+from .transport import binary_volume_body, bundle_response, rle_volume_body, volume_response
+
+VOLUME_FORMATS = ['json', 'binary']
+
+# Label volumes can also be sent run-length encoded
+LABEL_FORMATS = VOLUME_FORMATS + ['rle']
+
+# How many times files were read in place, through a symlink or from a temporary copy
+read_paths = Counter()
+
+# Number of files probed at once when detecting the images of many items
+DETECT_WORKERS = 4
+
+# Number of files whose probe results are written back to the database at once
+DETECT_BATCH_SIZE = 256
+
+logger = logging.getLogger(__name__)
+
+# Pyramids are built one at a time in the background, the pending ones are keyed by contents
+_pyramid_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='segmentation_pyramid')
+_pyramid_lock = threading.Lock()
+_pyramid_pending = set()
+
+# Histograms of the latest image files, by contents, on top of the stored results
+HISTOGRAM_CACHE_SIZE = 64
+_histograms = OrderedDict()
+_histograms_lock = threading.Lock()
+
+# Cohort comparisons are run one at a time, each one over a pool of processes
+_cohort_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='segmentation_cohort')
+
+# SimpleITK index of the axis perpendicular to each kind of plane
+SLAB_AXES = {
+    'sagittal': 0,
+    'coronal': 1,
+    'axial': 2,
+}
+
 class SegmentationViewerPlugin(GirderPlugin):
     DISPLAY_NAME = 'Segmentation Viewer'
     CLIENT_SOURCE_PATH = 'web_client'
 
     def load(self, info):
         Item().exposeFields(level=AccessType.READ, fields={'segmentation'})
+        ModelImporter.registerModel(
+            'segmentation_result', SegmentationResult, plugin='segmentation_viewer')
+        ModelImporter.registerModel(
+            'segmentation_cohort', CohortComparison, plugin='segmentation_viewer')
+        ModelImporter.registerModel(
+            'segmentation_cohort_row', CohortRow, plugin='segmentation_viewer')
+
+        volume_cache.resize(Setting().get(PluginSettings.VOLUME_CACHE_SIZE) * 1024 ** 2)
+        volume_store.path = Setting().get(PluginSettings.VOLUME_STORE_PATH)
+        volume_store.resize(Setting().get(PluginSettings.VOLUME_STORE_SIZE) * 1024 ** 2)
+        telemetry.profile_path = Setting().get(PluginSettings.PROFILE_PATH)
+        events.bind('model.setting.save.after', 'segmentation_viewer', _setting_handler)
 
         # File handlers
         events.bind('data.process', 'segmentation_viewer', _upload_handler)
         events.bind('model.file.remove', 'segmentation_viewer', _deletion_handler)
+        events.bind('model.file.save.after', 'segmentation_viewer', _file_save_handler)
 
         # Base image handlers
         events.bind('rest.post.item.after', 'segmentation_viewer', post_item_after)
@@ -55,6 +140,11 @@ class SegmentationItem(Resource):
             (),
             self.create_segmentation_item
         )
+        self.route(
+            'POST',
+            ('detect_images',),
+            self.detect_images_in_hierarchy
+        )
         self.route(
             'GET',
             (':id', 'base_image_data'),
@@ -70,6 +160,81 @@ class SegmentationItem(Resource):
             ('diff_data',),
             self.get_seg_diff_data_json
         )
+        self.route(
+            'GET',
+            (':id', 'batch'),
+            self.get_batch
+        )
+        self.route(
+            'GET',
+            (':id', 'slice', ':k'),
+            self.get_slice
+        )
+        self.route(
+            'GET',
+            (':id', 'slab'),
+            self.get_slab
+        )
+        self.route(
+            'GET',
+            (':id', 'render', ':k'),
+            self.render_slice
+        )
+        self.route(
+            'GET',
+            ('diff_render', ':k'),
+            self.render_diff_slice
+        )
+        self.route(
+            'GET',
+            ('cache',),
+            self.get_cache_stats
+        )
+        self.route(
+            'GET',
+            ('telemetry',),
+            self.get_telemetry
+        )
+        self.route(
+            'GET',
+            ('metrics',),
+            self.get_seg_metrics
+        )
+        self.route(
+            'POST',
+            ('cohort',),
+            self.create_cohort_comparison
+        )
+        self.route(
+            'GET',
+            ('cohort', ':id'),
+            self.get_cohort_comparison
+        )
+        self.route(
+            'GET',
+            ('cohort', ':id', 'rows'),
+            self.get_cohort_rows
+        )
+        self.route(
+            'PUT',
+            ('cohort', ':id', 'cancel'),
+            self.cancel_cohort_comparison
+        )
+        self.route(
+            'DELETE',
+            ('cohort', ':id'),
+            self.delete_cohort_comparison
+        )
+        self.route(
+            'GET',
+            (':id', 'morphometrics'),
+            self.get_seg_morphometrics
+        )
+        self.route(
+            'GET',
+            (':id', 'meshes'),
+            self.get_seg_meshes
+        )
 
     @access.user(scope=TokenScope.DATA_WRITE)
     @filtermodel(model=Item)
@@ -129,32 +294,39 @@ class SegmentationItem(Resource):
         .errorResponse('ID was invalid')
         .errorResponse('Read permission denied on the item', 403)
     )
-    def detect_images(self, item) -> None:
+    def detect_images(self, item):
         """
         Try to get all files within an item that can be read by itk,
         if any store references to them in a new 'images' property
         within the segmentation property.
         """
-        image_files = []
+        return _detect_images([item])
 
-        for file in Item().childFiles(item):
-            # Check if any files are readable by itk
-            if not _is_readable_by_sitk(file):
-                continue
-            # Add a reference for each file that is
-            image_files.append({
-                'name': file['name'],
-                '_id': file['_id']
-            })
-
-        if image_files:
-            # Initialize segmentation property
-            if 'segmentation' not in item:
-                item['segmentation'] = {}
-            # Save files that were readable to a new Item property
-            item['segmentation']['images'] = image_files
-            # Save the item
-            Item().save(item)
+    @access.user(scope=TokenScope.DATA_WRITE)
+    @autoDescribeRoute(
+        Description('Detect the images of every item within a folder or collection')
+        .param(
+            'parentType',
+            'Type of the parent of the items',
+            enum=['folder', 'collection']
+        )
+        .param(
+            'parentId',
+            'ID of the folder or collection'
+        )
+        .errorResponse('ID was invalid')
+        .errorResponse('Write permission denied on the folder or collection', 403)
+    )
+    def detect_images_in_hierarchy(self, parentType, parentId):
+        """
+        Detect the images of all the items within a folder or collection and
+        their subfolders, as detect_images does for a single item.
+        Folders the user cannot write to are skipped.
+        """
+        user = self.getCurrentUser()
+        parent = ModelImporter.model(parentType).load(
+            parentId, user=user, level=AccessType.WRITE, exc=True)
+        return _detect_images(_walk_items(parent, parentType, user))
 
     @access.user(scope=TokenScope.DATA_WRITE)
     @autoDescribeRoute(
@@ -195,6 +367,8 @@ class SegmentationItem(Resource):
     @access.user(scope=TokenScope.DATA_READ)
     @autoDescribeRoute(
         Description('Get the base image of an item as a JSON object')
+        .notes('The histogram of downsampled levels is null until it was computed by a full '
+               'resolution request or the pyramid build.')
         .modelParam(
             'id',
             'Item ID',
@@ -202,15 +376,33 @@ class SegmentationItem(Resource):
             level=AccessType.READ,
             paramType='path'
         )
+        .param(
+            'format',
+            'Response format. "binary" sends a JSON header followed by the raw voxel buffer',
+            required=False,
+            default='json',
+            enum=VOLUME_FORMATS
+        )
+        .param(
+            'level',
+            'Pyramid level, each one halving the resolution of the previous one. '
+            'The closest finer level is returned until the requested one is built. '
+            'Must not be negative',
+            required=False,
+            dataType='integer',
+            default=0
+        )
         .errorResponse('ID was invalid')
         .errorResponse('Read permission denied on the item', 403)
         .errorResponse('Item does not have a segmentation property', 400)
         .errorResponse('Item does not have a base image', 400)
     )
-    def get_base_image_data_json(self, item):
+    @timed_route('base_image_data')
+    def get_base_image_data_json(self, item, format, level):
         """
         Get the base image of an item as a JSON object. readable by VTKjs.
         """
+        _check_level(level)
         if 'segmentation' not in item:
             raise ValidationException('Item does not have a segmentation property', 'segmentation')
 
@@ -222,25 +414,26 @@ class SegmentationItem(Resource):
             raise ValidationException('Base image file not found', 'base_image')
         
         try:
-            image, array = _read_image_with_sitk(file)
-
-            print(f'array len: {len(array)}, subarray len: {len(array[0])}, subsubarray len: {len(array[0][0])}')
-
-            image_data_array = []
-            for image_slice in array:
-                image_data_array.append(image_slice.flatten().tolist())
-
+            level, image, array = _read_image_level(file, level)
+
+            # Downsampled levels only get the histogram of the whole volume, once it
+            # was stored, so they never wait for the whole volume to be decoded
+            histogram = _intensity_histogram(
+                file, None if level else array, stored_only=level > 0)
+            if histogram is not None:
+                histogram = histogram_header(histogram, None if level else 0)
             image_data = {
                 'shape': image.GetSize(),
                 'spacing': image.GetSpacing(),
                 'origin': image.GetOrigin(),
                 'direction': image.GetDirection(),
-                'data': image_data_array,
+                'level': level,
+                'histogram': histogram,
             }
-            # print(f'Base image data: {image_data}')
-            print(f'Shape: {image_data["shape"]}, Spacing: {image_data["spacing"]}, Origin: {image_data["origin"]}, Direction: {image_data["direction"]}')
-            print(f'Base image data length: {len(image_data["data"])}')
-            return image_data
+            logger.debug('Base image %s: shape %s, spacing %s, origin %s, direction %s',
+                         file['_id'], image_data['shape'], image_data['spacing'],
+                         image_data['origin'], image_data['direction'])
+            return volume_response(image_data, array, format)
         except RuntimeError:
             raise ValidationException('Base image file is not readable by SimpleITK', 'base_image')
 
@@ -254,111 +447,96 @@ class SegmentationItem(Resource):
             level=AccessType.READ,
             paramType='path'
         )
+        .param(
+            'format',
+            'Response format. "binary" sends a JSON header followed by the raw voxel buffer, '
+            '"rle" sends it run-length encoded slice by slice, for mostly empty label volumes',
+            required=False,
+            default='json',
+            enum=LABEL_FORMATS
+        )
+        .param(
+            'level',
+            'Pyramid level, each one halving the resolution of the previous one. '
+            'The closest finer level is returned until the requested one is built. '
+            'Must not be negative',
+            required=False,
+            dataType='integer',
+            default=0
+        )
+        .param(
+            'overlay',
+            'Whether to overlay the segmentation on the base image to compute its '
+            'quantification. Skip it when only the raw labels are needed. '
+            'Ignored when a level is requested',
+            required=False,
+            dataType='boolean',
+            default=True
+        )
+        .param(
+            'roi',
+            'When overlaying, only return the region of the base image grid that the '
+            'segmentation covers, instead of the whole grid',
+            required=False,
+            dataType='boolean',
+            default=False
+        )
         .errorResponse('File ID was invalid')
         .errorResponse('File was not found', 400)
         .errorResponse('File was not readable by SimpleITK', 400)
     )
-    def get_seg_data_json(self, file):
+    @timed_route('segmentation_data')
+    def get_seg_data_json(self, file, format, overlay, level, roi):
         """
         Get segmentation overlayed on base image as a JSON object readable by VTKjs.
         This method overlays the segmentation on top of the base image.
+        Segmentations on a different grid than the base image are resampled onto it.
         """
+        _check_level(level)
         try:
-            # Load the file objects from the provided IDs
-            item = Item().load(file['itemId'], force=True)
-            if not item:
-                raise ValidationException('Parent item not found', 'item_id')
-
-            base_image_file = File().load(item['segmentation']['base_image']['_id'], force=True)
-            if not base_image_file:
-                raise ValidationException('Base image file not found', 'base_image_id')
-
-            # Read both image files
-            base_image_sitk, base_array = _read_image_with_sitk(base_image_file)
-            seg_image_sitk, seg_array = _read_image_with_sitk(file)
-
-            print(f'Seg - Base image shape: {base_array.shape}, Segmentation shape: {seg_array.shape}')
-            
-            # Check if arrays have the same shape
-            if base_array.shape != seg_array.shape:
-                print(f'Seg - Base image shape: {base_array.shape}, Segmentation shape: {seg_array.shape}')
-                raise ValidationException('Base image and segmentation files must have the same dimensions', 'shape_mismatch')
-            
-            # Create overlay: where segmentation has values, use segmentation; otherwise use base image
-            # Normalize base image to 0-255 range if needed
-            if base_array.max() > 255:
-                base_normalized = ((base_array - base_array.min()) / (base_array.max() - base_array.min()) * 255).astype(np.uint8)
-            else:
-                base_normalized = base_array.astype(np.uint8)
-            
-            # Create overlay array starting with base image
-            overlay_array = base_normalized.copy().astype(np.float32)
-            
-            # Get unique segmentation labels (excluding background/0)
-            unique_labels = np.unique(seg_array)
-            unique_labels_no_bg = unique_labels[unique_labels != 0]
-            
-            print(f'Seg - Found {len(unique_labels_no_bg)} unique segmentation labels: {unique_labels_no_bg}')
-            
-            # Create different opacity levels for each label
-            for i, label in enumerate(unique_labels_no_bg):
-                # Create mask for this specific label
-                label_mask = seg_array == label
-                
-                # Calculate opacity based on label index (cycling through different opacity levels)
-                # This creates varying opacity: 0.4, 0.6, 0.8, 1.0, then cycles back
-                alpha = 0.4 + (i % unique_labels.size) * 0.05  # Results in opacities: 0.4, 0.45, 0.5, 0.55
-
-                # For this label's areas, blend the base image with white using this label's opacity
-                overlay_array[label_mask] = overlay_array[label_mask] * (1 - alpha) + 255 * alpha
-                
-                print(f'Seg - Label {label}: alpha={alpha:.2f}, pixels={np.count_nonzero(label_mask)}')
-            
-            # Convert back to uint8
-            overlay_array = np.clip(overlay_array, 0, 255).astype(np.uint8)
-
-            temp = np.unique(overlay_array)
-            print(f'Seg - unique overlay values: {temp}')
-
-            # print(f'Seg - Overlay array shape: {overlay_array.shape}')
-            # print(f'Seg - Overlay array dtype: {overlay_array.dtype}')
-            # print(f'Seg - Overlay array min: {overlay_array.min()}, max: {overlay_array.max()}')
-            # print(f'Seg - Total segmentation pixels overlayed: {np.count_nonzero(seg_array > 0)}')
-            
-            # Get statistics about the overlay
-            unique_overlay_values = np.unique(overlay_array)
-            print(f'Seg - Unique overlay values: {len(unique_overlay_values)} values')
-
-            seg_data_array = []
-            for seg_slice in seg_array:
-                seg_data_array.append(seg_slice.flatten().tolist())
-
-            # Compute quantification statistics for the overlay, Still not sure how to calculate them correctly 🫠
-            quantification = {
-                'min': overlay_array.min(),
-                'max': overlay_array.max(),
-                'mean': overlay_array.mean(),
-                'sd': overlay_array.std(),
-                'volume': overlay_array.size
-            }
+            served_level, seg_image_sitk, seg_array = _read_image_level(file, level)
+
+            spatial_image = seg_image_sitk
+            region = None
+            quantification = None
+            # The quantification is only computed at full resolution
+            if overlay and not level:
+                # Load the file objects from the provided IDs
+                item = Item().load(file['itemId'], force=True)
+                if not item:
+                    raise ValidationException('Parent item not found', 'item_id')
+
+                base_image_file = File().load(item['segmentation']['base_image']['_id'], force=True)
+                if not base_image_file:
+                    raise ValidationException('Base image file not found', 'base_image_id')
+
+                # The header stored by the probe is enough for the spatial metadata
+                base_image_info = _probe_image(base_image_file)
+                if not base_image_info['readable']:
+                    raise RuntimeError('Base image file is not readable by SimpleITK')
+                base_image = VolumeHeader(
+                    base_image_info['size'], base_image_info['spacing'],
+                    base_image_info['origin'], base_image_info['direction'])
+
+                logger.debug('Segmentation %s: base image size %s, segmentation shape %s',
+                             file['_id'], base_image.GetSize(), seg_array.shape)
+
+                spatial_image, region, seg_array, quantification = _overlay_segmentation(
+                    file, seg_image_sitk, seg_array, base_image_file, base_image, roi)
 
-            # Use base_image for spatial metadata (since both should have same metadata)
             seg_data = {
-                'shape': seg_image_sitk.GetSize(),
-                'spacing': base_image_sitk.GetSpacing(),
-                'origin': base_image_sitk.GetOrigin(),
-                'direction': base_image_sitk.GetDirection(),
-                # 'data': overlay_array.flatten().tolist(),  # Convert to list for JSON serialization
-                # 'data': seg_array.flatten().tolist(),  # Convert to list for JSON serialization
-                'data': seg_data_array,  # Convert to list for JSON serialization
+                'shape': spatial_image.GetSize(),
+                'spacing': spatial_image.GetSpacing(),
+                'origin': spatial_image.GetOrigin(),
+                'direction': spatial_image.GetDirection(),
                 'type': 'segmentation_overlay',  # Add type identifier for frontend
-                'quantification': quantification
+                'quantification': quantification,
+                'level': served_level,
             }
-            
-            # print(f'Seg - Final shape: {seg_data["shape"]}')
-            # print(f'Seg - Final data length: {len(seg_data["data"])}')
-            
-            return seg_data
+            if region is not None:
+                seg_data['region'] = {'index': region[0], 'size': region[1]}
+
+            return volume_response(seg_data, seg_array, format)
         except RuntimeError:
             raise ValidationException('Image file is not readable by SimpleITK', '')
 
@@ -375,15 +553,72 @@ class SegmentationItem(Resource):
             'Second segmentation file ID',
             paramType='query'
         )
+        .param(
+            'format',
+            'Response format. "binary" sends a JSON header followed by the raw voxel buffer, '
+            '"rle" sends it run-length encoded slice by slice, for mostly empty label volumes',
+            required=False,
+            default='json',
+            enum=LABEL_FORMATS
+        )
+        .param(
+            'level',
+            'Pyramid level, each one halving the resolution of the previous one. '
+            'The closest finer level is returned until the requested one is built. '
+            'Must not be negative',
+            required=False,
+            dataType='integer',
+            default=0
+        )
+        .param(
+            'mode',
+            'Difference to compute. "categories" gives the category of each voxel: '
+            '0 background, 1 same label, 2 only in the first segmentation, 3 only in the '
+            'second one and 4 different labels. "mismatch" is 1 where labels differ, and '
+            '"absolute" the absolute difference of the labels',
+            required=False,
+            default='categories',
+            enum=DIFF_MODES
+        )
+        .param(
+            'label',
+            'Only compare the voxels with this label in either segmentation',
+            required=False,
+            dataType='integer'
+        )
+        .param(
+            'roi',
+            'Only compare the region of the grid of the first segmentation that the '
+            'second one covers, instead of the whole grid',
+            required=False,
+            dataType='boolean',
+            default=False
+        )
+        .param(
+            'start',
+            'Index of the first axial slice to compare, the first one by default',
+            required=False,
+            dataType='integer'
+        )
+        .param(
+            'stop',
+            'Index past the last axial slice to compare, the last one by default',
+            required=False,
+            dataType='integer'
+        )
         .errorResponse('File ID was invalid')
         .errorResponse('File was not found', 400)
         .errorResponse('File was not readable by SimpleITK', 400)
     )
-    def get_seg_diff_data_json(self, seg1_id, seg2_id):
+    @timed_route('diff_data')
+    def get_seg_diff_data_json(self, seg1_id, seg2_id, format, level, mode, label, roi,
+                               start, stop):
         """
         Get segmentation difference data as a JSON object readable by VTKjs.
         This method computes the differences between two segmentation files.
+        The second segmentation is resampled onto the grid of the first one when they differ.
         """
+        _check_level(level)
         try:
             # Load the file objects from the provided IDs
             seg1 = File().load(seg1_id, force=True)
@@ -394,143 +629,1686 @@ class SegmentationItem(Resource):
             if not seg2:
                 raise ValidationException('Second segmentation file not found', 'seg2_id')
             
-            # Read both segmentation files
-            seg1_image, seg1_array = _read_image_with_sitk(seg1)
-            seg2_image, seg2_array = _read_image_with_sitk(seg2)
-
-            # print(f'Diff - Seg1 shape: {seg1_array.shape}, Seg2 shape: {seg2_array.shape}')
-            
-            # Check if arrays have the same shape
-            if seg1_array.shape != seg2_array.shape:
-                raise ValidationException('Segmentation files must have the same dimensions', 'shape_mismatch')
-            
-            # Compute the absolute difference between the two segmentations
-            diff_array = np.abs(seg1_array.astype(np.float32) - seg2_array.astype(np.float32))
-            
-            # Convert back to appropriate data type for visualization
-            # diff_array = diff_array.astype(np.uint8)
+            # Read both segmentation files, at a level both have
+            level1, seg1_image, seg1_array = _read_image_level(seg1, level)
+            level2, seg2_image, seg2_array = _read_image_level(seg2, level)
+            level = min(level1, level2)
+            if level1 != level:
+                level1, seg1_image, seg1_array = _read_image_level(seg1, level)
+            if level2 != level:
+                level2, seg2_image, seg2_array = _read_image_level(seg2, level)
+
+            # Map the second segmentation onto the grid of the first one when they differ
+            spatial_image, region = _target_grid(seg1_image, seg2_image, roi)
+            if region is not None:
+                seg1_array = crop(seg1_image, seg1_array, region)[1]
+            seg2_array = _resample_to_grid(
+                seg2, seg2_image, seg2_array, seg1, spatial_image, labels=True)
+
+            # Only the requested range of slices is compared
+            volume_shape = spatial_image.GetSize()
+            slab_start = 0
+            if start is not None or stop is not None:
+                slab_start = max(start or 0, 0)
+                slab_stop = volume_shape[-1] if stop is None else stop
+                axial = SLAB_AXES['axial']
+                seg2_array = _slice_slab(spatial_image, seg2_array, slab_start, slab_stop, axial)[1]
+                spatial_image, seg1_array, _ = _slice_slab(
+                    spatial_image, seg1_array, slab_start, slab_stop, axial)
+
+            # Compare the labels in their own data type
+            with span('diff'):
+                diff_array = diff_volume(seg1_array, seg2_array, mode, label)
+
+            # Statistics over the whole difference are only computed for debugging
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug('Difference of %s and %s: shape %s, %s differing voxels, values %s',
+                             seg1_id, seg2_id, diff_array.shape, np.count_nonzero(diff_array),
+                             np.unique(diff_array))
 
-            diff_data_array = []
-            for diff_slice in diff_array:
-                diff_data_array.append(diff_slice.flatten().tolist())
-            
-            # print(f'Diff - Difference array shape: {diff_array.shape}')
-            # print(f'Diff - Difference array dtype: {diff_array.dtype}')
-            # print(f'Diff - Difference array min: {diff_array.min()}, max: {diff_array.max()}')
-            # print(f'Diff - Non-zero differences: {np.count_nonzero(diff_array)}')
-            
-            # Get statistics about the differences
-            # unique_diff_values = np.unique(diff_array)
-            # print(f'Diff - Unique difference values: {unique_diff_values}')
-            
-            # Use seg1_image for spatial metadata (since both should have same metadata)
             diff_data = {
-                'shape': seg1_image.GetSize(),
-                'spacing': seg1_image.GetSpacing(),
-                'origin': seg1_image.GetOrigin(),
-                'direction': seg1_image.GetDirection(),
-                'data': diff_data_array,  # Convert to list for JSON serialization
+                'shape': spatial_image.GetSize(),
+                'spacing': spatial_image.GetSpacing(),
+                'origin': spatial_image.GetOrigin(),
+                'direction': spatial_image.GetDirection(),
                 'type': 'difference',  # Add type identifier for frontend
+                'level': level,
+                'mode': mode,
+                'label': label,
+                'start': slab_start,
+                'stop': slab_start + spatial_image.GetSize()[-1],
+                'volume_shape': volume_shape,
             }
-            
-            # print(f'Diff - Final shape: {diff_data["shape"]}')
-            # print(f'Diff - Final data length: {len(diff_data["data"])}')
-            
-            return diff_data
+            if mode == 'categories':
+                diff_data['categories'] = DIFF_CATEGORIES
+            if region is not None:
+                diff_data['region'] = {'index': region[0], 'size': region[1]}
+
+            return volume_response(diff_data, diff_array, format)
         except RuntimeError:
             raise ValidationException('Segmentation file is not readable by SimpleITK', '')
 
+    @access.user(scope=TokenScope.DATA_READ)
+    @autoDescribeRoute(
+        Description('Get the base image, two segmentations and their difference at once')
+        .notes('The response is a JSON header listing the name, offset and length of each '
+               'volume, followed by the volumes in the binary format for the base image and '
+               'the rle format for the segmentations and their difference.')
+        .modelParam(
+            'id',
+            'Item ID',
+            model='item',
+            level=AccessType.READ,
+            paramType='path'
+        )
+        .param(
+            'seg1_id',
+            'First segmentation file ID',
+            paramType='query'
+        )
+        .param(
+            'seg2_id',
+            'Second segmentation file ID, the difference is only returned along with it',
+            required=False,
+            paramType='query'
+        )
+        .param(
+            'start',
+            'Index of the first axial slice to return, the first one by default',
+            required=False,
+            dataType='integer'
+        )
+        .param(
+            'stop',
+            'Index past the last axial slice to return, the last one by default',
+            required=False,
+            dataType='integer'
+        )
+        .errorResponse('ID was invalid')
+        .errorResponse('Read permission denied on a file', 403)
+        .errorResponse('Slice range is out of the image bounds', 400)
+        .errorResponse('File was not readable by SimpleITK', 400)
+    )
+    @timed_route('batch')
+    def get_batch(self, item, seg1_id, seg2_id, start, stop):
+        """
+        Get what the viewer of a segmentation item shows in a single round trip,
+        decoding each file once: the base image, the segmentations with the
+        quantification of their overlay, and the categorical difference of the
+        second segmentation to the first one.
+        """
+        user = self.getCurrentUser()
+        base_image_file = _item_base_image_file(item)
+        seg_files = [('seg1', File().load(seg1_id, user=user, level=AccessType.READ))]
+        if not seg_files[0][1]:
+            raise ValidationException('First segmentation file not found', 'seg1_id')
+        if seg2_id is not None:
+            seg_files.append(('seg2', File().load(seg2_id, user=user, level=AccessType.READ)))
+            if not seg_files[1][1]:
+                raise ValidationException('Second segmentation file not found', 'seg2_id')
 
-def _read_image_with_sitk(file):
-    """
-    Read a Girder file using SimpleITK and return the image and array.
-    
-    :param file: Girder file object
-    :return: tuple (sitk_image, numpy_array)
-    :raises RuntimeError: if file is not readable by SimpleITK
-    """
-    exts = f'.{'.'.join(file['exts'])}'
-    
-    # Create a temporary file with the same extension as the original
-    with tempfile.NamedTemporaryFile(suffix=exts, delete=True) as tmp:
-        # Download file from Girder into temp file
-        with File().open(file) as fp:
-            shutil.copyfileobj(fp, tmp)
-            tmp.flush()  # Ensure all data is written
-        
-        # Read image using SimpleITK
-        image = sitk.ReadImage(tmp.name)
-        array = sitk.GetArrayFromImage(image)
+        try:
+            base_image, base_array = _read_image_with_sitk(base_image_file)
+            segs = [(name, file) + _read_image_with_sitk(file) for name, file in seg_files]
+        except RuntimeError:
+            raise ValidationException('File is not readable by SimpleITK', '')
+
+        base_data, base_planes = _axial_slab(base_image, base_array, start, stop)
+        base_data['histogram'] = histogram_header(
+            _intensity_histogram(base_image_file, base_array), base_data['start'],
+            base_data['stop'])
+        parts = [('base', binary_volume_body(base_data, base_planes))]
+        quantification = {}
+        for name, file, image, array in segs:
+            parts.append((name, rle_volume_body(*_axial_slab(image, array, start, stop))))
+            quantification[name] = _overlay_segmentation(
+                file, image, array, base_image_file, base_image, base_array=base_array)[3]
+
+        if len(segs) > 1:
+            (_, seg1, seg1_image, seg1_array), (_, seg2, seg2_image, seg2_array) = segs
+            # Like the difference route, the second segmentation is mapped onto the first one
+            target = VolumeHeader.from_image(seg1_image)
+            seg2_array = _resample_to_grid(
+                seg2, seg2_image, seg2_array, seg1, target, labels=True)
+            diff_data, seg1_planes = _axial_slab(target, seg1_array, start, stop)
+            seg2_planes = _axial_slab(target, seg2_array, start, stop)[1]
+            with span('diff'):
+                diff_array = diff_volume(seg1_planes, seg2_planes)
+            diff_data.update(
+                type='difference', mode='categories', label=None, categories=DIFF_CATEGORIES)
+            parts.append(('diff', rle_volume_body(diff_data, diff_array)))
+
+        return bundle_response({'quantification': quantification}, parts)
 
-        return image, array
+    @access.user(scope=TokenScope.DATA_READ)
+    @autoDescribeRoute(
+        Description('Compare two segmentations')
+        .param(
+            'seg1_id',
+            'First segmentation file ID',
+            paramType='query'
+        )
+        .param(
+            'seg2_id',
+            'Second segmentation file ID',
+            paramType='query'
+        )
+        .errorResponse('File ID was invalid')
+        .errorResponse('File was not found', 400)
+        .errorResponse('Read permission denied on a file', 403)
+        .errorResponse('File was not readable by SimpleITK', 400)
+    )
+    @timed_route('metrics')
+    def get_seg_metrics(self, seg1_id, seg2_id):
+        """
+        Compute the Dice and Jaccard coefficients, volume difference, Hausdorff distance,
+        95th percentile Hausdorff distance and average symmetric surface distance of two
+        segmentations, for each label and for the whole foreground.
+        """
+        user = self.getCurrentUser()
+        seg1 = File().load(seg1_id, user=user, level=AccessType.READ)
+        if not seg1:
+            raise ValidationException('First segmentation file not found', 'seg1_id')
+        seg2 = File().load(seg2_id, user=user, level=AccessType.READ)
+        if not seg2:
+            raise ValidationException('Second segmentation file not found', 'seg2_id')
+
+        def compare():
+            try:
+                seg1_image, seg1_array = _read_image_with_sitk(seg1)
+                seg2_image, seg2_array = _read_image_with_sitk(seg2)
+            except RuntimeError:
+                raise ValidationException('Segmentation file is not readable by SimpleITK', '')
+
+            # Map the second segmentation onto the grid of the first one when they differ
+            seg2_array = _resample_to_grid(
+                seg2, seg2_image, seg2_array, seg1, VolumeHeader.from_image(seg1_image),
+                labels=True)
+
+            with span('compare'):
+                return compare_segmentations(seg1_array, seg2_array, seg1_image.GetSpacing())
+
+        return SegmentationResult().get_or_compute('metrics', [seg1, seg2], compare)
 
+    @access.user(scope=TokenScope.DATA_READ)
+    @autoDescribeRoute(
+        Description('Measure every label of a segmentation')
+        .modelParam(
+            'id',
+            'File ID',
+            model='file',
+            level=AccessType.READ,
+            paramType='path'
+        )
+        .param(
+            'intensity',
+            'Whether to compute the statistics of the base image intensities under each label',
+            required=False,
+            dataType='boolean',
+            default=True
+        )
+        .errorResponse('File ID was invalid')
+        .errorResponse('File was not found', 400)
+        .errorResponse('File was not readable by SimpleITK', 400)
+    )
+    @timed_route('morphometrics')
+    def get_seg_morphometrics(self, file, intensity):
+        """
+        Get the voxel count, physical volume, centroid and bounding box of every label
+        of a segmentation, and the mean, standard deviation, minimum and maximum of the
+        base image intensities under it. Labels are measured on the grid of the
+        segmentation, the base image is resampled onto it when the grids differ.
+        """
+        base_image_file = _base_image_file(file) if intensity else None
+        files = [file, base_image_file] if intensity else [file]
+
+        def measure():
+            try:
+                seg_image, seg_array = _read_image_with_sitk(file)
+                base_array = None
+                if intensity:
+                    base_image, base_array = _read_image_with_sitk(base_image_file)
+                    base_array = _resample_to_grid(
+                        base_image_file, base_image, base_array, file,
+                        VolumeHeader.from_image(seg_image), labels=False)
+            except RuntimeError:
+                raise ValidationException('Image file is not readable by SimpleITK', '')
+            _require_volume(seg_image)
+
+            with span('morphometrics'):
+                return label_morphometrics(
+                    seg_array, seg_image.GetSpacing(), seg_image.GetOrigin(),
+                    seg_image.GetDirection(), base_array)
+
+        return SegmentationResult().get_or_compute(
+            'morphometrics' if intensity else 'morphometrics_labels', files, measure)
 
-def _is_readable_by_sitk(file) -> bool:
-    """
-    Check if a girder file is readable by SimpleITK or not.
-    :param file: Girder file object
-    :return: whether the file is readable by SimpleITK or not
-    """
-    try:
-        # Try to read the image - if it succeeds, the file is readable
-        _read_image_with_sitk(file)
-        return True
-    except RuntimeError:
-        return False
+    @access.user(scope=TokenScope.DATA_READ)
+    @autoDescribeRoute(
+        Description('Get the surface meshes of the labels of a segmentation')
+        .notes('The body is a binary header followed by the float32 vertices of every '
+               'label and then their uint32 triangles. Meshes are stored, so only the '
+               'first request for a file and budget extracts them.')
+        .modelParam(
+            'id',
+            'File ID',
+            model='file',
+            level=AccessType.READ,
+            paramType='path'
+        )
+        .param(
+            'triangles',
+            'Budget of triangles of all the labels, shared in proportion to their '
+            'surfaces (at most %d)' % MAX_MESH_TRIANGLES,
+            required=False,
+            dataType='integer',
+            default=MESH_TRIANGLES
+        )
+        .errorResponse('File ID was invalid')
+        .errorResponse('Triangle budget was out of range', 400)
+        .errorResponse('File was not readable by SimpleITK', 400)
+    )
+    @timed_route('meshes')
+    def get_seg_meshes(self, file, triangles):
+        """
+        Get the surface of every label of a segmentation as a triangle mesh in
+        physical space. Labels are meshed within their bounding boxes, from a
+        coarser grid when their surface exceeds their share of the budget.
+        """
+        if not 0 < triangles <= MAX_MESH_TRIANGLES:
+            raise ValidationException(
+                'Triangle budget must be between 1 and %d' % MAX_MESH_TRIANGLES, 'triangles')
 
-# File handlers
+        def extract():
+            try:
+                image, array = _read_image_with_sitk(file)
+            except RuntimeError:
+                raise ValidationException('File is not readable by SimpleITK', 'id')
+            _require_volume(image)
 
-def _upload_handler(event):
-    """
-    Whenever a new file is added to an item, check if the new file
-    is readable by SimpleITK. If it is, add it to the 'images' property.
-    """
-    # Get the ID of the file being added. If it even is a file
-    file = event.info['file']
-    if not _is_readable_by_sitk(file):
-        return
+            with span('meshes'):
+                return mesh_body(label_meshes(
+                    array, image.GetSpacing(), image.GetOrigin(), image.GetDirection(),
+                    triangles))
 
-    item = Item().load(file['itemId'], force=True)
-    # Initialize property if it does not already exist
-    if 'segmentation' not in item:
-        return
+        body = SegmentationResult().get_or_compute('meshes_%d' % triangles, [file], extract)
+        return mesh_response(bytes(body))
 
-    if 'images' not in item['segmentation']:
-        item['segmentation']['images'] = []
+    @access.user(scope=TokenScope.DATA_READ)
+    @autoDescribeRoute(
+        Description('Compare many segmentations with a reference in the background')
+        .param(
+            'reference_id',
+            'Reference segmentation file ID'
+        )
+        .param(
+            'parentType',
+            'Type of the parent whose segmentation images are compared with the reference',
+            required=False,
+            enum=['item', 'folder', 'collection']
+        )
+        .param(
+            'parentId',
+            'ID of the item, folder or collection. Folders and collections include the '
+            'items of their subfolders',
+            required=False
+        )
+        .jsonParam(
+            'candidate_ids',
+            'IDs of other segmentation files to compare with the reference',
+            required=False,
+            requireArray=True
+        )
+        .errorResponse('ID was invalid')
+        .errorResponse('No segmentation to compare with the reference', 400)
+        .errorResponse('Read permission denied on a file or parent', 403)
+    )
+    def create_cohort_comparison(self, reference_id, parentType, parentId, candidate_ids):
+        """
+        Queue the comparison of the segmentation images of an item, or of every item
+        within a folder or collection, and of any other given files, with a reference
+        segmentation. Base images and the reference itself are skipped. Progress is
+        reported through notifications and the status of the comparison, and the
+        metrics of each candidate can be paged through as soon as it is compared.
+        """
+        user = self.getCurrentUser()
+        reference = File().load(reference_id, user=user, level=AccessType.READ, exc=True)
+        candidates = _cohort_candidates(reference, parentType, parentId, candidate_ids, user)
+        if not candidates:
+            raise ValidationException('No segmentation to compare with the reference', 'parentId')
 
-    item['segmentation']['images'].append({
-        'name': file['name'],
-        '_id': file['_id']
-    })
-    Item().save(item)
-    events.trigger('segmentation_viewer.upload.success')
+        comparison = CohortComparison().create(reference, candidates, user)
+        _cohort_executor.submit(_run_cohort_comparison, comparison['_id'], user)
+        return comparison
 
+    @access.user(scope=TokenScope.DATA_READ)
+    @autoDescribeRoute(
+        Description('Get the status and progress of a cohort comparison')
+        .param(
+            'id',
+            'Cohort comparison ID',
+            paramType='path'
+        )
+        .errorResponse('ID was invalid')
+        .errorResponse('Access denied on the comparison', 403)
+    )
+    def get_cohort_comparison(self, id):
+        return _load_cohort_comparison(id, self.getCurrentUser())
 
-def _deletion_handler(event):
-    """
-    Whenever a file is about to be removed, check if it was contained
-    within the 'images' property. If it is, remove it.
-    """
-    file = event.info
-    item = Item().load(file['itemId'], force=True)
+    @access.user(scope=TokenScope.DATA_READ)
+    @autoDescribeRoute(
+        Description('Page through the metrics of a cohort comparison')
+        .param(
+            'id',
+            'Cohort comparison ID',
+            paramType='path'
+        )
+        .param(
+            'label',
+            'Only get the metrics of this label',
+            required=False,
+            dataType='integer'
+        )
+        .param(
+            'overall',
+            'Only get the metrics of the whole foreground of each segmentation',
+            required=False,
+            dataType='boolean',
+            default=False
+        )
+        .pagingParams(defaultSort='fileName')
+        .errorResponse('ID was invalid')
+        .errorResponse('Access denied on the comparison', 403)
+    )
+    def get_cohort_rows(self, id, label, overall, limit, offset, sort):
+        """
+        Get a page of the per-file, per-label metrics of a cohort comparison, along with
+        the total number of rows. The metrics of the whole foreground of a file have a
+        null label.
+        """
+        comparison = _load_cohort_comparison(id, self.getCurrentUser())
+        query = {'comparisonId': comparison['_id']}
+        if overall:
+            query['label'] = None
+        elif label is not None:
+            query['label'] = label
+        # Rows of the same file stay in label order
+        if not any(field == 'label' for field, _ in sort):
+            sort = sort + [('label', 1)]
+        rows = CohortRow().find(query, offset=offset, limit=limit, sort=sort)
+        return {'total': CohortRow().collection.count_documents(query), 'rows': list(rows)}
 
-    # Check if 'images' property even exists
-    if 'segmentation' not in item or 'images' not in item['segmentation']:
-        return
+    @access.user(scope=TokenScope.DATA_READ)
+    @autoDescribeRoute(
+        Description('Cancel a cohort comparison')
+        .param(
+            'id',
+            'Cohort comparison ID',
+            paramType='path'
+        )
+        .errorResponse('ID was invalid')
+        .errorResponse('Access denied on the comparison', 403)
+    )
+    def cancel_cohort_comparison(self, id):
+        """
+        Stop a cohort comparison. The metrics of the segmentations already compared
+        are kept.
+        """
+        comparison = _load_cohort_comparison(id, self.getCurrentUser())
+        if comparison['status'] in {'queued', 'running'}:
+            CohortComparison().request_cancel(comparison)
+        return comparison
 
-    images = []
-    for image in item['segmentation']['images']:
-        if image['_id'] != file['_id']:
-            images.append(image)
+    @access.user(scope=TokenScope.DATA_READ)
+    @autoDescribeRoute(
+        Description('Remove a cohort comparison and its metrics')
+        .param(
+            'id',
+            'Cohort comparison ID',
+            paramType='path'
+        )
+        .errorResponse('ID was invalid')
+        .errorResponse('Access denied on the comparison', 403)
+    )
+    def delete_cohort_comparison(self, id):
+        CohortComparison().remove(_load_cohort_comparison(id, self.getCurrentUser()))
 
-    if images:
-        item['segmentation']['images'] = images
+    @access.user(scope=TokenScope.DATA_READ)
+    @autoDescribeRoute(
+        Description('Get a single plane of an image file')
+        .modelParam(
+            'id',
+            'File ID',
+            model='file',
+            level=AccessType.READ,
+            paramType='path'
+        )
+        .param(
+            'k',
+            'Index of the plane along the axis',
+            paramType='path',
+            dataType='integer'
+        )
+        .param(
+            'axis',
+            'Orientation of the plane',
+            required=False,
+            default='axial',
+            enum=list(SLAB_AXES)
+        )
+        .param(
+            'format',
+            'Response format. "binary" sends a JSON header followed by the raw voxel buffer, '
+            '"rle" sends it run-length encoded slice by slice, for mostly empty label volumes',
+            required=False,
+            default='json',
+            enum=LABEL_FORMATS
+        )
+        .param(
+            'level',
+            'Pyramid level, each one halving the resolution of the previous one. '
+            'The closest finer level is returned until the requested one is built. '
+            'Must not be negative',
+            required=False,
+            dataType='integer',
+            default=0
+        )
+        .errorResponse('File ID was invalid')
+        .errorResponse('Plane index is out of the image bounds', 400)
+        .errorResponse('File was not readable by SimpleITK', 400)
+    )
+    @timed_route('slice')
+    def get_slice(self, file, k, axis, format, level):
+        """
+        Get a single plane of an image file without reading the rest of the volume.
+        """
+        _check_level(level)
+        return self._slab_response(file, k, k + 1, axis, format, level)
+
+    @access.user(scope=TokenScope.DATA_READ)
+    @autoDescribeRoute(
+        Description('Get a range of planes of an image file')
+        .modelParam(
+            'id',
+            'File ID',
+            model='file',
+            level=AccessType.READ,
+            paramType='path'
+        )
+        .param(
+            'start',
+            'Index of the first plane along the axis',
+            dataType='integer'
+        )
+        .param(
+            'stop',
+            'Index past the last plane along the axis, clamped to the image bounds',
+            dataType='integer'
+        )
+        .param(
+            'axis',
+            'Orientation of the planes',
+            required=False,
+            default='axial',
+            enum=list(SLAB_AXES)
+        )
+        .param(
+            'format',
+            'Response format. "binary" sends a JSON header followed by the raw voxel buffer, '
+            '"rle" sends it run-length encoded slice by slice, for mostly empty label volumes',
+            required=False,
+            default='json',
+            enum=LABEL_FORMATS
+        )
+        .param(
+            'level',
+            'Pyramid level, each one halving the resolution of the previous one. '
+            'The closest finer level is returned until the requested one is built. '
+            'Must not be negative',
+            required=False,
+            dataType='integer',
+            default=0
+        )
+        .param(
+            'histogram',
+            'Whether to add the intensity histogram and window presets of the whole volume, '
+            'and those of the axial slices of the slab, to the header. Meant for base images. '
+            'Downsampled levels get null until it was computed',
+            required=False,
+            dataType='boolean',
+            default=False
+        )
+        .errorResponse('File ID was invalid')
+        .errorResponse('Plane range is out of the image bounds', 400)
+        .errorResponse('File was not readable by SimpleITK', 400)
+    )
+    @timed_route('slab')
+    def get_slab(self, file, start, stop, axis, format, level, histogram):
+        """
+        Get the planes in [start, stop) of an image file without reading the rest of the
+        volume. The histogram is computed from the whole volume the first time it is
+        requested, and stored.
+        """
+        _check_level(level)
+        return self._slab_response(file, start, stop, axis, format, level, histogram)
+
+    def _slab_response(self, file, start, stop, axis, format, level=0, histogram=False):
+        """
+        Build the response for a range of planes along an axis.
+
+        Planes are returned as a volume whose first two dimensions are the
+        in-plane dimensions and whose last one is the number of planes, so they
+        can be indexed like the axial slices of the whole volume routes. When a
+        finer level is returned, the range is scaled to its planes. With
+        ``histogram``, the header holds the histogram of the whole volume, and
+        that of each axial slice of the range at the finest level. Requests of a
+        downsampled level only get it once it was stored, or None.
+        """
+        axis_index = SLAB_AXES[axis]
+        requested = level
+        try:
+            level, start, image, array, volume_size = _read_slab_level(
+                file, start, stop, axis_index, level)
+        except RuntimeError:
+            raise ValidationException('File is not readable by SimpleITK', 'id')
+
+        slab_data, planes = _slab_data(image, array, start, axis, volume_size, level)
+        if histogram:
+            try:
+                stored = _intensity_histogram(file, stored_only=requested > 0)
+            except RuntimeError:
+                raise ValidationException('File is not readable by SimpleITK', 'id')
+            # Only the full resolution axial slices have their own histogram
+            if stored is None:
+                slab_data['histogram'] = None
+            elif axis == 'axial' and not level:
+                slab_data['histogram'] = histogram_header(
+                    stored, slab_data['start'], slab_data['stop'])
+            else:
+                slab_data['histogram'] = histogram_header(stored)
+        return volume_response(slab_data, planes, format)
+
+    @access.user(scope=TokenScope.DATA_READ)
+    @autoDescribeRoute(
+        Description('Render a single plane of an image file as a PNG or WebP image')
+        .modelParam(
+            'id',
+            'File ID',
+            model='file',
+            level=AccessType.READ,
+            paramType='path'
+        )
+        .param(
+            'k',
+            'Index of the plane along the axis',
+            paramType='path',
+            dataType='integer'
+        )
+        .param(
+            'axis',
+            'Orientation of the plane',
+            required=False,
+            default='axial',
+            enum=list(SLAB_AXES)
+        )
+        .param(
+            'mode',
+            '"image" renders the file in grays through the window, "labels" colors each '
+            'label of a segmentation and "overlay" blends the colored labels of a '
+            'segmentation over its base image',
+            required=False,
+            default='image',
+            enum=RENDER_MODES
+        )
+        .param(
+            'window_width',
+            'Width of the intensity window, that of the 1-99 percentile preset of the '
+            'volume by default, like the web client',
+            required=False,
+            dataType='number'
+        )
+        .param(
+            'window_level',
+            'Center of the intensity window, that of the 1-99 percentile preset of the '
+            'volume by default',
+            required=False,
+            dataType='number'
+        )
+        .param(
+            'opacity',
+            'Opacity of the labels in overlay mode',
+            required=False,
+            dataType='number',
+            default=0.5
+        )
+        .param(
+            'format',
+            'Image format',
+            required=False,
+            default='png',
+            enum=RENDER_FORMATS
+        )
+        .errorResponse('File ID was invalid')
+        .errorResponse('Plane index is out of the image bounds', 400)
+        .errorResponse('File was not readable by SimpleITK', 400)
+    )
+    @timed_route('render')
+    def render_slice(self, file, k, axis, mode, window_width, window_level, opacity, format):
+        """
+        Render a plane of an image file, or of a segmentation over its base image,
+        for clients that cannot render the volumes themselves. Responses carry an
+        ETag built from the file contents and parameters, so cached copies are
+        revalidated without reading any voxel.
+        """
+        base_image_file = _base_image_file(file) if mode == 'overlay' else None
+        etag = render_etag(
+            volume_key(file), base_image_file and volume_key(base_image_file), k, axis, mode,
+            window_width, window_level, opacity, format)
+        cached = cached_response(etag)
+        if cached is not None:
+            return cached
+
+        try:
+            if mode == 'labels':
+                pixels = label_colors(_read_plane(file, k, axis))
+            elif mode == 'image':
+                pixels = _window_plane(
+                    _read_plane(file, k, axis), file, window_width, window_level)
+            else:
+                base_plane = _read_plane(base_image_file, k, axis)
+                seg_plane = _read_plane(file, k, axis, reference_file=base_image_file)
+                pixels = blend(
+                    _window_plane(base_plane, base_image_file, window_width, window_level),
+                    label_colors(seg_plane), seg_plane != 0, opacity)
+        except RuntimeError:
+            raise ValidationException('File is not readable by SimpleITK', 'id')
+        return image_response(pixels, format)
+
+    @access.user(scope=TokenScope.DATA_READ)
+    @autoDescribeRoute(
+        Description('Render a single plane of the difference of two segmentations')
+        .param(
+            'k',
+            'Index of the plane along the axis',
+            paramType='path',
+            dataType='integer'
+        )
+        .param(
+            'seg1_id',
+            'First segmentation file ID',
+            paramType='query'
+        )
+        .param(
+            'seg2_id',
+            'Second segmentation file ID',
+            paramType='query'
+        )
+        .param(
+            'axis',
+            'Orientation of the plane',
+            required=False,
+            default='axial',
+            enum=list(SLAB_AXES)
+        )
+        .param(
+            'label',
+            'Only compare the voxels with this label in either segmentation',
+            required=False,
+            dataType='integer'
+        )
+        .param(
+            'format',
+            'Image format',
+            required=False,
+            default='png',
+            enum=RENDER_FORMATS
+        )
+        .errorResponse('File ID was invalid')
+        .errorResponse('Read permission denied on a file', 403)
+        .errorResponse('Plane index is out of the image bounds', 400)
+        .errorResponse('File was not readable by SimpleITK', 400)
+    )
+    @timed_route('diff_render')
+    def render_diff_slice(self, k, seg1_id, seg2_id, axis, label, format):
+        """
+        Render a plane of the categorical difference of two segmentations: green
+        where they agree, red only in the first one, blue only in the second one
+        and yellow where their labels differ.
+        """
+        user = self.getCurrentUser()
+        seg1 = File().load(seg1_id, user=user, level=AccessType.READ)
+        if not seg1:
+            raise ValidationException('First segmentation file not found', 'seg1_id')
+        seg2 = File().load(seg2_id, user=user, level=AccessType.READ)
+        if not seg2:
+            raise ValidationException('Second segmentation file not found', 'seg2_id')
+
+        etag = render_etag(volume_key(seg1), volume_key(seg2), k, axis, label, format)
+        cached = cached_response(etag)
+        if cached is not None:
+            return cached
+
+        try:
+            seg1_plane = _read_plane(seg1, k, axis)
+            seg2_plane = _read_plane(seg2, k, axis, reference_file=seg1)
+        except RuntimeError:
+            raise ValidationException('Segmentation file is not readable by SimpleITK', '')
+        categories = diff_volume(seg1_plane[None], seg2_plane[None], 'categories', label)[0]
+        return image_response(diff_colors(categories), format)
+
+    @access.admin(scope=TokenScope.DATA_READ)
+    @autoDescribeRoute(
+        Description('Get the counters of the decoded volume cache and file reads')
+        .errorResponse('Admin access was denied', 403)
+    )
+    def get_cache_stats(self):
+        """
+        Get the hit, miss and eviction counters and memory usage of the decoded volume cache,
+        and how many files were read in place, through a symlink or from a temporary copy.
+        """
+        return dict(volume_cache.stats(), read_paths=dict(read_paths))
+
+    @access.admin(scope=TokenScope.DATA_READ)
+    @autoDescribeRoute(
+        Description('Get the timings of the routes in the Prometheus text format')
+        .notes('Requests are also profiled with cProfile when the profile path setting '
+               'is set and they carry the "%s" header.' % telemetry.PROFILE_HEADER)
+        .errorResponse('Admin access was denied', 403)
+    )
+    def get_telemetry(self):
+        """
+        Get the total time spent in each stage of each route and the size of their
+        responses, along with the volume cache and file read counters.
+        """
+        gauges = {
+            'segmentation_viewer_volume_cache_%s' % key: value
+            for key, value in volume_cache.stats().items()
+            if isinstance(value, (int, float))
+        }
+        gauges.update({
+            'segmentation_viewer_reads_%s' % key: value for key, value in read_paths.items()
+        })
+        body = timing_registry.render(gauges).encode('utf8')
+        setResponseHeader('Content-Type', 'text/plain; version=0.0.4')
+
+        def stream():
+            yield body
+
+        return stream
+
+
+def _local_file_path(file):
+    """
+    Get the path of a Girder file on the local disk, if its assetstore has one.
+
+    :param file: Girder file object
+    :return: path to the file, or None for assetstores such as GridFS or S3
+    """
+    try:
+        return File().getLocalFilePath(file)
+    except FilePathException:
+        return None
+
+
+@contextmanager
+def _local_image_path(file):
+    """
+    Context manager giving a local path to the contents of a Girder file,
+    with the same extension as the original so SimpleITK can pick its reader.
+    Files in local assetstores are used in place, through a symlink if their
+    path does not end with that extension. Other files are copied to a
+    temporary file.
+
+    :param file: Girder file object
+    :return: path to the file, a symlink to it, or a temporary copy of it
+    """
+    exts = '.' + '.'.join(file['exts'])
+    path = _local_file_path(file)
+
+    if path is not None and path.endswith(exts):
+        read_paths['local'] += 1
+        yield path
+    elif path is not None:
+        # Filesystem assetstores name files after their hash, without extension
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            link = os.path.join(tmp_dir, 'image' + exts)
+            os.symlink(path, link)
+            read_paths['symlink'] += 1
+            yield link
     else:
-        del item['segmentation']['images']  # Remove the property entirely if the list is empty
+        # Create a temporary file with the same extension as the original
+        with tempfile.NamedTemporaryFile(suffix=exts, delete=True) as tmp:
+            # Download file from Girder into temp file
+            with span('copy'), File().open(file) as fp:
+                shutil.copyfileobj(fp, tmp)
+                tmp.flush()  # Ensure all data is written
 
-    Item().save(item)
+            read_paths['copy'] += 1
+            yield tmp.name
+
+
+def _read_image_with_sitk(file):
+    """
+    Read a Girder file using SimpleITK and return the image and array.
+    Decoded volumes are kept in memory and in the volume store. The returned
+    array is read-only, and is memory-mapped when it comes from the store, in
+    which case the image is a VolumeHeader holding only the spatial metadata.
+    
+    :param file: Girder file object
+    :return: tuple (sitk_image, numpy_array)
+    :raises RuntimeError: if file is not readable by SimpleITK
+    """
+    cached = volume_cache.get(file)
+    if cached is not None:
+        return cached
+
+    stored = volume_store.get(file)
+    if stored is not None:
+        return stored
+
+    with _local_image_path(file) as path, span('decode'):
+        # Read image using SimpleITK
+        image = sitk.ReadImage(path)
+        array = image_array(image)
+
+    volume_cache.put(file, image, array)
+    volume_store.put(file, image, array)
+    return image, array
+
+
+def _require_volume(image):
+    """
+    Reject segmentations that are not 3D volumes, for the routes measuring
+    them in physical space.
+
+    :param image: SimpleITK image or VolumeHeader
+    :raises ValidationException: if the image is not 3D
+    """
+    if image.GetDimension() != 3:
+        raise ValidationException(
+            'Segmentation must be a 3D volume, not %dD' % image.GetDimension(), 'id')
+
+
+def _intensity_histogram(file, array=None, stored_only=False):
+    """
+    Get the intensity histogram and window presets of an image file. They are
+    computed once per file contents, stored with the other results, and kept
+    in memory for the latest files.
+
+    :param file: Girder file object
+    :param array: decoded volume of the file, read when the histogram is
+        computed if not given
+    :param stored_only: whether to only get a histogram that was already
+        computed, instead of decoding the file for it
+    :return: result of ``intensity_histogram``, or None if it was not
+        computed yet with ``stored_only``
+    :raises RuntimeError: if file is not readable by SimpleITK
+    """
+    key = volume_key(file)
+    with _histograms_lock:
+        histogram = _histograms.get(key)
+        if histogram is not None:
+            _histograms.move_to_end(key)
+            return histogram
+
+    def compute():
+        volume = _read_image_with_sitk(file)[1] if array is None else array
+        with span('histogram'):
+            return intensity_histogram(volume)
+
+    if stored_only:
+        histogram = SegmentationResult().get('histogram', [file])
+        if histogram is None:
+            return None
+    else:
+        histogram = SegmentationResult().get_or_compute('histogram', [file], compute)
+    with _histograms_lock:
+        _histograms[key] = histogram
+        while len(_histograms) > HISTOGRAM_CACHE_SIZE:
+            _histograms.popitem(last=False)
+    return histogram
+
+
+def _read_slab_with_sitk(file, start, stop, axis):
+    """
+    Read the planes in [start, stop) along an axis of a Girder file using SimpleITK.
+    Volumes that were already decoded are sliced from memory or from the volume
+    store. Otherwise uncompressed formats only decode the requested region,
+    and the others are decoded whole and cached like by ``_read_image_with_sitk``,
+    so the next planes are sliced from memory.
+
+    :param file: Girder file object
+    :param start: index of the first plane
+    :param stop: index past the last plane, clamped to the image bounds
+    :param axis: SimpleITK index of the axis perpendicular to the planes
+    :return: tuple (VolumeHeader, numpy_array, size of the whole volume)
+    :raises RuntimeError: if file is not readable by SimpleITK
+    """
+    decoded = volume_cache.get(file) or volume_store.get(file)
+    if decoded is not None:
+        return _slice_slab(VolumeHeader.from_image(decoded[0]), decoded[1], start, stop, axis)
+
+    with _local_image_path(file) as path:
+        with open(path, 'rb') as fp:
+            region_reading = supports_region_reading(fp.read(HEADER_PROBE_SIZE))
+        if region_reading:
+            reader = sitk.ImageFileReader()
+            reader.SetFileName(path)
+            reader.ReadImageInformation()
+            volume_size = reader.GetSize()
+            index, size = _slab_region(volume_size, start, stop, axis)
+
+            reader.SetExtractIndex(index)
+            reader.SetExtractSize(size)
+            with span('decode'):
+                image = reader.Execute()
+
+            return VolumeHeader.from_image(image), sitk.GetArrayFromImage(image), volume_size
+
+    # Compressed files are decoded whole to read any region, so they are decoded once
+    image, array = _read_image_with_sitk(file)
+    return _slice_slab(VolumeHeader.from_image(image), array, start, stop, axis)
+
+
+def _check_level(level):
+    """
+    Reject pyramid levels finer than the full resolution.
+
+    :param level: requested pyramid level
+    :raises ValidationException: if the level is negative
+    """
+    if level < 0:
+        raise ValidationException('Pyramid level must not be negative', 'level')
+
+
+def _read_image_level(file, level):
+    """
+    Read a level of the pyramid of a Girder file. Until it is built, the
+    closest finer level that was stored is returned instead, and the pyramid
+    is built in the background.
+
+    :param file: Girder file object
+    :param level: pyramid level, 0 being the full resolution
+    :return: tuple (level, sitk_image or VolumeHeader, numpy_array)
+    :raises RuntimeError: if file is not readable by SimpleITK
+    """
+    for stored_level in range(level, 0, -1):
+        stored = volume_store.get(file, stored_level)
+        if stored is not None:
+            return (stored_level,) + stored
+    if level > 0:
+        _schedule_pyramid(file)
+    return (0,) + _read_image_with_sitk(file)
+
+
+def _target_grid(reference, moving, roi):
+    """
+    Get the voxel grid a volume is mapped onto to be compared with another one.
+
+    :param reference: SimpleITK image or VolumeHeader of the volume whose grid is used
+    :param moving: SimpleITK image or VolumeHeader of the volume mapped onto it
+    :param roi: whether to only keep the region of the grid that the moving volume covers
+    :return: tuple (VolumeHeader of the grid, region (index, size) of the reference
+        grid or None when the whole grid is used)
+    """
+    reference = VolumeHeader.from_image(reference)
+    if not roi:
+        return reference, None
+    region = overlap_region(reference, moving)
+    if region is None:
+        raise ValidationException('The images do not overlap', 'roi')
+    return reference.region(*region), region
+
+
+def _overlay_segmentation(file, seg_image, seg_array, base_image_file, base_image, roi=False,
+                          base_array=None):
+    """
+    Overlay a segmentation on its base image and get the quantification of the
+    overlay, which is stored with the results of both files.
+
+    :param file: Girder file object of the segmentation
+    :param seg_image: SimpleITK image or VolumeHeader of the segmentation
+    :param seg_array: numpy array of the segmentation
+    :param base_image_file: Girder file object of the base image
+    :param base_image: SimpleITK image or VolumeHeader of the base image
+    :param roi: whether to only keep the region of the base image that the
+        segmentation covers
+    :param base_array: numpy array of the base image, read when the
+        quantification is computed if not given
+    :return: tuple (VolumeHeader of the overlay, region of the base image or
+        None, segmentation array on the overlay grid, quantification)
+    """
+    # Map the segmentation onto the grid of the base image when they differ
+    spatial_image, region = _target_grid(base_image, seg_image, roi)
+    seg_array = _resample_to_grid(
+        file, seg_image, seg_array, base_image_file, spatial_image, labels=True)
+
+    def quantify():
+        # Compute quantification statistics for the overlay,
+        # Still not sure how to calculate them correctly 🫠
+        base = _read_image_with_sitk(base_image_file)[1] if base_array is None else base_array
+        value_range = None
+        if region is not None:
+            base = crop(base_image, base, region)[1]
+        else:
+            # The stored histogram spares scanning the base image for its range
+            value_range = _intensity_histogram(base_image_file, base)['range']
+        with span('overlay'):
+            return overlay_quantification(base, seg_array, value_range)
+
+    quantification = SegmentationResult().get_or_compute(
+        'quantification_roi' if roi else 'quantification', [file, base_image_file], quantify)
+    return spatial_image, region, seg_array, quantification
+
+
+def _resample_to_grid(file, image, array, reference_file, target, labels):
+    """
+    Map the decoded volume of a Girder file onto the voxel grid of another file.
+    Resampled volumes are kept in the volume cache for each pair of files and grid.
+
+    :param file: Girder file object of the volume
+    :param image: SimpleITK image or VolumeHeader of the volume
+    :param array: numpy array of the volume
+    :param reference_file: Girder file object whose grid is used
+    :param target: VolumeHeader of the grid, or of a region of it
+    :param labels: whether the volume holds labels rather than intensities
+    :return: numpy array on the target grid
+    """
+    if same_grid(image, target):
+        return array
+
+    grid = hashlib.sha1(json.dumps(
+        [VolumeHeader.from_image(image).to_dict(), target.to_dict()]).encode('utf8'))
+    key = {
+        '_id': 'resampled:%s:%s:%s' % (file['_id'], reference_file['_id'], grid.hexdigest()),
+        'sha512': '%s:%s' % (volume_key(file)[1], volume_key(reference_file)[1]),
+    }
+    cached = volume_cache.get(key)
+    if cached is not None:
+        return cached[1]
+
+    with span('resample'):
+        resampled = resample_volume(image, array, target, labels)
+    volume_cache.put(key, target, resampled)
+    return resampled
+
+
+def _read_slab_level(file, start, stop, axis, level):
+    """
+    Read the planes in [start, stop) along an axis of a level of the pyramid
+    of a Girder file. Until it is built, the planes covering the same region
+    in the closest finer level that was stored are returned instead.
+
+    :return: tuple (level, index of the first plane in that level, VolumeHeader,
+        numpy_array, size of the whole volume at that level)
+    :raises RuntimeError: if file is not readable by SimpleITK
+    """
+    requested = level
+    while level > 0:
+        stored = volume_store.get(file, level)
+        if stored is not None:
+            return (level, max(start, 0)) + _slice_slab(*stored, start, stop, axis)
+        # Each finer level has twice as many planes
+        level -= 1
+        start, stop = max(start, 0) * 2, stop * 2
+    if requested > 0:
+        _schedule_pyramid(file)
+    return (0, max(start, 0)) + _read_slab_with_sitk(file, start, stop, axis)
+
+
+def _base_image_file(file):
+    """
+    Get the base image file of the item of a segmentation file.
+
+    :param file: Girder file object of the segmentation
+    :return: Girder file object
+    """
+    return _item_base_image_file(Item().load(file['itemId'], force=True))
+
+
+def _item_base_image_file(item):
+    """
+    Get the base image file of a segmentation item.
+
+    :param item: Girder item object, or None
+    :return: Girder file object
+    """
+    base_image = (item or {}).get('segmentation', {}).get('base_image')
+    base_image_file = base_image and File().load(base_image['_id'], force=True)
+    if not base_image_file:
+        raise ValidationException('Base image file not found', 'base_image_id')
+    return base_image_file
+
+
+def _image_header(file):
+    """
+    Get the spatial metadata of a Girder file from its probe.
+
+    :param file: Girder file object
+    :return: VolumeHeader
+    :raises RuntimeError: if file is not readable by SimpleITK
+    """
+    info = _probe_image(file)
+    if not info['readable']:
+        raise RuntimeError('File is not readable by SimpleITK')
+    return VolumeHeader(info['size'], info['spacing'], info['origin'], info['direction'])
+
+
+def _read_plane(file, k, axis, reference_file=None):
+    """
+    Read a single plane of a Girder file.
+
+    :param file: Girder file object
+    :param k: index of the plane along the axis
+    :param axis: name of the orientation of the plane
+    :param reference_file: Girder file object whose grid the plane is taken from,
+        the file being resampled onto it when their grids differ
+    :return: 2D numpy array
+    :raises RuntimeError: if file is not readable by SimpleITK
+    """
+    axis_index = SLAB_AXES[axis]
+    if reference_file is None or same_grid(_image_header(file), _image_header(reference_file)):
+        array = _read_slab_with_sitk(file, k, k + 1, axis_index)[1]
+    else:
+        reference = _image_header(reference_file)
+        image, array = _read_image_with_sitk(file)
+        array = _resample_to_grid(file, image, array, reference_file, reference, labels=True)
+        array = _slice_slab(reference, array, k, k + 1, axis_index)[1]
+    return np.moveaxis(array, array.ndim - 1 - axis_index, 0)[0]
+
+
+def _window_plane(plane, file, width, level):
+    """
+    Map a plane of an image file to grays, through the default window preset
+    of its histogram like the web client levels it unless one is given.
+    """
+    histogram = None
+    if width is None or level is None:
+        histogram = _intensity_histogram(file)
+    auto_width, auto_level = auto_window(plane, histogram)
+    return apply_window(plane, auto_width if width is None else width,
+                        auto_level if level is None else level)
+
+
+def _slab_region(volume_size, start, stop, axis):
+    """
+    Get the region of the planes in [start, stop) along an axis of a volume.
+
+    :return: tuple (index, size) of the region
+    """
+    if axis >= len(volume_size):
+        raise ValidationException('Image does not have enough dimensions for this axis', 'axis')
+    start = max(start, 0)
+    stop = min(stop, volume_size[axis])
+    if start >= stop:
+        raise ValidationException('Plane range is out of the image bounds', 'start')
+
+    index = [0] * len(volume_size)
+    index[axis] = start
+    size = list(volume_size)
+    size[axis] = stop - start
+    return index, size
+
+
+def _slice_slab(header, array, start, stop, axis):
+    """
+    Slice the planes in [start, stop) along an axis out of a decoded volume.
+
+    :return: tuple (VolumeHeader, numpy_array, size of the whole volume)
+    """
+    volume_size = header.GetSize()
+    index, size = _slab_region(volume_size, start, stop, axis)
+
+    region = [slice(None)] * array.ndim
+    region[len(volume_size) - 1 - axis] = slice(index[axis], index[axis] + size[axis])
+    return header.region(index, size), array[tuple(region)], volume_size
+
+
+def _slab_data(image, array, start, axis, volume_size, level=0):
+    """
+    Get the header and planes of a slab response. Planes are returned as a
+    volume whose first two dimensions are the in-plane dimensions and whose
+    last one is the number of planes.
+
+    :param image: SimpleITK image or VolumeHeader of the slab
+    :param array: numpy array of the slab
+    :param start: index of the first plane of the slab in the volume
+    :param axis: name of the orientation of the planes
+    :param volume_size: size of the whole volume
+    :param level: pyramid level of the slab
+    :return: tuple (dict, numpy array with the planes first)
+    """
+    axis_index = SLAB_AXES[axis]
+    # Put the planes first, the remaining numpy axes keep their order
+    planes = np.moveaxis(array, array.ndim - 1 - axis_index, 0)
+    in_plane = [i for i in range(image.GetDimension()) if i != axis_index]
+    size = image.GetSize()
+    spacing = image.GetSpacing()
+
+    slab_data = {
+        'shape': [size[i] for i in in_plane] + [size[axis_index]],
+        'spacing': [spacing[i] for i in in_plane] + [spacing[axis_index]],
+        'origin': image.GetOrigin(),
+        'direction': image.GetDirection(),
+        'axis': axis,
+        'start': start,
+        'stop': start + size[axis_index],
+        'volume_shape': volume_size,
+        'level': level,
+    }
+    return slab_data, planes
+
+
+def _axial_slab(image, array, start=None, stop=None):
+    """
+    Get the header and planes of the axial slices in [start, stop) of a decoded
+    volume, all of them by default.
+
+    :return: tuple (dict, numpy array with the planes first)
+    """
+    start = 0 if start is None else start
+    stop = image.GetSize()[-1] if stop is None else stop
+    header, array, volume_size = _slice_slab(
+        VolumeHeader.from_image(image), array, start, stop, SLAB_AXES['axial'])
+    return _slab_data(header, array, max(start, 0), 'axial', volume_size)
+
+
+def _is_label_file(file):
+    """
+    Check whether a file holds labels, that is whether it is not the base
+    image of its segmentation item.
+    """
+    item = Item().load(file['itemId'], force=True) or {}
+    base_image = item.get('segmentation', {}).get('base_image')
+    return base_image is None or base_image['_id'] != file['_id']
+
+
+def _schedule_pyramid(file):
+    """
+    Build the pyramid of a file in the background, once at a time per file contents.
+    """
+    if not volume_store.enabled:
+        return
+    key = volume_key(file)
+    with _pyramid_lock:
+        if key in _pyramid_pending:
+            return
+        _pyramid_pending.add(key)
+    _pyramid_executor.submit(_build_pyramid, file, key)
+
+
+def _build_pyramid(file, key):
+    """
+    Store the missing levels of the pyramid of a file, each one downsampled
+    from the previous one. Intensities are averaged and labels take the most
+    frequent value of each block. The histogram of intensity volumes is stored
+    too, for the requests of downsampled levels.
+    """
+    try:
+        labels = _is_label_file(file)
+        image, array = _read_image_with_sitk(file)
+        if not labels:
+            _intensity_histogram(file, array)
+        for level in range(1, level_count(array.shape)):
+            stored = volume_store.get(file, level)
+            if stored is None:
+                stored = downsample_volume(image, array, labels)
+                volume_store.put(file, *stored, level=level)
+            image, array = stored
+    except Exception:
+        logger.exception('Could not build the pyramid of file %s', file['_id'])
+    finally:
+        with _pyramid_lock:
+            _pyramid_pending.discard(key)
+
+
+def _stored_image_info(file):
+    """
+    Get the result of the last probe of a file, if its contents did not change since.
+
+    :param file: Girder file object
+    :return: dict stored by _probe_image, or None
+    """
+    image_info = file.get('image_info')
+    if image_info is not None and image_info.get('content') == volume_key(file)[1]:
+        return image_info
+    return None
+
+
+def _probe_image(file, store=True):
+    """
+    Read only the header of a Girder file with SimpleITK and store the result
+    in the 'image_info' property of the file. Files are first filtered by
+    extension and signature, and the stored result is reused until the
+    contents of the file change.
+
+    :param file: Girder file object
+    :param store: whether to write the result to the database, otherwise the
+        caller is responsible for it
+    :return: dict with whether the file is readable and, if it is, its
+        dimension, size, spacing, origin, direction and pixel type
+    """
+    image_info = _stored_image_info(file)
+    if image_info is not None:
+        return image_info
+
+    with File().open(file) as fp:
+        head = fp.read(HEADER_PROBE_SIZE)
+
+    info = None
+    if has_image_extension(file['name']) or has_image_signature(head):
+        if _local_file_path(file) is not None:
+            # Only the header is read from files on the local disk
+            with _local_image_path(file) as path:
+                info = read_image_information(path)
+        else:
+            with tempfile.NamedTemporaryFile(suffix='.' + '.'.join(file['exts'])) as tmp:
+                tmp.write(head)
+                tmp.flush()
+                info = read_image_information(tmp.name)
+
+            if info is None and len(head) == HEADER_PROBE_SIZE:
+                # Some formats, such as TIFF or DICOM, need more than the start of the file
+                with _local_image_path(file) as path:
+                    info = read_image_information(path)
+
+    image_info = dict(info or {}, readable=info is not None, content=volume_key(file)[1])
+    if store:
+        File().update({'_id': file['_id']}, {'$set': {'image_info': image_info}})
+    file['image_info'] = image_info
+    return image_info
+
+
+def _is_readable_by_sitk(file) -> bool:
+    """
+    Check if a girder file is readable by SimpleITK or not.
+    :param file: Girder file object
+    :return: whether the file is readable by SimpleITK or not
+    """
+    return _probe_image(file)['readable']
+
+
+def _walk_items(parent, parent_type, user, level=AccessType.WRITE):
+    """
+    Yield the items within a folder or collection and their subfolders.
+
+    :param parent: Girder folder or collection
+    :param parent_type: 'folder' or 'collection'
+    :param user: user who must have access to the folders
+    :param level: access level required on the folders
+    """
+    if parent_type == 'folder':
+        yield from Folder().childItems(parent)
+    for folder in Folder().childFolders(parent, parent_type, user=user):
+        if Folder().hasAccess(folder, user, level):
+            yield from _walk_items(folder, 'folder', user, level)
+
+
+def _try_probe_image(file):
+    try:
+        return _probe_image(file, store=False)
+    except Exception:
+        logger.exception('Could not probe file %s', file['_id'])
+        return None
+
+
+def _detect_images(items):
+    """
+    Store references to the files of each item that can be read by itk in the
+    'images' property of its segmentation property. Files that were already
+    probed with the same contents are skipped, the others are probed in a
+    thread pool, and the results are written back in batches. Images are only
+    added to the lists, removed files are left to the deletion handler.
+
+    :param items: iterable of Girder items
+    :return: dict with the number of items, files, probed, skipped and
+        failed files, images found and items updated, and the time taken
+    """
+    start = time.perf_counter()
+    summary = Counter(items=0, files=0, probed=0, skipped=0, failed=0, images=0, updated=0)
+    with ThreadPoolExecutor(max_workers=DETECT_WORKERS) as executor:
+        batch = []
+        for item in items:
+            batch.append((item, list(Item().childFiles(item))))
+            if sum(len(files) for _, files in batch) >= DETECT_BATCH_SIZE:
+                _detect_batch_images(batch, executor, summary)
+                batch = []
+        if batch:
+            _detect_batch_images(batch, executor, summary)
+
+    return dict(summary, seconds=time.perf_counter() - start)
+
+
+def _detect_batch_images(batch, executor, summary):
+    """
+    Detect the images of a batch of items with one bulk write per collection.
+    Files that fail to be probed are not counted as images.
+
+    :param batch: list of (item, list of files) tuples
+    :param executor: thread pool probing the files
+    :param summary: Counter updated with the results
+    """
+    files = [file for _, item_files in batch for file in item_files]
+    unprobed = [file for file in files if _stored_image_info(file) is None]
+
+    file_updates = []
+    for file, image_info in zip(unprobed, executor.map(_try_probe_image, unprobed)):
+        if image_info is None:
+            # The stored result is about previous contents, so it is dropped rather
+            # than used to classify the file
+            summary['failed'] += 1
+            if file.pop('image_info', None) is not None:
+                file_updates.append(UpdateOne(
+                    {'_id': file['_id']}, {'$unset': {'image_info': ''}}))
+            continue
+        file_updates.append(UpdateOne(
+            {'_id': file['_id']}, {'$set': {'image_info': image_info}}))
+    if file_updates:
+        File().collection.bulk_write(file_updates, ordered=False)
+
+    item_updates = []
+    for item, item_files in batch:
+        image_files = [{
+            'name': file['name'],
+            '_id': file['_id']
+        } for file in item_files if file.get('image_info', {}).get('readable')]
+        if image_files:
+            # Only add to the list, so uploads and removals handled meanwhile are kept
+            item_updates.append(UpdateOne(
+                {'_id': item['_id']},
+                {'$addToSet': {'segmentation.images': {'$each': image_files}}}))
+            summary['images'] += len(image_files)
+    if item_updates:
+        result = Item().collection.bulk_write(item_updates, ordered=False)
+        summary['updated'] += result.modified_count
+
+    summary['items'] += len(batch)
+    summary['files'] += len(files)
+    summary['probed'] += len(unprobed)
+    summary['skipped'] += len(files) - len(unprobed)
+
+
+def _load_cohort_comparison(id, user):
+    """
+    Load a cohort comparison, which only its creator and administrators can access.
+    """
+    comparison = CohortComparison().load(id, force=True, exc=True)
+    if comparison['creatorId'] != user['_id'] and not user.get('admin'):
+        raise AccessException('Access denied on the comparison')
+    return comparison
+
+
+def _cohort_candidates(reference, parent_type, parent_id, candidate_ids, user):
+    """
+    Get the segmentation files to compare with a reference.
+
+    :param reference: Girder file object of the reference
+    :param parent_type: 'item', 'folder', 'collection' or None
+    :param parent_id: ID of the parent whose segmentation images are used
+    :param candidate_ids: IDs of other files, or None
+    :param user: user who must have read access to the files and parents
+    :return: list of Girder file objects, without duplicates
+    """
+    candidates = {}
+    for file_id in candidate_ids or []:
+        file = File().load(file_id, user=user, level=AccessType.READ, exc=True)
+        candidates[file['_id']] = file
+    if parent_type:
+        if not parent_id:
+            raise ValidationException('A parent ID is required with a parent type', 'parentId')
+        parent = ModelImporter.model(parent_type).load(
+            parent_id, user=user, level=AccessType.READ, exc=True)
+        items = ([parent] if parent_type == 'item'
+                 else _walk_items(parent, parent_type, user, AccessType.READ))
+        for item in items:
+            segmentation = item.get('segmentation', {})
+            base_image_id = segmentation.get('base_image', {}).get('_id')
+            for image in segmentation.get('images', []):
+                if image['_id'] != base_image_id and image['_id'] not in candidates:
+                    file = File().load(image['_id'], force=True)
+                    if file:
+                        candidates[file['_id']] = file
+    candidates.pop(reference['_id'], None)
+    return list(candidates.values())
+
+
+def _run_cohort_comparison(comparison_id, user):
+    """
+    Run a queued cohort comparison, storing the metrics of each candidate as
+    soon as it is compared.
+    """
+    comparison = CohortComparison().load(comparison_id, force=True)
+    if comparison is None:
+        return
+    if comparison['cancel']:
+        CohortComparison().update_fields(comparison, status='canceled')
+        return
+    CohortComparison().update_fields(comparison, status='running')
+    total = comparison['progress']['total']
+    done = 0
+
+    def candidates():
+        for candidate in comparison['candidates']:
+            file = File().load(candidate['_id'], force=True)
+            if file is None:
+                record(candidate, None, ValidationException('File not found'))
+            else:
+                yield file, _local_image_path(file)
+
+    def record(file, metrics, error):
+        nonlocal done
+        if error is None:
+            CohortRow().add(comparison, file, metrics)
+        else:
+            logger.warning('Could not compare file %s: %s', file['_id'], error)
+            CohortComparison().add_failure(comparison, file, error)
+        done += 1
+        CohortComparison().update_fields(comparison, **{'progress.current': done})
+        progress.update(current=done, message=file['name'])
+
+    try:
+        reference = File().load(comparison['reference']['_id'], force=True)
+        if reference is None:
+            raise ValidationException('Reference file not found', 'reference_id')
+        title = 'Comparing segmentations with %s' % reference['name']
+        with ProgressContext(True, user=user, total=total, title=title) as progress:
+            reference_image, reference_array = _read_image_with_sitk(reference)
+            completed = compare_cohort(
+                reference_image, reference_array, candidates(), record,
+                lambda: CohortComparison().cancel_requested(comparison))
+        CohortComparison().update_fields(
+            comparison, status='completed' if completed else 'canceled')
+    except Exception as exc:
+        logger.exception('Cohort comparison %s failed', comparison['_id'])
+        CohortComparison().update_fields(comparison, status='failed', error=str(exc))
+
+    # Rows stored while the comparison was being removed
+    if CohortComparison().load(comparison['_id'], force=True) is None:
+        CohortRow().removeWithQuery({'comparisonId': comparison['_id']})
+
+
+# File handlers
+
+def _upload_handler(event):
+    """
+    Whenever a new file is added to an item, queue it to check if it is
+    readable by SimpleITK in the background, so uploads do not wait for it.
+    """
+    ingestion_queue.put(_ingest_file, event.info['file'], event.info.get('currentUser'))
+
+
+def _ingest_file(file):
+    """
+    Check if an uploaded file is readable by SimpleITK. If it is, add it to
+    the 'images' property of its segmentation item.
+    """
+    # The file may have been removed while it was queued
+    file = File().load(file['_id'], force=True)
+    if not file or not _is_readable_by_sitk(file):
+        return
+
+    # Only items with a segmentation property get the image, once
+    result = Item().update({
+        '_id': file['itemId'],
+        'segmentation': {'$exists': True},
+        'segmentation.images._id': {'$ne': file['_id']},
+    }, {'$push': {'segmentation.images': {
+        'name': file['name'],
+        '_id': file['_id']
+    }}}, multi=False)
+    if result.modified_count:
+        _schedule_pyramid(file)
+        events.trigger('segmentation_viewer.upload.success')
+
+
+def _deletion_handler(event):
+    """
+    Whenever a file is about to be removed, check if it was contained
+    within the 'images' property. If it is, remove it.
+    """
+    file = event.info
+    volume_cache.invalidate(file['_id'])
+    volume_store.invalidate(file['_id'])
+    SegmentationResult().invalidate(file)
+
+    result = Item().update({
+        '_id': file['itemId'],
+        'segmentation.images._id': file['_id'],
+    }, {'$pull': {'segmentation.images': {'_id': file['_id']}}}, multi=False)
+    if not result.modified_count:
+        return
+
+    # Remove the property entirely if the list is empty
+    Item().update({
+        '_id': file['itemId'],
+        'segmentation.images': {'$size': 0},
+    }, {'$unset': {'segmentation.images': ''}}, multi=False)
     events.trigger('segmentation_viewer.file.remove.success')
 
+
+def _file_save_handler(event):
+    """
+    Whenever a file is saved, drop the results and cached volumes computed
+    from its previous contents.
+    """
+    SegmentationResult().invalidate(event.info, keep_content=True)
+    volume_cache.invalidate(event.info['_id'], keep_content=volume_key(event.info)[1])
+
+
+def _setting_handler(event):
+    """
+    Apply changes to the volume cache size, store path and size and profile path as soon
+    as the settings are saved.
+    """
+    if event.info['key'] == PluginSettings.VOLUME_CACHE_SIZE:
+        volume_cache.resize(event.info['value'] * 1024 ** 2)
+    elif event.info['key'] == PluginSettings.VOLUME_STORE_PATH:
+        volume_store.path = event.info['value']
+    elif event.info['key'] == PluginSettings.VOLUME_STORE_SIZE:
+        volume_store.resize(event.info['value'] * 1024 ** 2)
+    elif event.info['key'] == PluginSettings.PROFILE_PATH:
+        telemetry.profile_path = event.info['value']
+
 # Base image handlers
 
 def _update_base_image(event):
@@ -0,0 +1,158 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import SimpleITK as sitk
+
+
+class _ImageBuffer:
+    """
+    Exposes the pixel buffer of a SimpleITK image to numpy as a read-only
+    array, keeping the image alive for as long as the array is.
+    """
+
+    def __init__(self, image):
+        self.image = image
+        view = sitk.GetArrayViewFromImage(image)
+        pointer = view.__array_interface__['data'][0]
+        self.__array_interface__ = dict(view.__array_interface__, data=(pointer, True))
+
+
+def image_array(image):
+    """
+    Get a read-only numpy array sharing the pixel buffer of a SimpleITK image.
+
+    :param image: SimpleITK image
+    :return: numpy array
+    """
+    return np.asarray(_ImageBuffer(image))
+
+
+def volume_key(file):
+    """
+    Key identifying the contents of a Girder file.
+
+    :param file: Girder file object
+    :return: tuple (file ID, content hash or last update time)
+    """
+    return str(file['_id']), file.get('sha512') or str(file.get('updated'))
+
+
+class VolumeCache:
+    """
+    Thread-safe LRU cache of decoded volumes within a memory budget.
+
+    Entries are ``(sitk_image, numpy_array)`` tuples where the array shares the
+    image pixel buffer, so the size of an entry is the size of its array.
+    """
+
+    def __init__(self, max_bytes=0):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, file):
+        """
+        Get the decoded volume of a file if it is cached.
+
+        :param file: Girder file object
+        :return: tuple (sitk_image, numpy_array) or None
+        """
+        key = volume_key(file)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, file, image, array):
+        """
+        Store the decoded volume of a file, evicting the least recently used
+        entries that do not fit in the budget. Older versions of the same file
+        are dropped.
+
+        :param file: Girder file object
+        :param image: SimpleITK image
+        :param array: numpy array sharing the image pixel buffer
+        """
+        key = volume_key(file)
+        with self._lock:
+            self._remove(lambda k: k[0] == key[0])
+            if array.nbytes > self.max_bytes:
+                return
+            self._entries[key] = (image, array)
+            self._bytes += array.nbytes
+            self._evict()
+
+    def invalidate(self, file_id, keep_content=None):
+        """
+        Drop every cached version of a file, and the volumes derived from it.
+        Derived volumes are cached under IDs joining a prefix and the IDs of
+        the files they come from with colons, such as resampled volumes, and
+        under the contents of those files joined the same way.
+
+        :param file_id: Girder file ID
+        :param keep_content: content hash of the file whose volumes are kept,
+            to only drop those of its previous contents
+        """
+        file_id = str(file_id)
+
+        def stale(key):
+            if file_id not in key[0].split(':'):
+                return False
+            return keep_content is None or keep_content not in key[1]
+
+        with self._lock:
+            self._remove(stale)
+
+    def resize(self, max_bytes):
+        """
+        Change the memory budget, evicting entries if it shrinks.
+
+        :param max_bytes: memory budget in bytes
+        """
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """
+        Get the counters of the cache.
+
+        :return: dict
+        """
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+    def _remove(self, predicate):
+        for key in [k for k in self._entries if predicate(k)]:
+            self._bytes -= self._entries.pop(key)[1].nbytes
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._entries:
+            _, (_, array) = self._entries.popitem(last=False)
+            self._bytes -= array.nbytes
+            self.evictions += 1
+
+
+# Process-wide cache of decoded volumes
+volume_cache = VolumeCache()
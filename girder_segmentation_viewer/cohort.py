@@ -0,0 +1,246 @@
+import datetime
+import multiprocessing
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import ExitStack
+from multiprocessing import shared_memory
+
+import numpy as np
+import SimpleITK as sitk
+
+from girder.models.model_base import Model
+
+from .cache import image_array
+from .metrics import compare_segmentations
+from .resample import resample_volume, same_grid
+from .store import VolumeHeader
+
+# Candidates compared at once, each one in its own process
+COHORT_WORKERS = os.cpu_count() or 1
+
+# Candidates whose files are held open per worker, so workers never wait for a copy
+COHORT_QUEUED_PER_WORKER = 2
+
+# Seconds between checks of whether a comparison was canceled while candidates are compared
+COHORT_CANCEL_INTERVAL = 0.5
+
+COHORT_STATUSES = ['queued', 'running', 'completed', 'failed', 'canceled']
+
+# Reference volume of a worker process, a view of the shared memory it is attached to
+_reference_memory = None
+_reference = None
+
+
+class CohortComparison(Model):
+    """
+    A comparison of many candidate segmentations with one reference, run in
+    the background. Documents hold the status and progress of the job, and
+    the metrics of each candidate are stored as CohortRow documents as soon
+    as they are computed.
+    """
+
+    def initialize(self):
+        self.name = 'segmentation_viewer_cohort'
+        self.ensureIndices(['creatorId', 'reference._id'])
+
+    def validate(self, doc):
+        return doc
+
+    def create(self, reference, candidates, user):
+        """
+        :param reference: Girder file object of the reference segmentation
+        :param candidates: Girder file objects of the candidate segmentations
+        :param user: user creating the comparison
+        :return: the queued comparison
+        """
+        now = datetime.datetime.now(datetime.timezone.utc)
+        return self.save({
+            'creatorId': user['_id'],
+            'created': now,
+            'updated': now,
+            'reference': {'_id': reference['_id'], 'name': reference['name']},
+            'candidates': [{'_id': file['_id'], 'name': file['name']} for file in candidates],
+            'status': 'queued',
+            'progress': {'current': 0, 'total': len(candidates)},
+            'failures': [],
+            'cancel': False,
+        })
+
+    def update_fields(self, doc, **fields):
+        """
+        Set fields of a comparison, such as its status or progress.
+
+        :param doc: comparison
+        :param fields: values of the fields, by name. Dotted names set nested fields
+        """
+        fields['updated'] = datetime.datetime.now(datetime.timezone.utc)
+        self.update({'_id': doc['_id']}, {'$set': fields}, multi=False)
+
+    def add_failure(self, doc, file, error):
+        """
+        Record a candidate that could not be compared.
+        """
+        self.update({'_id': doc['_id']}, {'$push': {'failures': {
+            '_id': file['_id'], 'name': file['name'], 'error': str(error),
+        }}}, multi=False)
+
+    def request_cancel(self, doc):
+        """
+        Ask the job of a comparison to stop. Candidates being compared are
+        dropped, the metrics of the others are kept.
+        """
+        self.update_fields(doc, cancel=True)
+        doc['cancel'] = True
+
+    def cancel_requested(self, doc):
+        """
+        :return: whether the job of a comparison should stop, because it was
+            canceled or removed
+        """
+        current = self.findOne({'_id': doc['_id']}, fields=['cancel'])
+        return current is None or current['cancel']
+
+    def remove(self, doc, **kwargs):
+        CohortRow().removeWithQuery({'comparisonId': doc['_id']})
+        return super().remove(doc, **kwargs)
+
+
+class CohortRow(Model):
+    """
+    The metrics of a label of a candidate of a cohort comparison. The metrics
+    of the whole foreground of each candidate are stored with a null label.
+    """
+
+    def initialize(self):
+        self.name = 'segmentation_viewer_cohort_row'
+        self.ensureIndices([
+            ([('comparisonId', 1), ('fileName', 1), ('label', 1)], {}),
+            ([('comparisonId', 1), ('label', 1)], {}),
+        ])
+
+    def validate(self, doc):
+        return doc
+
+    def add(self, comparison, file, metrics):
+        """
+        Store the metrics of a candidate.
+
+        :param comparison: cohort comparison
+        :param file: Girder file object of the candidate
+        :param metrics: result of ``compare_segmentations``
+        """
+        rows = metrics['labels'] + [dict(metrics['overall'], label=None)]
+        self.collection.insert_many([dict(
+            row, comparisonId=comparison['_id'], fileId=file['_id'], fileName=file['name'],
+        ) for row in rows])
+
+
+def _attach_reference(name, shape, dtype):
+    """
+    Initialize a worker process with the reference volume in shared memory.
+    """
+    global _reference_memory, _reference
+    # Workers already run one per core
+    sitk.ProcessObject.SetGlobalDefaultNumberOfThreads(1)
+    _reference_memory = shared_memory.SharedMemory(name=name)
+    _reference = np.ndarray(shape, dtype=dtype, buffer=_reference_memory.buf)
+    _reference.flags.writeable = False
+
+
+def compare_candidate(path, reference_header):
+    """
+    Compare a candidate segmentation with the reference of the worker process.
+    Candidates on a different grid are resampled onto the grid of the reference.
+
+    :param path: path of the candidate, readable by SimpleITK
+    :param reference_header: dict of the VolumeHeader of the reference
+    :return: result of ``compare_segmentations``
+    """
+    target = VolumeHeader(**reference_header)
+    image = sitk.ReadImage(path)
+    array = image_array(image)
+    if not same_grid(image, target):
+        array = resample_volume(image, array, target, labels=True)
+    # Workers already run one per core, so the labels are not spread over threads
+    return compare_segmentations(_reference, array, target.GetSpacing(), parallel=False)
+
+
+def compare_cohort(reference_image, reference_array, candidates, on_result, canceled,
+                   workers=COHORT_WORKERS):
+    """
+    Compare candidate segmentations with a reference decoded once, in a pool
+    of processes sharing the memory of the reference volume.
+
+    :param reference_image: SimpleITK image or VolumeHeader of the reference
+    :param reference_array: numpy array of the reference
+    :param candidates: iterable of (key, context manager giving a path
+        readable by SimpleITK) tuples. Each context is entered right before
+        its candidate is queued and left once it is compared
+    :param on_result: function called with the key, metrics and exception of
+        each candidate as it is compared, in completion order. Either the
+        metrics or the exception is None
+    :param canceled: function without arguments returning whether to stop,
+        checked before queuing each candidate and while waiting for them. On
+        cancel, queued candidates are dropped and those being compared are
+        not waited for
+    :param workers: number of processes
+    :return: whether every candidate was compared, False when canceled
+    """
+    memory = shared_memory.SharedMemory(create=True, size=max(reference_array.nbytes, 1))
+    try:
+        np.ndarray(reference_array.shape, dtype=reference_array.dtype,
+                   buffer=memory.buf)[...] = reference_array
+        header = VolumeHeader.from_image(reference_image).to_dict()
+        # Forked workers would inherit the database connections and threads of the server
+        executor = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+            initializer=_attach_reference,
+            initargs=(memory.name, reference_array.shape, reference_array.dtype.str))
+        with ExitStack() as cleanup:
+            pending = {}
+            stopped = False
+            # The files of the candidates being compared are released once the workers stop
+            cleanup.callback(lambda: [paths.close() for _, paths in pending.values()])
+            cleanup.callback(
+                lambda: executor.shutdown(wait=not stopped, cancel_futures=True))
+            candidates = iter(candidates)
+            exhausted = False
+            while True:
+                while not exhausted and len(pending) < workers * COHORT_QUEUED_PER_WORKER:
+                    if canceled():
+                        stopped = True
+                        break
+                    try:
+                        key, path_context = next(candidates)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    paths = ExitStack()
+                    try:
+                        path = paths.enter_context(path_context)
+                    except Exception as exc:
+                        paths.close()
+                        on_result(key, None, exc)
+                        continue
+                    pending[executor.submit(compare_candidate, path, header)] = key, paths
+
+                if stopped or canceled():
+                    stopped = True
+                    for future in pending:
+                        future.cancel()
+                    return False
+                if not pending:
+                    return True
+                done, _ = wait(pending, timeout=COHORT_CANCEL_INTERVAL,
+                               return_when=FIRST_COMPLETED)
+                for future in done:
+                    key, paths = pending.pop(future)
+                    paths.close()
+                    try:
+                        metrics, error = future.result(), None
+                    except Exception as exc:
+                        metrics, error = None, exc
+                    on_result(key, metrics, error)
+    finally:
+        memory.close()
+        memory.unlink()
@@ -0,0 +1,89 @@
+import numpy as np
+
+from .overlay import CHUNK_SLICES
+
+# Categories of the voxels of a categorical difference
+BACKGROUND = 0
+AGREEMENT = 1
+ONLY_SEG1 = 2
+ONLY_SEG2 = 3
+MISMATCH = 4
+
+DIFF_CATEGORIES = {
+    'background': BACKGROUND,
+    'agreement': AGREEMENT,
+    'only_seg1': ONLY_SEG1,
+    'only_seg2': ONLY_SEG2,
+    'mismatch': MISMATCH,
+}
+
+# 'categories' gives the category of each voxel, 'mismatch' flags the voxels whose
+# labels differ and 'absolute' is the absolute difference of the labels
+DIFF_MODES = ['categories', 'mismatch', 'absolute']
+
+
+def diff_categories(seg1, seg2):
+    """
+    Categorize the voxels of two label arrays.
+
+    :param seg1: label array, or boolean mask
+    :param seg2: label array, or boolean mask with the same shape
+    :return: uint8 array of categories
+    """
+    labeled1 = seg1 != 0
+    labeled2 = seg2 != 0
+    categories = np.zeros(seg1.shape, dtype=np.uint8)
+    categories[labeled1 & ~labeled2] = ONLY_SEG1
+    categories[labeled2 & ~labeled1] = ONLY_SEG2
+    both = labeled1 & labeled2
+    same = seg1 == seg2
+    categories[both & same] = AGREEMENT
+    categories[both & ~same] = MISMATCH
+    return categories
+
+
+def absolute_difference(seg1, seg2):
+    """
+    Absolute difference of two arrays in their own data type, which cannot
+    wrap around for unsigned types.
+    """
+    return np.where(seg1 > seg2, seg1 - seg2, seg2 - seg1)
+
+
+def _diff_chunk(seg1, seg2, mode, label):
+    if label is not None:
+        seg1 = seg1 == label
+        seg2 = seg2 == label
+    if mode == 'categories':
+        return diff_categories(seg1, seg2)
+    if mode == 'mismatch' or label is not None:
+        # The absolute difference of two masks flags where they differ
+        return (seg1 != seg2).view(np.uint8)
+    return absolute_difference(seg1, seg2)
+
+
+def diff_volume(seg1_array, seg2_array, mode='categories', label=None,
+                chunk_slices=CHUNK_SLICES):
+    """
+    Compute the difference of two label volumes a few slices at a time,
+    without converting them.
+
+    :param seg1_array: label volume, or memory map
+    :param seg2_array: label volume with the same shape
+    :param mode: one of DIFF_MODES
+    :param label: only compare the voxels with this label in either volume
+    :param chunk_slices: number of slices per chunk
+    :return: numpy array, uint8 unless the mode is 'absolute' without a label
+    """
+    if mode not in DIFF_MODES:
+        raise ValueError('Unknown difference mode: %s' % mode)
+    if mode == 'absolute' and label is None:
+        dtype = np.result_type(seg1_array.dtype, seg2_array.dtype)
+    else:
+        dtype = np.uint8
+
+    diff = np.empty(seg1_array.shape, dtype=dtype)
+    for start in range(0, len(seg1_array), chunk_slices):
+        stop = start + chunk_slices
+        diff[start:stop] = _diff_chunk(seg1_array[start:stop], seg2_array[start:stop], mode, label)
+    return diff
@@ -0,0 +1,142 @@
+import numpy as np
+
+from .overlay import CHUNK_SLICES
+
+# Bins of the histogram of a whole volume, spanning its range
+HISTOGRAM_BINS = 1024
+
+# Bins of the histograms of the axial slices, each one merging adjacent volume bins
+SLICE_HISTOGRAM_BINS = 32
+
+# Window/level presets spanning percentiles of the intensities, by name
+WINDOW_PRESETS = {
+    '1-99': (1, 99),
+    '2-98': (2, 98),
+    '5-95': (5, 95),
+    'full': (0, 100),
+}
+
+# Preset the window of each slice is computed with
+SLICE_WINDOW_PRESET = '1-99'
+
+# Preset the web client levels base images with, and rendered planes default to
+DEFAULT_WINDOW_PRESET = '1-99'
+
+
+def value_range(array):
+    """
+    Get the minimum and maximum of a volume in a single pass, a few slices at a time.
+
+    :param array: intensity volume
+    :return: tuple of floats (minimum, maximum)
+    """
+    minimum, maximum = np.inf, -np.inf
+    for start in range(0, len(array), CHUNK_SLICES):
+        chunk = array[start:start + CHUNK_SLICES]
+        minimum = min(minimum, float(chunk.min()))
+        maximum = max(maximum, float(chunk.max()))
+    return minimum, maximum
+
+
+def _bin_indices(chunk, minimum, maximum, bins):
+    if maximum <= minimum:
+        return np.zeros(chunk.shape, dtype=np.intp)
+    scaled = np.subtract(chunk, minimum, dtype=np.float64)
+    scaled *= bins / (maximum - minimum)
+    indices = scaled.astype(np.intp)
+    # The maximum falls in the last bin
+    np.minimum(indices, bins - 1, out=indices)
+    return indices
+
+
+def percentiles(counts, minimum, maximum, values):
+    """
+    Estimate percentiles of a volume from its histogram, interpolating
+    linearly within bins.
+
+    :param counts: count of voxels in each bin, which evenly span the range
+    :param minimum: lower bound of the first bin
+    :param maximum: upper bound of the last bin
+    :param values: percentiles between 0 and 100
+    :return: numpy array of intensities
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    total = counts.sum()
+    if not total:
+        return np.full(len(values), float(minimum))
+    edges = np.linspace(minimum, maximum, len(counts) + 1)
+    cumulative = np.concatenate([[0], np.cumsum(counts)]) * (100 / total)
+    return np.interp(values, cumulative, edges)
+
+
+def _window(lower, upper):
+    return {'width': float(upper - lower), 'level': float((upper + lower) / 2)}
+
+
+def window_presets(counts, minimum, maximum):
+    """
+    :param counts: count of voxels in each bin, which evenly span the range
+    :return: dict mapping the name of each preset to its window width and level
+    """
+    bounds = percentiles(counts, minimum, maximum, [
+        value for preset in WINDOW_PRESETS.values() for value in preset])
+    return {name: _window(bounds[2 * row], bounds[2 * row + 1])
+            for row, name in enumerate(WINDOW_PRESETS)}
+
+
+def intensity_histogram(array):
+    """
+    Compute the histogram of a volume and of each of its axial slices in a
+    single counting pass, along with percentile window presets of the volume
+    and the window of each slice.
+
+    :param array: intensity volume, axial slices first
+    :return: dict with the range of the volume, the counts of its histogram
+        and its window presets, and under 'slices' the coarser counts and
+        the window of each slice
+    """
+    minimum, maximum = value_range(array)
+    slice_count = len(array)
+    slice_counts = np.zeros((slice_count, HISTOGRAM_BINS), dtype=np.int64)
+    for start in range(0, slice_count, CHUNK_SLICES):
+        chunk = array[start:start + CHUNK_SLICES]
+        # Count the voxels of each (slice, bin) pair with one bincount
+        keys = _bin_indices(chunk, minimum, maximum, HISTOGRAM_BINS)
+        keys += (np.arange(len(chunk)) * HISTOGRAM_BINS).reshape((-1,) + (1,) * (chunk.ndim - 1))
+        slice_counts[start:start + len(chunk)] = np.bincount(
+            keys.reshape(-1), minlength=len(chunk) * HISTOGRAM_BINS).reshape(len(chunk), -1)
+
+    counts = slice_counts.sum(axis=0)
+    lower, upper = WINDOW_PRESETS[SLICE_WINDOW_PRESET]
+    return {
+        'range': [minimum, maximum],
+        'counts': counts.tolist(),
+        'windows': window_presets(counts, minimum, maximum),
+        'slices': {
+            'counts': slice_counts.reshape(slice_count, SLICE_HISTOGRAM_BINS, -1).sum(
+                axis=2).tolist(),
+            'windows': [_window(*percentiles(row, minimum, maximum, [lower, upper]))
+                        for row in slice_counts],
+        },
+    }
+
+
+def histogram_header(histogram, start=None, stop=None):
+    """
+    Get the part of the histogram of a volume sent along with some of its
+    slices: the counts and window presets of the volume, and the counts and
+    windows of the axial slices in [start, stop).
+
+    :param histogram: result of ``intensity_histogram``
+    :param start: index of the first axial slice, or None to leave the slices out
+    :param stop: index past the last axial slice
+    :return: dict
+    """
+    header = {key: histogram[key] for key in ('range', 'counts', 'windows')}
+    if start is not None:
+        header['slices'] = {
+            'start': start,
+            'counts': histogram['slices']['counts'][start:stop],
+            'windows': histogram['slices']['windows'][start:stop],
+        }
+    return header
@@ -0,0 +1,85 @@
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from girder.utility.progress import ProgressContext
+
+logger = logging.getLogger(__name__)
+
+
+class IngestionQueue:
+    """
+    Background queue processing uploaded files off the request thread.
+
+    Files queued by the same user are processed in order by a single worker,
+    which reports its progress through a Girder progress notification for as
+    long as the user has pending files. Files of different users are
+    processed in parallel, up to the number of workers.
+    """
+
+    def __init__(self, max_workers=2):
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix='segmentation_ingest')
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._pending = {}
+
+    def put(self, task, file, user=None):
+        """
+        Queue a file.
+
+        :param task: function processing a Girder file object
+        :param file: Girder file object
+        :param user: user the progress is reported to, if any
+        """
+        key = user['_id'] if user else None
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is not None:
+                pending.append((task, file))
+                return
+            self._pending[key] = deque([(task, file)])
+        self._executor.submit(self._drain, key, user)
+
+    def join(self):
+        """
+        Wait until all the queued files are processed.
+        """
+        with self._idle:
+            self._idle.wait_for(lambda: not self._pending)
+
+    def _drain(self, key, user):
+        with self._lock:
+            pending = self._pending[key]
+        done = 0
+        try:
+            with ProgressContext(user is not None, user=user,
+                                 title='Detecting images in uploaded files') as progress:
+                while True:
+                    with self._idle:
+                        if not pending:
+                            # Files queued from now on start a new worker
+                            del self._pending[key]
+                            self._idle.notify_all()
+                            break
+                        task, file = pending.popleft()
+                        total = done + 1 + len(pending)
+
+                    progress.update(current=done, total=total, message=file['name'])
+                    try:
+                        task(file)
+                    except Exception:
+                        logger.exception('Could not ingest file %s', file['_id'])
+                    done += 1
+                progress.update(force=True, current=done, total=done)
+        except Exception:
+            logger.exception('Ingestion of uploaded files was interrupted')
+            with self._idle:
+                # The files left in the queue are dropped
+                if self._pending.get(key) is pending:
+                    del self._pending[key]
+                self._idle.notify_all()
+
+
+ingestion_queue = IngestionQueue()
@@ -0,0 +1,246 @@
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from girder.api.rest import setResponseHeader
+
+from .metrics import bounding_boxes, label_plane_counts
+from .overlay import LabelIndex
+from .transport import encode_header
+
+# Triangles of the surfaces of all the labels of a segmentation, shared by
+# the labels in proportion to the area of their surface
+MESH_TRIANGLES = 200000
+
+# Triangles of the surface of a single voxel, the coarsest mesh of a label
+MIN_LABEL_TRIANGLES = 12
+
+# Largest budget, which keeps the stored meshes well under the size limit of a document
+MAX_MESH_TRIANGLES = 500000
+
+# Workers extracting the surfaces of different labels
+_executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 1)
+
+# Corners of a cell of the voxel grid, as offsets in numpy order
+_CORNERS = np.array([(z, y, x) for z in (0, 1) for y in (0, 1) for x in (0, 1)])
+
+# Edges of a cell, as pairs of corners
+_EDGES = [(a, b) for a in range(8) for b in range(a + 1, 8)
+          if np.abs(_CORNERS[a] - _CORNERS[b]).sum() == 1]
+
+
+def boundary_faces(mask):
+    """
+    Count the faces between the voxels of a mask and the other voxels, each
+    of which gives two triangles of its surface.
+
+    :param mask: boolean array, padded or not
+    :return: number of faces
+    """
+    mask = np.pad(mask, 1)
+    return sum(int(np.count_nonzero(np.diff(mask, axis=axis))) for axis in range(3))
+
+
+def coarsen_mask(mask, stride):
+    """
+    Downsample a mask by blocks of ``stride`` voxels along each axis. A block
+    is set when most of its voxels are, or when any is if that leaves none set.
+
+    :param mask: boolean array
+    :param stride: size of the blocks
+    :return: boolean array
+    """
+    if stride == 1:
+        return mask
+    padded = np.pad(mask, [(0, -length % stride) for length in mask.shape])
+    blocks = padded.reshape([value for length in padded.shape
+                             for value in (length // stride, stride)])
+    counts = blocks.sum(axis=(1, 3, 5), dtype=np.int32)
+    coarse = counts * 2 >= stride ** 3
+    return coarse if coarse.any() else counts > 0
+
+
+def surface_net(mask):
+    """
+    Extract the surface of a mask as a triangle mesh with naive surface nets.
+
+    Like marching cubes, every cell of the voxel grid whose corners are not
+    all set or all unset gets a vertex, here at the mean of the midpoints of
+    its crossed edges. Every pair of neighboring voxels across the surface
+    then gives a quad joining the vertices of the four cells around it. Only
+    the cells on the surface are indexed, so memory stays proportional to
+    the area of the surface rather than to the size of the mask.
+
+    :param mask: boolean array
+    :return: tuple (float64 array of vertex positions in numpy index order,
+        int64 array of triangles as vertex indices, wound counterclockwise
+        seen from outside in index space)
+    """
+    mask = np.pad(mask, 1)
+    cells = tuple(length - 1 for length in mask.shape)
+
+    def corner(offset):
+        return mask[offset[0]:offset[0] + cells[0], offset[1]:offset[1] + cells[1],
+                    offset[2]:offset[2] + cells[2]]
+
+    active = np.zeros(cells, dtype=bool)
+    first = corner(_CORNERS[0])
+    for offset in _CORNERS[1:]:
+        active |= corner(offset) != first
+    cell_ids = np.flatnonzero(active)
+    indices = np.stack(np.unravel_index(cell_ids, cells), axis=1)
+
+    values = [mask[tuple((indices + offset).T)] for offset in _CORNERS]
+    sums = np.zeros(indices.shape)
+    counts = np.zeros(len(indices))
+    for a, b in _EDGES:
+        crossed = values[a] != values[b]
+        sums[crossed] += (_CORNERS[a] + _CORNERS[b]) / 2
+        counts += crossed
+    vertices = indices + sums / counts[:, None]
+
+    triangles = []
+    for axis in range(3):
+        u, v = (axis + 1) % 3, (axis + 2) % 3
+        lower = [slice(None)] * 3
+        upper = [slice(None)] * 3
+        lower[axis] = slice(None, -1)
+        upper[axis] = slice(1, None)
+        inside = mask[tuple(lower)]
+        points = np.stack(np.nonzero(inside != mask[tuple(upper)]), axis=1)
+        # The four cells around each crossed edge, counterclockwise around the axis
+        quad = []
+        for du, dv in ((0, 0), (1, 0), (1, 1), (0, 1)):
+            cell = points.copy()
+            cell[:, u] -= du
+            cell[:, v] -= dv
+            quad.append(np.searchsorted(cell_ids, np.ravel_multi_index(cell.T, cells)))
+        quad = np.stack(quad, axis=1)
+        # Faces point from the inside voxel to the outside one
+        outward_up = inside[tuple(points.T)]
+        quad[~outward_up] = quad[~outward_up, ::-1]
+        triangles += [quad[:, [0, 1, 2]], quad[:, [0, 2, 3]]]
+    return vertices, np.concatenate(triangles)
+
+
+def label_surface(mask, triangles):
+    """
+    Extract the surface of a mask within a triangle budget, coarsening the
+    mask by the smallest stride that fits the budget.
+
+    :param mask: boolean array
+    :param triangles: budget of triangles
+    :return: tuple (vertex positions in the numpy indices of the mask,
+        triangles, stride)
+    """
+    # Each face of the voxels gives two triangles, and coarsening by a stride
+    # divides the faces by about its square
+    stride = max(math.ceil(math.sqrt(2 * boundary_faces(mask) / max(triangles, 1))), 1)
+    while True:
+        vertices, faces = surface_net(coarsen_mask(mask, stride))
+        if len(faces) <= triangles or stride >= max(mask.shape):
+            break
+        stride += 1
+    # The voxels of the coarse mask are centered on their blocks
+    return (vertices - 1) * stride + (stride - 1) / 2, faces, stride
+
+
+def label_meshes(seg_array, spacing, origin, direction, triangles=MESH_TRIANGLES):
+    """
+    Extract the surface of every label of a segmentation as a triangle mesh
+    in physical space.
+
+    Each label is meshed within its bounding box, and labels are spread over
+    a thread pool. Every label gets at least the triangles of a single
+    voxel, and the rest of the budget is shared by the labels in proportion
+    to their surfaces. Labels whose surface exceeds their share are meshed
+    from a coarser grid. Only budgets below ``MIN_LABEL_TRIANGLES`` per label
+    are exceeded.
+
+    :param seg_array: label volume
+    :param spacing: spacing in SimpleITK order
+    :param origin: origin in SimpleITK order
+    :param direction: direction cosines matrix, flattened
+    :param triangles: budget of triangles of all the labels
+    :return: list of dicts with the label, the float32 (vertices, 3) array of
+        physical points in SimpleITK order, the uint32 (triangles, 3) array of
+        vertex indices, wound counterclockwise seen from outside, and the
+        stride of the grid it was meshed from, background excluded
+    """
+    index = LabelIndex(seg_array)
+    first, last = bounding_boxes(label_plane_counts(seg_array, index))
+    rows = [row for row, label in enumerate(index.labels.tolist()) if label != 0]
+    boxes = {row: tuple(slice(start, stop + 1) for start, stop in zip(first[row], last[row]))
+             for row in rows}
+
+    def mask(row):
+        return seg_array[boxes[row]] == index.labels[row]
+
+    faces = list(_executor.map(lambda row: boundary_faces(mask(row)), rows))
+    total = sum(faces)
+    spare = max(triangles - MIN_LABEL_TRIANGLES * len(rows), 0)
+    # Numpy indices to physical points, reversing the axes to SimpleITK order
+    transform = np.reshape(direction, (3, 3)) @ np.diag(spacing) @ np.eye(3)[::-1]
+    flip = np.linalg.det(transform) < 0
+
+    def mesh(row, label_faces):
+        vertices, faces, stride = label_surface(
+            mask(row), MIN_LABEL_TRIANGLES + spare * label_faces // total)
+        points = np.asarray(origin) + (vertices + first[row]) @ transform.T
+        if flip:
+            faces = faces[:, ::-1]
+        return {
+            'label': index.labels[row].item(),
+            'vertices': points.astype(np.float32),
+            'triangles': faces.astype(np.uint32),
+            'stride': stride,
+        }
+
+    return list(_executor.map(mesh, rows, faces))
+
+
+def mesh_body(meshes):
+    """
+    Serialize meshes as a binary body: the header prefix built by
+    ``encode_header``, whose 'labels' list gives the label, number of
+    vertices and triangles and stride of each mesh, followed by the
+    little-endian float32 vertices of every mesh and then their uint32
+    triangles, each padded to 8 bytes. Vertex indices start at 0 for each mesh.
+
+    :param meshes: result of ``label_meshes``
+    :return: bytes
+    """
+    header = {
+        'labels': [{
+            'label': mesh['label'],
+            'vertices': len(mesh['vertices']),
+            'triangles': len(mesh['triangles']),
+            'stride': mesh['stride'],
+        } for mesh in meshes],
+        'vertices': sum(len(mesh['vertices']) for mesh in meshes),
+        'triangles': sum(len(mesh['triangles']) for mesh in meshes),
+        'byteorder': 'little',
+    }
+    parts = [encode_header(header)]
+    for key, dtype in (('vertices', '<f4'), ('triangles', '<u4')):
+        part = b''.join(mesh[key].astype(dtype, copy=False).tobytes() for mesh in meshes)
+        parts += [part, b'\0' * (-len(part) % 8)]
+    return b''.join(parts)
+
+
+def mesh_response(body):
+    """
+    Build the response of the meshes of a segmentation.
+
+    :param body: bytes returned by ``mesh_body``
+    :return: generator function to be returned from a REST endpoint
+    """
+    setResponseHeader('Content-Type', 'application/octet-stream')
+    setResponseHeader('Content-Length', str(len(body)))
+
+    def stream():
+        yield body
+
+    return stream
@@ -0,0 +1,210 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import SimpleITK as sitk
+
+from .overlay import CHUNK_SLICES, LabelIndex
+
+# Surface distances of masks that have no boundary
+NO_DISTANCES = {'hausdorff': None, 'hd95': None, 'assd': None}
+
+# Workers computing the surface distances of different labels
+_executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 1)
+
+
+def label_plane_counts(seg_array, index):
+    """
+    Count the voxels of every label in each plane along each axis, in a single pass.
+
+    For each chunk of slices and each axis, the voxels are counted per
+    (plane, label) pair with one bincount.
+
+    :param seg_array: label volume
+    :param index: LabelIndex of the volume
+    :return: list with an int64 array of shape (planes, labels) per axis, in
+        numpy order
+    """
+    count = index.labels.size
+    counts = [np.zeros((length, count), dtype=np.int64) for length in seg_array.shape]
+    for start in range(0, len(seg_array), CHUNK_SLICES):
+        rows = index.rows(seg_array[start:start + CHUNK_SLICES])
+        for axis, length in enumerate(rows.shape):
+            shape = [1] * rows.ndim
+            shape[axis] = length
+            keys = rows + count * np.arange(length).reshape(shape)
+            planes = np.bincount(keys.reshape(-1), minlength=length * count)
+            if axis == 0:
+                counts[axis][start:start + length] += planes.reshape(length, count)
+            else:
+                counts[axis] += planes.reshape(length, count)
+    return counts
+
+
+def bounding_boxes(plane_counts):
+    """
+    :param plane_counts: counts of each label per plane, from ``label_plane_counts``
+    :return: tuple of (labels, axes) arrays with the first and last index of
+        each label along each axis
+    """
+    presence = [counts > 0 for counts in plane_counts]
+    first = np.stack([axis.argmax(axis=0) for axis in presence], axis=1)
+    last = np.stack([len(axis) - 1 - axis[::-1].argmax(axis=0) for axis in presence], axis=1)
+    return first, last
+
+
+def label_bounding_boxes(seg_array, index):
+    """
+    Get the bounding box of every label of a volume in a single pass.
+
+    :param seg_array: label volume
+    :param index: LabelIndex of the volume
+    :return: dict mapping each label to a tuple (first, last) of index arrays
+    """
+    first, last = bounding_boxes(label_plane_counts(seg_array, index))
+    return {label: (first[row], last[row]) for row, label in enumerate(index.labels.tolist())}
+
+
+def _union_box(*boxes):
+    boxes = [box for box in boxes if box is not None]
+    first = np.min([box[0] for box in boxes], axis=0)
+    last = np.max([box[1] for box in boxes], axis=0)
+    return tuple(slice(start, stop + 1) for start, stop in zip(first, last))
+
+
+def _contour_and_distance(mask, spacing):
+    """
+    Get the boundary voxels of a mask and the distance of every voxel to them.
+
+    :param mask: boolean array, padded so the object does not touch its border
+    :param spacing: spacing in SimpleITK order
+    :return: tuple (boolean contour array, distance array in physical units)
+    """
+    image = sitk.GetImageFromArray(mask.astype(np.uint8))
+    image.SetSpacing(spacing)
+    contour = sitk.BinaryContour(image, fullyConnected=True)
+    # The contour is its own boundary, so the distance map measures the distance to it
+    distance = sitk.SignedMaurerDistanceMap(
+        contour, insideIsPositive=False, squaredDistance=False, useImageSpacing=True)
+    return sitk.GetArrayFromImage(contour) > 0, np.abs(sitk.GetArrayFromImage(distance))
+
+
+def surface_distances(mask1, mask2, spacing):
+    """
+    Compute the symmetric surface distance metrics of two masks.
+
+    :param mask1: boolean array
+    :param mask2: boolean array with the same shape
+    :param spacing: spacing in SimpleITK order
+    :return: dict with hausdorff, hd95 and assd, None if either mask is empty
+    """
+    if not mask1.any() or not mask2.any():
+        return dict(NO_DISTANCES)
+
+    contour1, distance1 = _contour_and_distance(np.pad(mask1, 1), spacing)
+    contour2, distance2 = _contour_and_distance(np.pad(mask2, 1), spacing)
+    distances1 = distance2[contour1]
+    distances2 = distance1[contour2]
+
+    return {
+        'hausdorff': float(max(distances1.max(), distances2.max())),
+        'hd95': float(max(np.percentile(distances1, 95), np.percentile(distances2, 95))),
+        'assd': float((distances1.sum() + distances2.sum())
+                      / (distances1.size + distances2.size)),
+    }
+
+
+def overlap_metrics(count1, count2, intersection, voxel_volume):
+    """
+    Compute the overlap metrics of two masks from their voxel counts.
+
+    :return: dict with dice, jaccard, both volumes and their difference
+    """
+    union = count1 + count2 - intersection
+    volume1 = count1 * voxel_volume
+    volume2 = count2 * voxel_volume
+    return {
+        'dice': 2 * intersection / (count1 + count2) if count1 + count2 else None,
+        'jaccard': intersection / union if union else None,
+        'volume1': volume1,
+        'volume2': volume2,
+        'volume_difference': volume2 - volume1,
+        'relative_volume_difference': (volume2 - volume1) / volume1 if volume1 else None,
+    }
+
+
+def _intersection_counts(seg1_array, seg2_array, index):
+    """
+    Count the voxels of each label of seg1 that have the same label in seg2.
+    """
+    counts = np.zeros(index.labels.size, dtype=np.int64)
+    foreground = 0
+    for start in range(0, len(seg1_array), CHUNK_SLICES):
+        seg1 = seg1_array[start:start + CHUNK_SLICES]
+        seg2 = seg2_array[start:start + CHUNK_SLICES]
+        agreement = seg1[seg1 == seg2]
+        counts += np.bincount(index.rows(agreement), minlength=index.labels.size)
+        foreground += int(np.count_nonzero((seg1 != 0) & (seg2 != 0)))
+    return counts, foreground
+
+
+def compare_segmentations(seg1_array, seg2_array, spacing, parallel=True):
+    """
+    Compute per-label and overall comparison metrics of two segmentations.
+
+    Overlap metrics come from a single counting pass over both volumes.
+    Surface distances are computed from spacing-aware distance maps of the
+    label boundaries, cropped to the bounding box of each label, with labels
+    spread over a thread pool. The overall metrics compare the foregrounds.
+
+    :param seg1_array: label volume
+    :param seg2_array: label volume with the same shape
+    :param spacing: spacing in SimpleITK order
+    :param parallel: whether to spread the labels over the thread pool, or
+        compute them in the calling thread, such as in processes already
+        running one per core
+    :return: dict with a list of per-label metrics and the overall metrics
+    """
+    voxel_volume = float(np.prod(spacing))
+    index1 = LabelIndex(seg1_array)
+    index2 = LabelIndex(seg2_array)
+    boxes1 = label_bounding_boxes(seg1_array, index1)
+    boxes2 = label_bounding_boxes(seg2_array, index2)
+    counts1 = dict(zip(index1.labels.tolist(), index1.counts.tolist()))
+    counts2 = dict(zip(index2.labels.tolist(), index2.counts.tolist()))
+    intersections, foreground_intersection = _intersection_counts(seg1_array, seg2_array, index1)
+    intersections = dict(zip(index1.labels.tolist(), intersections.tolist()))
+
+    labels = [label for label in sorted(set(counts1) | set(counts2)) if label != 0]
+
+    def label_metrics(label):
+        box = _union_box(boxes1.get(label), boxes2.get(label))
+        metrics = overlap_metrics(
+            counts1.get(label, 0), counts2.get(label, 0), intersections.get(label, 0),
+            voxel_volume)
+        metrics.update(surface_distances(
+            seg1_array[box] == label, seg2_array[box] == label, spacing))
+        metrics['label'] = label
+        return metrics
+
+    def foreground_metrics():
+        metrics = overlap_metrics(
+            seg1_array.size - counts1.get(0, 0), seg2_array.size - counts2.get(0, 0),
+            foreground_intersection, voxel_volume)
+        if not labels:
+            metrics.update(NO_DISTANCES)
+            return metrics
+        box = _union_box(*[boxes.get(label) for boxes in (boxes1, boxes2) for label in labels])
+        metrics.update(surface_distances(seg1_array[box] != 0, seg2_array[box] != 0, spacing))
+        return metrics
+
+    if not parallel:
+        return {'labels': [label_metrics(label) for label in labels],
+                'overall': foreground_metrics()}
+
+    # The foreground is the largest task, start it first
+    overall = _executor.submit(foreground_metrics)
+    per_label = list(_executor.map(label_metrics, labels))
+    overall = overall.result()
+
+    return {'labels': per_label, 'overall': overall}
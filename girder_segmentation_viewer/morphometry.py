@@ -0,0 +1,89 @@
+import numpy as np
+
+from .metrics import bounding_boxes, label_plane_counts
+from .overlay import CHUNK_SLICES, LabelIndex
+
+
+def intensity_statistics(seg_array, base_array, index):
+    """
+    Compute the statistics of the intensities under every label in a single
+    pass, with one bincount per sum and unbuffered minimum and maximum
+    reductions, a few slices at a time.
+
+    :param seg_array: label volume
+    :param base_array: intensity volume with the same shape
+    :param index: LabelIndex of the label volume
+    :return: dict mapping mean, sd, min and max to float64 arrays ordered
+        like ``index.labels``
+    """
+    count = index.labels.size
+    sums = np.zeros(count)
+    squares = np.zeros(count)
+    minimum = np.full(count, np.inf)
+    maximum = np.full(count, -np.inf)
+    for start in range(0, len(seg_array), CHUNK_SLICES):
+        rows = index.rows(seg_array[start:start + CHUNK_SLICES]).reshape(-1)
+        values = base_array[start:start + CHUNK_SLICES].astype(np.float64).reshape(-1)
+        sums += np.bincount(rows, weights=values, minlength=count)
+        np.minimum.at(minimum, rows, values)
+        np.maximum.at(maximum, rows, values)
+        squares += np.bincount(rows, weights=np.square(values, out=values), minlength=count)
+
+    mean = sums / index.counts
+    variance = np.maximum(squares / index.counts - mean ** 2, 0)
+    return {'mean': mean, 'sd': np.sqrt(variance), 'min': minimum, 'max': maximum}
+
+
+def label_morphometrics(seg_array, spacing, origin, direction, base_array=None):
+    """
+    Measure every label of a segmentation at once: its voxel count, physical
+    volume, centroid and bounding box, and the statistics of the base image
+    intensities under it.
+
+    Everything comes from counts of the voxels of each label per plane along
+    each axis and from weighted bincounts, so the cost does not grow with the
+    number of labels.
+
+    :param seg_array: label volume
+    :param spacing: spacing in SimpleITK order
+    :param origin: origin in SimpleITK order
+    :param direction: direction cosines matrix, flattened
+    :param base_array: intensity volume on the grid of the segmentation, or
+        None to skip the intensity statistics
+    :return: dict with a list of per-label measures, background excluded.
+        Centroids are physical points, and bounding boxes an index and a size,
+        both in SimpleITK order
+    """
+    index = LabelIndex(seg_array)
+    plane_counts = label_plane_counts(seg_array, index)
+    first, last = bounding_boxes(plane_counts)
+    # Sum of the indices of the voxels of each label along each axis, in numpy order
+    sums = np.stack([np.arange(len(counts)) @ counts for counts in plane_counts], axis=1)
+    centroid_indices = (sums / index.counts[:, None])[:, ::-1]
+    points = (np.asarray(origin)
+              + (centroid_indices * spacing) @ np.reshape(direction, (3, 3)).T)
+    voxel_volume = float(np.prod(spacing))
+    intensity = None
+    if base_array is not None:
+        intensity = {key: values.tolist() for key, values in
+                     intensity_statistics(seg_array, base_array, index).items()}
+
+    labels = []
+    for row, (label, voxels, point, centroid_index, box_index, box_size) in enumerate(zip(
+            index.labels.tolist(), index.counts.tolist(), points.tolist(),
+            centroid_indices.tolist(), first[:, ::-1].tolist(),
+            (last - first + 1)[:, ::-1].tolist())):
+        if label == 0:
+            continue
+        measures = {
+            'label': label,
+            'voxels': voxels,
+            'volume': voxels * voxel_volume,
+            'centroid': point,
+            'centroid_index': centroid_index,
+            'bounding_box': {'index': box_index, 'size': box_size},
+        }
+        if intensity is not None:
+            measures['intensity'] = {key: values[row] for key, values in intensity.items()}
+        labels.append(measures)
+    return {'labels': labels}
@@ -0,0 +1,145 @@
+import numpy as np
+
+# Number of slices processed at once, which bounds the size of temporary arrays
+CHUNK_SLICES = 16
+
+# Largest label value mapped through a lookup table indexed by label
+MAX_TABLE_LABEL = 2 ** 16
+
+
+class LabelIndex:
+    """
+    Maps the voxels of a label volume to the position of their label in the
+    sorted list of labels present in the volume.
+
+    Non-negative integer labels are counted with ``np.bincount`` and mapped
+    with a lookup table, other labels fall back to ``np.unique``.
+    """
+
+    def __init__(self, seg_array):
+        integer = np.issubdtype(seg_array.dtype, np.integer) or seg_array.dtype == np.bool_
+        self._table = None
+        if integer and seg_array.size:
+            minimum, maximum = int(seg_array.min()), int(seg_array.max())
+            if minimum >= 0 and maximum < MAX_TABLE_LABEL:
+                counts = np.bincount(seg_array.reshape(-1), minlength=maximum + 1)
+                self.labels = np.flatnonzero(counts)
+                self.counts = counts[self.labels]
+                self._table = np.zeros(maximum + 1, dtype=np.intp)
+                self._table[self.labels] = np.arange(self.labels.size)
+                return
+        self.labels, self.counts = np.unique(seg_array, return_counts=True)
+
+    def rows(self, seg_chunk):
+        """
+        :param seg_chunk: part of the label volume
+        :return: position of the label of each voxel in ``labels``
+        """
+        if self._table is not None:
+            return np.take(self._table, seg_chunk)
+        return np.searchsorted(self.labels, seg_chunk)
+
+
+def normalize_to_uint8(array, minimum, maximum):
+    """
+    Scale intensities to the 0-255 range when they exceed it.
+
+    :param array: intensity array
+    :param minimum: minimum intensity of the whole volume
+    :param maximum: maximum intensity of the whole volume
+    :return: uint8 array
+    """
+    if maximum > 255:
+        scaled = np.subtract(array, minimum, dtype=np.float32)
+        scaled *= 255 / (maximum - minimum) if maximum > minimum else 0
+        return scaled.astype(np.uint8)
+    return array.astype(np.uint8)
+
+
+def overlay_table(labels):
+    """
+    Build the blending lookup table of a set of labels.
+
+    Each non-zero label blends the base image with white using an opacity
+    that grows with its rank, background leaves the base image unchanged.
+
+    :param labels: sorted labels present in the segmentation
+    :return: uint8 array of shape (len(labels), 256), indexed by label
+        position and normalized base intensity
+    """
+    values = np.arange(256, dtype=np.float32)
+    table = np.empty((len(labels), 256), dtype=np.uint8)
+    rank = 0
+    for row, label in enumerate(labels):
+        if label == 0:
+            table[row] = values
+            continue
+        alpha = 0.4 + (rank % len(labels)) * 0.05
+        table[row] = np.clip(values * (1 - alpha) + 255 * alpha, 0, 255)
+        rank += 1
+    return table
+
+
+def overlay_chunks(base_array, seg_array, chunk_slices=CHUNK_SLICES, value_range=None):
+    """
+    Overlay a segmentation on its base image, a few slices at a time.
+
+    :param base_array: intensity volume
+    :param seg_array: label volume with the same shape
+    :param chunk_slices: number of slices per chunk
+    :param value_range: (minimum, maximum) of the base image when already
+        known, such as from its histogram
+    :return: generator of uint8 overlay chunks
+    """
+    index = LabelIndex(seg_array)
+    table = overlay_table(index.labels)
+    if value_range is None:
+        minimum, maximum = base_array.min(), base_array.max()
+    else:
+        # Scalars of the volume type scale intensities exactly like its own extrema
+        minimum, maximum = (base_array.dtype.type(value) for value in value_range)
+
+    for start in range(0, len(base_array), chunk_slices):
+        stop = start + chunk_slices
+        base = normalize_to_uint8(base_array[start:stop], minimum, maximum)
+        yield table[index.rows(seg_array[start:stop]), base]
+
+
+def histogram_statistics(histogram):
+    """
+    Compute the statistics of a volume from the histogram of its values.
+
+    :param histogram: count of voxels per value, starting from 0
+    :return: dict with min, max, mean, sd and volume
+    """
+    values = np.flatnonzero(histogram)
+    size = int(histogram.sum())
+    if not size:
+        return {'min': None, 'max': None, 'mean': None, 'sd': None, 'volume': 0}
+
+    counts = histogram[values]
+    mean = float(np.dot(values, counts) / size)
+    variance = float(np.dot((values - mean) ** 2, counts) / size)
+    return {
+        'min': int(values[0]),
+        'max': int(values[-1]),
+        'mean': mean,
+        'sd': variance ** 0.5,
+        'volume': size,
+    }
+
+
+def overlay_quantification(base_array, seg_array, value_range=None):
+    """
+    Compute the statistics of the overlay of a segmentation on its base image
+    without holding the whole overlay in memory.
+
+    :param base_array: intensity volume
+    :param seg_array: label volume with the same shape
+    :param value_range: (minimum, maximum) of the base image when already known
+    :return: dict with min, max, mean, sd and volume
+    """
+    histogram = np.zeros(256, dtype=np.int64)
+    for chunk in overlay_chunks(base_array, seg_array, value_range=value_range):
+        histogram += np.bincount(chunk.reshape(-1), minlength=256)
+    return histogram_statistics(histogram)
@@ -0,0 +1,106 @@
+import re
+
+import SimpleITK as sitk
+
+# Number of bytes read from the start of a file to probe its header
+HEADER_PROBE_SIZE = 64 * 1024
+
+# Extensions of the formats SimpleITK can read
+IMAGE_EXTENSIONS = {
+    'nii', 'nia', 'hdr', 'img', 'nrrd', 'nhdr', 'mha', 'mhd', 'dcm', 'dicom', 'gipl',
+    'vtk', 'mnc', 'mnc2', 'pic', 'lsm', 'png', 'jpg', 'jpeg', 'bmp', 'tif', 'tiff', 'rec',
+}
+
+# Signatures found at a given offset in the formats SimpleITK can read
+IMAGE_SIGNATURES = [
+    (0, b'\x1f\x8b'),  # gzip, e.g. .nii.gz
+    (0, b'\\\x01\x00\x00'),  # NIfTI-1 header size, little-endian
+    (0, b'\x00\x00\x01\\'),  # NIfTI-1 header size, big-endian
+    (344, b'n+1\x00'),  # NIfTI-1 single file
+    (344, b'ni1\x00'),  # NIfTI-1 header/image pair
+    (4, b'n+2\x00'),  # NIfTI-2
+    (0, b'NRRD'),
+    (0, b'ObjectType'),  # MetaImage
+    (0, b'NDims'),  # MetaImage without object type
+    (128, b'DICM'),
+    (0, b'# vtk'),
+    (0, b'\x89PNG'),
+    (0, b'\xff\xd8\xff'),  # JPEG
+    (0, b'BM'),
+    (0, b'II*\x00'),  # little-endian TIFF
+    (0, b'MM\x00*'),  # big-endian TIFF
+    (0, b'\x89HDF'),  # MINC 2
+]
+
+
+# Signatures of the uncompressed NIfTI files, whose regions SimpleITK reads on their own
+NIFTI_SIGNATURES = [
+    (0, b'\\\x01\x00\x00'),  # NIfTI-1 header size, little-endian
+    (0, b'\x00\x00\x01\\'),  # NIfTI-1 header size, big-endian
+    (4, b'n+2\x00'),  # NIfTI-2
+]
+
+
+def has_image_extension(name):
+    """
+    Check if a file name has the extension of a format SimpleITK can read.
+
+    :param name: file name
+    :return: bool
+    """
+    parts = name.lower().split('.')[1:]
+    if parts and parts[-1] == 'gz':
+        parts.pop()
+    return bool(parts) and parts[-1] in IMAGE_EXTENSIONS
+
+
+def has_image_signature(head):
+    """
+    Check if the first bytes of a file match the signature of a format SimpleITK can read.
+
+    :param head: bytes from the start of the file
+    :return: bool
+    """
+    return any(head[offset:offset + len(signature)] == signature
+               for offset, signature in IMAGE_SIGNATURES)
+
+
+def supports_region_reading(head):
+    """
+    Check if SimpleITK can decode a region of a file without decoding the
+    whole volume, which holds for uncompressed NIfTI, NRRD and MetaImage files.
+
+    :param head: bytes from the start of the file
+    :return: bool
+    """
+    if head.startswith(b'NRRD'):
+        return not re.search(rb'^encoding:\s*(gz|gzip|bz2|bzip2)\s*$', head, re.M)
+    if head.startswith((b'ObjectType', b'NDims')):
+        return not re.search(rb'^CompressedData\s*=\s*True', head, re.M | re.I)
+    return any(head[offset:offset + len(signature)] == signature
+               for offset, signature in NIFTI_SIGNATURES)
+
+
+def read_image_information(path):
+    """
+    Read only the header of an image file with SimpleITK.
+
+    :param path: local path to the file, which may be truncated after its header
+    :return: dict with the image information, or None if SimpleITK cannot read it
+    """
+    reader = sitk.ImageFileReader()
+    reader.SetFileName(path)
+    try:
+        reader.ReadImageInformation()
+    except RuntimeError:
+        return None
+
+    return {
+        'dimension': reader.GetDimension(),
+        'size': list(reader.GetSize()),
+        'spacing': list(reader.GetSpacing()),
+        'origin': list(reader.GetOrigin()),
+        'direction': list(reader.GetDirection()),
+        'pixel_type': sitk.GetPixelIDValueAsString(reader.GetPixelIDValue()),
+        'components': reader.GetNumberOfComponents(),
+    }
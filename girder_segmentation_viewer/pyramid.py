@@ -0,0 +1,121 @@
+import numpy as np
+
+from .overlay import CHUNK_SLICES
+from .store import VolumeHeader
+
+# Volumes are not downsampled once all their dimensions are this small
+MIN_LEVEL_SIZE = 64
+
+
+def level_factors(shape):
+    """
+    Get the downsampling factor of each axis of a volume to build its next level.
+
+    :param shape: shape of the numpy array
+    :return: tuple of factors, 2 for axes longer than one voxel, 1 otherwise
+    """
+    return tuple(2 if length > 1 else 1 for length in shape)
+
+
+def level_count(shape):
+    """
+    Get the number of levels of the pyramid of a volume, including the full
+    resolution one.
+
+    :param shape: shape of the numpy array
+    :return: number of levels
+    """
+    count = 1
+    while max(shape) > MIN_LEVEL_SIZE:
+        shape = tuple(-(-length // factor) for length, factor in zip(shape, level_factors(shape)))
+        count += 1
+    return count
+
+
+def level_header(header, factors):
+    """
+    Get the spatial metadata of a downsampled volume. Each voxel covers a
+    block of voxels of the original volume and is centered on it.
+
+    :param header: SimpleITK image or VolumeHeader of the original volume
+    :param factors: downsampling factor of each axis of the numpy array
+    :return: VolumeHeader
+    """
+    header = VolumeHeader.from_image(header)
+    factors = np.array(factors[::-1])
+    size = -(-np.array(header.size) // factors)
+    spacing = np.array(header.spacing)
+    dimension = header.GetDimension()
+    direction = np.array(header.direction).reshape(dimension, dimension)
+    origin = np.array(header.origin) + direction @ (spacing * (factors - 1) / 2)
+    return VolumeHeader(size.tolist(), (spacing * factors).tolist(), origin.tolist(),
+                        header.direction)
+
+
+def _blocks(chunk, factors):
+    """
+    Reshape a chunk so the voxels of each block are along the last axis.
+    Chunks are padded by repeating their last voxels to a multiple of the
+    factors.
+    """
+    padding = [(0, -length % factor) for length, factor in zip(chunk.shape, factors)]
+    if any(after for _, after in padding):
+        chunk = np.pad(chunk, padding, mode='edge')
+    shape = []
+    for length, factor in zip(chunk.shape, factors):
+        shape += [length // factor, factor]
+    blocks = chunk.reshape(shape)
+    ndim = len(factors)
+    blocks = blocks.transpose(list(range(0, 2 * ndim, 2)) + list(range(1, 2 * ndim, 2)))
+    return blocks.reshape(blocks.shape[:ndim] + (-1,))
+
+
+def area_average(chunk, factors):
+    """
+    Downsample intensities by averaging the voxels of each block.
+
+    :param chunk: intensity array
+    :param factors: downsampling factor of each axis
+    :return: array with the same dtype
+    """
+    average = _blocks(chunk, factors).mean(axis=-1, dtype=np.float32)
+    if np.issubdtype(chunk.dtype, np.integer):
+        average = np.rint(average)
+    return average.astype(chunk.dtype)
+
+
+def label_mode(chunk, factors):
+    """
+    Downsample labels by keeping the most frequent label of each block, or
+    the first voxel of the block on ties.
+
+    :param chunk: label array
+    :param factors: downsampling factor of each axis
+    :return: array with the same dtype
+    """
+    blocks = _blocks(chunk, factors)
+    mode = blocks[..., 0].copy()
+    # Most blocks of a segmentation hold a single label, only the others are counted
+    mixed = (blocks != blocks[..., :1]).any(axis=-1)
+    mixed_blocks = blocks[mixed]
+    votes = (mixed_blocks[:, :, None] == mixed_blocks[:, None, :]).sum(axis=-1)
+    mode[mixed] = np.take_along_axis(mixed_blocks, votes.argmax(axis=-1)[:, None], axis=-1)[:, 0]
+    return mode
+
+
+def downsample_volume(header, array, labels, chunk_slices=CHUNK_SLICES):
+    """
+    Build the next level of the pyramid of a volume, a few slices at a time.
+
+    :param header: SimpleITK image or VolumeHeader of the volume
+    :param array: numpy array of the volume
+    :param labels: whether the volume holds labels rather than intensities
+    :param chunk_slices: number of slices per chunk, rounded up to the factor
+    :return: tuple (VolumeHeader, numpy array) of the downsampled volume
+    """
+    factors = level_factors(array.shape)
+    chunk_slices = -(-chunk_slices // factors[0]) * factors[0]
+    downsample = label_mode if labels else area_average
+    chunks = [downsample(array[start:start + chunk_slices], factors)
+              for start in range(0, len(array), chunk_slices)]
+    return level_header(header, factors), np.concatenate(chunks)
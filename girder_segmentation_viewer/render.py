@@ -0,0 +1,219 @@
+import colorsys
+import hashlib
+import io
+import json
+import struct
+import zlib
+
+import cherrypy
+import numpy as np
+
+from girder.api.rest import setResponseHeader
+from girder.exceptions import ValidationException
+
+try:
+    from PIL import Image
+except ImportError:  # WebP rendering needs the optional Pillow dependency
+    Image = None
+
+from .diff import AGREEMENT, MISMATCH, ONLY_SEG1, ONLY_SEG2
+from .histogram import DEFAULT_WINDOW_PRESET
+from .telemetry import span
+
+RENDER_FORMATS = ['png', 'webp']
+
+RENDER_MODES = ['image', 'labels', 'overlay']
+
+# Rendered planes only change with the files they come from, which the ETag
+# covers, so clients revalidate them after this many seconds
+RENDER_MAX_AGE = 300
+
+PNG_COMPRESSION = 6
+
+# Color of each label modulo its length, background excluded, with hues spread
+# by the golden ratio so consecutive labels stand apart
+LABEL_PALETTE = np.array([
+    [round(255 * c) for c in colorsys.hsv_to_rgb((k * 0.618033988749895) % 1, 0.75, 1.0)]
+    for k in range(255)
+], dtype=np.uint8)
+
+DIFF_PALETTE = np.zeros((256, 3), dtype=np.uint8)
+DIFF_PALETTE[AGREEMENT] = (0, 200, 0)
+DIFF_PALETTE[ONLY_SEG1] = (230, 40, 40)
+DIFF_PALETTE[ONLY_SEG2] = (40, 90, 230)
+DIFF_PALETTE[MISMATCH] = (240, 200, 0)
+
+
+def auto_window(plane, histogram=None):
+    """
+    Get the window of a plane the way the web client levels it: the default
+    preset of the histogram of its volume, or the range of the plane without one.
+
+    :param plane: intensity array
+    :param histogram: result of ``intensity_histogram`` for the volume of the plane
+    :return: tuple (window width, window level)
+    """
+    if histogram is not None:
+        window = histogram['windows'][DEFAULT_WINDOW_PRESET]
+        return window['width'], window['level']
+    if not plane.size:
+        return 0.0, 0.0
+    minimum, maximum = float(plane.min()), float(plane.max())
+    return maximum - minimum, (minimum + maximum) / 2
+
+
+def apply_window(plane, width, level):
+    """
+    Map intensities to grays through a window, clamping the values outside it.
+
+    :param plane: intensity array
+    :param width: width of the window
+    :param level: center of the window
+    :return: uint8 array
+    """
+    if width <= 0:
+        return np.where(plane > level, 255, 0).astype(np.uint8)
+    gray = np.subtract(plane, level - width / 2, dtype=np.float32)
+    gray *= 255 / width
+    np.clip(gray, 0, 255, out=gray)
+    return np.rint(gray).astype(np.uint8)
+
+
+def label_colors(labels):
+    """
+    Color the labels of a plane, black for the background.
+
+    :param labels: integer label array
+    :return: uint8 array with a trailing RGB axis
+    """
+    labels = np.asarray(labels)
+    colors = LABEL_PALETTE[(labels.astype(np.int64) - 1) % len(LABEL_PALETTE)]
+    colors[labels == 0] = 0
+    return colors
+
+
+def diff_colors(categories):
+    """
+    Color the categories of a difference plane, black for the background.
+
+    :param categories: uint8 array of categories
+    :return: uint8 array with a trailing RGB axis
+    """
+    return DIFF_PALETTE[categories]
+
+
+def blend(gray, colors, mask, opacity):
+    """
+    Blend colors over a gray plane where a mask is set.
+
+    :param gray: uint8 array
+    :param colors: uint8 array with a trailing RGB axis
+    :param mask: boolean array, where the colors are drawn
+    :param opacity: opacity of the colors between 0 and 1
+    :return: uint8 array with a trailing RGB axis
+    """
+    rgb = np.repeat(gray[..., None], 3, axis=-1)
+    blended = rgb[mask] * (1 - opacity) + colors[mask] * opacity
+    rgb[mask] = np.rint(blended).astype(np.uint8)
+    return rgb
+
+
+def encode_png(pixels):
+    """
+    Encode a plane as a PNG image. Every row uses the "up" filter, which
+    stores its difference with the previous row and compresses well for
+    smooth images and label maps alike.
+
+    :param pixels: uint8 array, with a trailing RGB axis for color images
+    :return: bytes
+    """
+    height, width = pixels.shape[:2]
+    color_type = 2 if pixels.ndim == 3 else 0
+    data = np.ascontiguousarray(pixels, dtype=np.uint8).reshape(height, -1)
+
+    rows = np.empty((height, data.shape[1] + 1), dtype=np.uint8)
+    rows[:, 0] = 2
+    rows[:, 1:] = data
+    rows[1:, 1:] -= data[:-1]
+
+    def chunk(tag, body):
+        return (struct.pack('>I', len(body)) + tag + body
+                + struct.pack('>I', zlib.crc32(tag + body) & 0xffffffff))
+
+    return b''.join([
+        b'\x89PNG\r\n\x1a\n',
+        chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, color_type, 0, 0, 0)),
+        chunk(b'IDAT', zlib.compress(rows.tobytes(), PNG_COMPRESSION)),
+        chunk(b'IEND', b''),
+    ])
+
+
+def encode_webp(pixels):
+    """
+    Encode a plane as a lossless WebP image.
+
+    :param pixels: uint8 array, with a trailing RGB axis for color images
+    :return: bytes
+    """
+    if Image is None:
+        raise ValidationException('WebP rendering requires Pillow', 'format')
+    buffer = io.BytesIO()
+    Image.fromarray(np.ascontiguousarray(pixels, dtype=np.uint8)).save(
+        buffer, 'WEBP', lossless=True)
+    return buffer.getvalue()
+
+
+def render_etag(*parts):
+    """
+    Build the ETag of a rendered plane from everything it depends on.
+
+    :param parts: JSON-serializable values, such as the volume keys of the
+        files and the rendering parameters
+    :return: quoted ETag
+    """
+    digest = hashlib.sha1(json.dumps(parts, default=str).encode('utf8')).hexdigest()
+    return '"%s"' % digest
+
+
+def cached_response(etag):
+    """
+    Set the caching headers of a rendered plane, and answer conditional
+    requests whose copy is still valid before any plane is read.
+
+    :param etag: ETag of the plane that would be rendered
+    :return: generator function of an empty 304 response, or None when the
+        plane has to be rendered
+    """
+    setResponseHeader('ETag', etag)
+    # Proxies and shared caches may store the planes too, but only serve them again
+    # for the same token, since each user's read access to the files is checked
+    setResponseHeader('Cache-Control', 'public, max-age=%d, must-revalidate' % RENDER_MAX_AGE)
+    setResponseHeader('Vary', 'Girder-Token, Cookie')
+    matches = [tag.strip() for tag in cherrypy.request.headers.get('If-None-Match', '').split(',')]
+    if etag not in matches and '*' not in matches:
+        return None
+    cherrypy.response.status = 304
+
+    def stream():
+        yield b''
+
+    return stream
+
+
+def image_response(pixels, image_format='png'):
+    """
+    Build the response of a rendered plane.
+
+    :param pixels: uint8 array, with a trailing RGB axis for color images
+    :param image_format: either 'png' or 'webp'
+    :return: generator function to be returned from a REST endpoint
+    """
+    with span('encode'):
+        body = encode_webp(pixels) if image_format == 'webp' else encode_png(pixels)
+    setResponseHeader('Content-Type', 'image/%s' % image_format)
+    setResponseHeader('Content-Length', str(len(body)))
+
+    def stream():
+        yield body
+
+    return stream
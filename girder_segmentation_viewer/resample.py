@@ -0,0 +1,99 @@
+import itertools
+
+import numpy as np
+import SimpleITK as sitk
+
+from .cache import image_array
+from .store import VolumeHeader
+
+# Largest difference between the spacing, origin or direction of two grids considered equal
+GRID_TOLERANCE = 1e-5
+
+
+def same_grid(header1, header2):
+    """
+    Check whether two images have the same voxel grid in physical space.
+
+    :param header1: SimpleITK image or VolumeHeader
+    :param header2: SimpleITK image or VolumeHeader
+    :return: whether their voxels are at the same physical positions
+    """
+    return (tuple(header1.GetSize()) == tuple(header2.GetSize())
+            and all(np.allclose(getter(header1), getter(header2), atol=GRID_TOLERANCE)
+                    for getter in (lambda h: h.GetSpacing(), lambda h: h.GetOrigin(),
+                                   lambda h: h.GetDirection())))
+
+
+def _index_matrix(header):
+    dimension = header.GetDimension()
+    direction = np.array(header.GetDirection()).reshape(dimension, dimension)
+    return direction @ np.diag(header.GetSpacing())
+
+
+def overlap_region(reference, moving, margin=0):
+    """
+    Get the region of a voxel grid that covers the physical extent of another image.
+
+    :param reference: SimpleITK image or VolumeHeader whose grid the region is taken from
+    :param moving: SimpleITK image or VolumeHeader
+    :param margin: number of voxels added around the region, within the grid bounds
+    :return: tuple (index, size) of the region, or None if the images do not overlap
+    """
+    moving_size = np.array(moving.GetSize())
+    # The extent of a voxel goes half a voxel past its center
+    corners = np.array(list(itertools.product(*[(-0.5, length - 0.5) for length in moving_size])))
+    physical = np.array(moving.GetOrigin()) + corners @ _index_matrix(moving).T
+    indices = np.linalg.solve(
+        _index_matrix(reference), (physical - np.array(reference.GetOrigin())).T).T
+
+    size = np.array(reference.GetSize())
+    first = np.maximum(np.ceil(indices.min(axis=0) - GRID_TOLERANCE).astype(int) - margin, 0)
+    last = np.minimum(np.floor(indices.max(axis=0) + GRID_TOLERANCE).astype(int) + margin,
+                      size - 1)
+    if np.any(last < first):
+        return None
+    return first.tolist(), (last - first + 1).tolist()
+
+
+def crop(header, array, region):
+    """
+    Crop a volume to a region of its grid.
+
+    :param header: SimpleITK image or VolumeHeader of the volume
+    :param array: numpy array of the volume
+    :param region: tuple (index, size) in SimpleITK order
+    :return: tuple (VolumeHeader, numpy array)
+    """
+    index, size = region
+    slices = tuple(slice(start, start + length) for start, length in zip(index, size))
+    return VolumeHeader.from_image(header).region(index, size), array[slices[::-1]]
+
+
+def resample_volume(moving, moving_array, target, labels):
+    """
+    Map a volume onto another voxel grid with SimpleITK. Only the part of the
+    moving volume that covers the target grid is converted to an image.
+
+    :param moving: SimpleITK image or VolumeHeader of the volume
+    :param moving_array: numpy array of the volume
+    :param target: SimpleITK image or VolumeHeader of the grid to map it to
+    :param labels: whether the volume holds labels, resampled with the nearest
+        neighbor instead of linear interpolation
+    :return: numpy array on the target grid, zero outside of the moving volume
+    """
+    target = VolumeHeader.from_image(target)
+    region = overlap_region(moving, target, margin=1)
+    if region is None:
+        return np.zeros(target.GetSize()[::-1], dtype=moving_array.dtype)
+
+    header, cropped = crop(moving, moving_array, region)
+    image = sitk.GetImageFromArray(np.ascontiguousarray(cropped))
+    image.SetSpacing(header.GetSpacing())
+    image.SetOrigin(header.GetOrigin())
+    image.SetDirection(header.GetDirection())
+
+    interpolator = sitk.sitkNearestNeighbor if labels else sitk.sitkLinear
+    resampled = sitk.Resample(
+        image, target.GetSize(), sitk.Transform(), interpolator, target.GetOrigin(),
+        target.GetSpacing(), target.GetDirection(), 0, image.GetPixelID())
+    return image_array(resampled)
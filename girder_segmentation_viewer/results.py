@@ -0,0 +1,92 @@
+import datetime
+
+from girder.models.model_base import Model
+
+from .cache import volume_key
+
+
+def result_key(kind, files):
+    """
+    Key identifying a result computed from the contents of some files.
+
+    :param kind: name of the computation
+    :param files: Girder file objects the result was computed from, in order
+    :return: string key
+    """
+    return '|'.join([kind] + [':'.join(volume_key(file)) for file in files])
+
+
+class SegmentationResult(Model):
+    """
+    Statistics and comparison results computed from the contents of files,
+    such as the quantification of an overlay or the metrics of a pair of
+    segmentations. Results are looked up by the (file ID, sha512) tuple of
+    every file they were computed from, and removed when one of those files
+    is removed or its contents change.
+    """
+
+    def initialize(self):
+        self.name = 'segmentation_viewer_result'
+        self.ensureIndices([
+            ('key', {'unique': True}),
+            'files._id',
+        ])
+
+    def validate(self, doc):
+        return doc
+
+    def get(self, kind, files):
+        """
+        Get a stored result.
+
+        :param kind: name of the computation
+        :param files: Girder file objects the result was computed from, in order
+        :return: the stored value, or None
+        """
+        doc = self.findOne({'key': result_key(kind, files)}, fields=['value'])
+        return doc['value'] if doc is not None else None
+
+    def put(self, kind, files, value):
+        """
+        Store a result, replacing any result of the same computation on the
+        same file contents.
+
+        :param kind: name of the computation
+        :param files: Girder file objects the result was computed from, in order
+        :param value: BSON serializable result
+        """
+        key = result_key(kind, files)
+        self.collection.update_one({'key': key}, {'$set': {
+            'kind': kind,
+            'files': [{'_id': file['_id'], 'content': volume_key(file)[1]} for file in files],
+            'value': value,
+            'created': datetime.datetime.now(datetime.timezone.utc),
+        }}, upsert=True)
+
+    def get_or_compute(self, kind, files, compute):
+        """
+        Get a stored result, computing and storing it if there is none.
+
+        :param kind: name of the computation
+        :param files: Girder file objects the result is computed from, in order
+        :param compute: function without arguments computing the result
+        :return: the result
+        """
+        value = self.get(kind, files)
+        if value is None:
+            value = compute()
+            self.put(kind, files, value)
+        return value
+
+    def invalidate(self, file, keep_content=False):
+        """
+        Remove the results computed from a file.
+
+        :param file: Girder file object
+        :param keep_content: only remove the results computed from other
+            contents of the file
+        """
+        match = {'_id': file['_id']}
+        if keep_content:
+            match['content'] = {'$ne': volume_key(file)[1]}
+        self.removeWithQuery({'files': {'$elemMatch': match}})
@@ -0,0 +1,63 @@
+import os
+import tempfile
+
+from girder.exceptions import ValidationException
+from girder.utility import setting_utilities
+
+
+class PluginSettings:
+    VOLUME_CACHE_SIZE = 'segmentation_viewer.volume_cache_size'
+    VOLUME_STORE_PATH = 'segmentation_viewer.volume_store_path'
+    VOLUME_STORE_SIZE = 'segmentation_viewer.volume_store_size'
+    PROFILE_PATH = 'segmentation_viewer.profile_path'
+
+
+@setting_utilities.default(PluginSettings.VOLUME_CACHE_SIZE)
+def _default_volume_cache_size():
+    # In megabytes
+    return 1024
+
+
+@setting_utilities.validator(PluginSettings.VOLUME_CACHE_SIZE)
+def _validate_volume_cache_size(doc):
+    if not isinstance(doc['value'], int) or doc['value'] < 0:
+        raise ValidationException(
+            'Volume cache size must be a non-negative number of megabytes.', 'value')
+
+
+@setting_utilities.default(PluginSettings.VOLUME_STORE_PATH)
+def _default_volume_store_path():
+    return os.path.join(tempfile.gettempdir(), 'girder_segmentation_viewer')
+
+
+@setting_utilities.validator(PluginSettings.VOLUME_STORE_PATH)
+def _validate_volume_store_path(doc):
+    # An empty path disables the store
+    if not isinstance(doc['value'], str):
+        raise ValidationException('Volume store path must be a string.', 'value')
+
+
+@setting_utilities.default(PluginSettings.VOLUME_STORE_SIZE)
+def _default_volume_store_size():
+    # In megabytes, the least recently used volumes are removed beyond it
+    return 10240
+
+
+@setting_utilities.validator(PluginSettings.VOLUME_STORE_SIZE)
+def _validate_volume_store_size(doc):
+    # Zero disables the store
+    if not isinstance(doc['value'], int) or doc['value'] < 0:
+        raise ValidationException(
+            'Volume store size must be a non-negative number of megabytes.', 'value')
+
+
+@setting_utilities.default(PluginSettings.PROFILE_PATH)
+def _default_profile_path():
+    # Profiling is disabled until a directory is set
+    return ''
+
+
+@setting_utilities.validator(PluginSettings.PROFILE_PATH)
+def _validate_profile_path(doc):
+    if not isinstance(doc['value'], str):
+        raise ValidationException('Profile path must be a string.', 'value')
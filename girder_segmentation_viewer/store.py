@@ -0,0 +1,241 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+from .cache import volume_key
+
+logger = logging.getLogger(__name__)
+
+# Suffix of the files being written, until they are renamed
+TEMPORARY_SUFFIX = '.tmp'
+
+
+class VolumeHeader:
+    """
+    Spatial metadata of a volume, with the same getters as a SimpleITK image
+    so it can stand in for one when the pixels come from somewhere else.
+    """
+
+    def __init__(self, size, spacing, origin, direction):
+        self.size = tuple(size)
+        self.spacing = tuple(spacing)
+        self.origin = tuple(origin)
+        self.direction = tuple(direction)
+
+    @classmethod
+    def from_image(cls, image):
+        """
+        :param image: SimpleITK image or VolumeHeader
+        :return: VolumeHeader
+        """
+        return cls(image.GetSize(), image.GetSpacing(), image.GetOrigin(), image.GetDirection())
+
+    def GetSize(self):
+        return self.size
+
+    def GetSpacing(self):
+        return self.spacing
+
+    def GetOrigin(self):
+        return self.origin
+
+    def GetDirection(self):
+        return self.direction
+
+    def GetDimension(self):
+        return len(self.size)
+
+    def region(self, index, size):
+        """
+        Get the header of a region of the volume.
+
+        :param index: index of the first voxel of the region
+        :param size: size of the region
+        :return: VolumeHeader
+        """
+        dimension = self.GetDimension()
+        direction = np.array(self.direction).reshape(dimension, dimension)
+        origin = np.array(self.origin) + direction @ (np.array(index) * np.array(self.spacing))
+        return VolumeHeader(size, self.spacing, origin.tolist(), self.direction)
+
+    def to_dict(self):
+        return {
+            'size': self.size,
+            'spacing': self.spacing,
+            'origin': self.origin,
+            'direction': self.direction,
+        }
+
+
+class VolumeStore:
+    """
+    Derived copies of decoded volumes as uncompressed NPY files in a local
+    directory, which are read back through memory maps so only the pages of
+    the slices actually used are loaded. Downsampled levels of a volume are
+    stored next to it.
+
+    The files are kept within a disk budget: reading a volume marks it as
+    recently used, and storing one removes the least recently used volumes
+    that no longer fit.
+    """
+
+    def __init__(self, path=None, max_bytes=None):
+        """
+        :param path: directory of the files, None or empty to disable the store
+        :param max_bytes: disk budget in bytes, None for no budget and 0 to
+            disable the store
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.path) and self.max_bytes != 0
+
+    def _prefix(self, file_id):
+        return os.path.join(self.path, str(file_id))
+
+    def _paths(self, file, level=0):
+        file_id, content = volume_key(file)
+        name = '%s-%s' % (self._prefix(file_id), hashlib.sha1(content.encode('utf8')).hexdigest())
+        if level:
+            name += '-level%d' % level
+        return name + '.npy', name + '.json'
+
+    def get(self, file, level=0):
+        """
+        Get the stored volume of a file.
+
+        :param file: Girder file object
+        :param level: pyramid level, 0 being the full resolution
+        :return: tuple (VolumeHeader, read-only memory-mapped numpy array) or None
+        """
+        if not self.enabled:
+            return None
+        array_path, header_path = self._paths(file, level)
+        try:
+            with open(header_path) as fp:
+                header = VolumeHeader(**json.load(fp))
+            array = np.load(array_path, mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+        try:
+            # The modification time of the voxels orders the volumes for eviction
+            os.utime(array_path)
+        except OSError:
+            pass
+        return header, array
+
+    def put(self, file, image, array, level=0):
+        """
+        Store the decoded volume of a file. Storing the full resolution
+        replaces older versions of the file and all their levels. Errors such
+        as a full disk are logged, the volume is then only left out.
+
+        :param file: Girder file object
+        :param image: SimpleITK image or VolumeHeader with the spatial metadata
+        :param array: numpy array
+        :param level: pyramid level, 0 being the full resolution
+        """
+        if not self.enabled:
+            return
+        array_path, header_path = self._paths(file, level)
+        temporary = []
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            if not level:
+                self.invalidate(file['_id'])
+
+            # Write to temporary files first so readers never see partial files. Their
+            # suffix keeps them out of the volumes counted and removed by the eviction
+            with tempfile.NamedTemporaryFile(
+                    dir=self.path, suffix=TEMPORARY_SUFFIX, delete=False) as tmp:
+                temporary.append(tmp.name)
+                np.save(tmp, array)
+            with tempfile.NamedTemporaryFile(
+                    'w', dir=self.path, suffix=TEMPORARY_SUFFIX, delete=False) as tmp:
+                temporary.append(tmp.name)
+                json.dump(VolumeHeader.from_image(image).to_dict(), tmp)
+            os.replace(temporary[0], array_path)
+            os.replace(temporary[1], header_path)
+        except OSError:
+            logger.exception('Could not store the volume of file %s', file['_id'])
+            for path in temporary:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            return
+        self._evict()
+
+    def resize(self, max_bytes):
+        """
+        Change the disk budget, removing volumes if it shrinks.
+
+        :param max_bytes: disk budget in bytes, None for no budget and 0 to
+            disable the store
+        """
+        self.max_bytes = max_bytes
+        if self.path:
+            self._evict()
+
+    def _evict(self):
+        """
+        Remove the least recently used volumes until the others fit in the budget.
+        """
+        if self.max_bytes is None:
+            return
+        with self._lock:
+            entries = []
+            for array_path in glob.glob(os.path.join(self.path, '*.npy')):
+                header_path = array_path[:-len('.npy')] + '.json'
+                try:
+                    stat = os.stat(array_path)
+                except OSError:
+                    continue
+                size = stat.st_size
+                try:
+                    size += os.path.getsize(header_path)
+                except OSError:
+                    pass
+                entries.append((stat.st_mtime, array_path, header_path, size))
+
+            entries.sort()
+            total = sum(entry[3] for entry in entries)
+            for _, array_path, header_path, size in entries:
+                if total <= self.max_bytes:
+                    break
+                # Readers holding a memory map of the file keep their pages
+                for path in (header_path, array_path):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                total -= size
+                self.evictions += 1
+
+    def invalidate(self, file_id):
+        """
+        Delete every stored version of a file.
+
+        :param file_id: Girder file ID
+        """
+        if not self.path:
+            return
+        for path in glob.glob(self._prefix(file_id) + '-*'):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+# Process-wide store of decoded volumes
+volume_store = VolumeStore()
@@ -0,0 +1,210 @@
+import contextvars
+import cProfile
+import functools
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import cherrypy
+
+logger = logging.getLogger(__name__)
+
+# Requests carrying this header are profiled when a profile directory is set
+PROFILE_HEADER = 'Segmentation-Viewer-Profile'
+
+_current_timing = contextvars.ContextVar('segmentation_viewer_timing', default=None)
+
+
+class RouteTiming:
+    """
+    Time spent in each stage of a request, such as copying the file out of the
+    assetstore, decoding it or serializing the response.
+    """
+
+    def __init__(self, route):
+        self.route = route
+        self.start = time.perf_counter()
+        self.stages = defaultdict(float)
+        self.response_bytes = 0
+
+    def add(self, stage, seconds):
+        self.stages[stage] += seconds
+
+    def finish(self):
+        """
+        Log the timing of the request and add it to the registry.
+        """
+        self.stages['total'] = time.perf_counter() - self.start
+        timing_registry.add(self)
+        logger.info(
+            '%s %s response_bytes=%d', self.route,
+            ' '.join('%s=%.4fs' % item for item in self.stages.items()), self.response_bytes,
+            extra={'segmentation_viewer_timing': {
+                'route': self.route,
+                'stages': dict(self.stages),
+                'response_bytes': self.response_bytes,
+            }})
+
+
+class TimingRegistry:
+    """
+    Thread-safe totals of the timings of every route, rendered in the
+    Prometheus text exposition format.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = defaultdict(lambda: [0, 0.0])
+        self._responses = defaultdict(lambda: [0, 0])
+
+    def add(self, timing):
+        with self._lock:
+            for stage, seconds in timing.stages.items():
+                totals = self._stages[timing.route, stage]
+                totals[0] += 1
+                totals[1] += seconds
+            totals = self._responses[timing.route]
+            totals[0] += 1
+            totals[1] += timing.response_bytes
+
+    def clear(self):
+        with self._lock:
+            self._stages.clear()
+            self._responses.clear()
+
+    def render(self, gauges=None):
+        """
+        :param gauges: dict of extra gauges, mapping metric names to values
+        :return: text in the Prometheus exposition format
+        """
+        lines = [
+            '# HELP segmentation_viewer_stage_seconds Time spent in each stage of the routes.',
+            '# TYPE segmentation_viewer_stage_seconds summary',
+        ]
+        with self._lock:
+            for (route, stage), (count, seconds) in sorted(self._stages.items()):
+                labels = '{route="%s",stage="%s"}' % (route, stage)
+                lines.append('segmentation_viewer_stage_seconds_count%s %d' % (labels, count))
+                lines.append('segmentation_viewer_stage_seconds_sum%s %.6f' % (labels, seconds))
+            lines += [
+                '# HELP segmentation_viewer_response_bytes Size of the responses of the routes.',
+                '# TYPE segmentation_viewer_response_bytes summary',
+            ]
+            for route, (count, size) in sorted(self._responses.items()):
+                labels = '{route="%s"}' % route
+                lines.append('segmentation_viewer_response_bytes_count%s %d' % (labels, count))
+                lines.append('segmentation_viewer_response_bytes_sum%s %d' % (labels, size))
+        for name, value in sorted((gauges or {}).items()):
+            lines += ['# TYPE %s gauge' % name, '%s %s' % (name, value)]
+        return '\n'.join(lines) + '\n'
+
+
+timing_registry = TimingRegistry()
+
+# Directory profiles are written to, profiling is disabled when it is empty
+profile_path = None
+
+# Only one profiler can be active at a time since Python 3.12
+_profile_lock = threading.Lock()
+
+
+@contextmanager
+def span(stage):
+    """
+    Time a stage of the current request. Does nothing outside of a timed route.
+
+    :param stage: name of the stage
+    """
+    timing = _current_timing.get()
+    if timing is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing.add(stage, time.perf_counter() - start)
+
+
+def _profiled():
+    return bool(profile_path) and bool(cherrypy.request.headers.get(PROFILE_HEADER))
+
+
+@contextmanager
+def _profiling(profile):
+    """
+    Profile a block unless another profiler is active, in which case the
+    block runs without being profiled instead of failing.
+
+    :param profile: cProfile.Profile or None
+    :return: context yielding whether the block is profiled
+    """
+    if profile is None or not _profile_lock.acquire(blocking=False):
+        yield False
+        return
+    profile.enable()
+    try:
+        yield True
+    finally:
+        profile.disable()
+        _profile_lock.release()
+
+
+def _dump_profile(profile, route):
+    os.makedirs(profile_path, exist_ok=True)
+    path = os.path.join(profile_path, '%s-%d.prof' % (route, time.time() * 1000))
+    profile.dump_stats(path)
+    logger.info('%s profile written to %s', route, path)
+
+
+def timed_route(route):
+    """
+    Decorate a route handler to time its stages. Streamed responses are timed
+    while they are sent, as the 'serialization' stage, and their size is
+    counted. Requests are profiled with cProfile when a profile directory is
+    set and they carry the profile header, unless another request is being
+    profiled at the same time.
+
+    :param route: name of the route in the logs and metrics
+    """
+    def decorator(fun):
+        @functools.wraps(fun)
+        def wrapped(*args, **kwargs):
+            timing = RouteTiming(route)
+            profile = cProfile.Profile() if _profiled() else None
+            token = _current_timing.set(timing)
+            try:
+                with _profiling(profile) as profiled:
+                    result = fun(*args, **kwargs)
+            except Exception:
+                timing.finish()
+                raise
+            finally:
+                _current_timing.reset(token)
+
+            if not callable(result):
+                timing.finish()
+                if profiled:
+                    _dump_profile(profile, route)
+                return result
+
+            def stream():
+                start = time.perf_counter()
+                streamed = False
+                try:
+                    with _profiling(profile) as streamed:
+                        for chunk in result():
+                            timing.response_bytes += memoryview(chunk).nbytes
+                            yield chunk
+                finally:
+                    if profiled or streamed:
+                        _dump_profile(profile, route)
+                    timing.add('serialization', time.perf_counter() - start)
+                    timing.finish()
+
+            return stream
+        return wrapped
+    return decorator
@@ -0,0 +1,270 @@
+import json
+import struct
+
+import numpy as np
+
+from girder.api.rest import setResponseHeader
+from girder.utility import JsonEncoder
+
+from .overlay import CHUNK_SLICES
+from .telemetry import span
+
+# Size of each chunk written to the response when streaming a voxel buffer
+CHUNK_SIZE = 1024 * 1024
+
+# Data types the web client can wrap in a typed array without conversion
+SUPPORTED_DTYPES = {
+    'uint8', 'int8', 'uint16', 'int16', 'uint32', 'int32', 'float32', 'float64'
+}
+
+# Fallbacks for data types JavaScript has no typed array for
+DTYPE_FALLBACKS = {
+    'bool': 'uint8',
+    'uint64': 'uint32',
+    'int64': 'int32',
+    'float16': 'float32',
+}
+
+
+def transport_dtype(dtype):
+    """
+    Get the little-endian data type a data type is sent as.
+
+    :param dtype: numpy data type
+    :return: numpy data type supported by the web client
+    """
+    name = dtype.name
+    if name not in SUPPORTED_DTYPES:
+        name = DTYPE_FALLBACKS.get(name, 'float64')
+    return np.dtype(name).newbyteorder('<')
+
+
+def to_transport_array(array):
+    """
+    Make an array suitable to be sent as a raw little-endian buffer.
+
+    No copy is made if the array is already C-contiguous, little-endian and
+    of a type supported by the web client.
+
+    :param array: numpy array
+    :return: C-contiguous little-endian numpy array
+    """
+    return np.ascontiguousarray(array, dtype=transport_dtype(array.dtype))
+
+
+def encode_header(header):
+    """
+    Serialize a volume header as the prefix of a binary volume response.
+
+    The prefix is a little-endian uint32 holding the length of the JSON
+    header, followed by the JSON header itself. The header is padded with
+    spaces so that the voxel buffer starts at an 8-byte aligned offset,
+    which allows the client to view it as a typed array directly.
+
+    :param header: JSON-serializable dict
+    :return: bytes
+    """
+    encoded = json.dumps(header, cls=JsonEncoder, allow_nan=False).encode('utf8')
+    padding = -(4 + len(encoded)) % 8
+    encoded += b' ' * padding
+    return struct.pack('<I', len(encoded)) + encoded
+
+
+def binary_volume_body(header, array):
+    """
+    Build the body of a binary volume: the header prefix built by
+    :func:`encode_header` followed by the raw voxel buffer of ``array``. The
+    buffer is produced a few slices at a time, converted to the transport
+    data type only when needed, so a request never holds more than one chunk
+    besides the volume itself.
+
+    :param header: dict with the spatial metadata of the volume
+    :param array: numpy array or memory map holding the voxels
+    :return: tuple (length of the body, generator function of its chunks)
+    """
+    dtype = transport_dtype(array.dtype)
+    header = dict(header, dtype=dtype.name, byteorder='little')
+    prefix = encode_header(header)
+
+    def stream():
+        yield prefix
+        planes = _volume_planes(array)
+        chunk_slices = max(CHUNK_SIZE // max(planes[0].size * dtype.itemsize, 1), 1)
+        for start in range(0, len(planes), chunk_slices):
+            chunk = np.ascontiguousarray(planes[start:start + chunk_slices], dtype=dtype)
+            yield memoryview(chunk.reshape(-1)).cast('B')
+
+    return len(prefix) + array.size * dtype.itemsize, stream
+
+
+def binary_volume_response(header, array):
+    """
+    Build a streamed binary response for a volume, see :func:`binary_volume_body`.
+
+    :param header: dict with the spatial metadata of the volume
+    :param array: numpy array or memory map holding the voxels
+    :return: generator function to be returned from a REST endpoint
+    """
+    length, stream = binary_volume_body(header, array)
+    setResponseHeader('Content-Type', 'application/octet-stream')
+    setResponseHeader('Content-Length', str(length))
+    return stream
+
+
+def _volume_planes(array):
+    """
+    View a volume as a stack of slices, matching how the web client splits it.
+    """
+    if array.ndim > 2:
+        return array.reshape((-1,) + array.shape[-2:])
+    return array.reshape((1,) + array.shape)
+
+
+def run_length_encode(array, chunk_slices=CHUNK_SLICES):
+    """
+    Run-length encode a volume slice by slice, a few slices at a time.
+    Runs never cross slices, so each slice can be decoded on its own.
+
+    :param array: numpy array holding the voxels
+    :param chunk_slices: number of slices per chunk
+    :return: tuple (index of the first run of each slice followed by the
+        number of runs, length of each run, value of each run)
+    """
+    planes = _volume_planes(array)
+    slice_runs, lengths, values = [np.zeros(1, dtype=np.uint32)], [], []
+    run_count = 0
+    for start in range(0, len(planes), chunk_slices):
+        chunk = planes[start:start + chunk_slices].reshape(-1, planes[0].size)
+        # A run starts at the beginning of each slice and wherever the value changes
+        run_starts = np.ones(chunk.shape, dtype=bool)
+        np.not_equal(chunk[:, 1:], chunk[:, :-1], out=run_starts[:, 1:])
+        rows, columns = np.nonzero(run_starts)
+        starts = rows * chunk.shape[1] + columns
+
+        lengths.append(np.diff(starts, append=chunk.size).astype(np.uint32))
+        values.append(chunk.reshape(-1)[starts])
+        slice_runs.append(run_count + np.cumsum(
+            np.bincount(rows, minlength=len(chunk)), dtype=np.uint32))
+        run_count += len(starts)
+
+    return (np.concatenate(slice_runs).astype(np.uint32), np.concatenate(lengths),
+            np.concatenate(values) if values else array.reshape(-1)[:0])
+
+
+def rle_volume_body(header, array):
+    """
+    Build the body of a run-length encoded volume, which is much smaller than
+    the voxel buffer for label volumes that are mostly background.
+
+    The body is the header prefix built by :func:`encode_header` followed by
+    the arrays returned by :func:`run_length_encode`, each padded to 8 bytes:
+    the uint32 index of the first run of each slice, the uint32 length of
+    each run and the value of each run.
+
+    :param header: dict with the spatial metadata of the volume
+    :param array: numpy array holding the voxels
+    :return: tuple (length of the body, generator function of its chunks)
+    """
+    # Only the run values are converted, the volume is encoded as it is
+    dtype = transport_dtype(array.dtype)
+    with span('encode'):
+        slice_runs, lengths, values = run_length_encode(array)
+    header = dict(header, dtype=dtype.name, byteorder='little', encoding='rle',
+                  runs=len(lengths))
+    parts = [encode_header(header)]
+    for part in (slice_runs, lengths, values.astype(dtype)):
+        part = part.astype(part.dtype.newbyteorder('<'), copy=False).tobytes()
+        parts += [part, b'\0' * (-len(part) % 8)]
+
+    def stream():
+        yield from parts
+
+    return sum(len(part) for part in parts), stream
+
+
+def rle_volume_response(header, array):
+    """
+    Build a binary response for a run-length encoded volume, see :func:`rle_volume_body`.
+
+    :param header: dict with the spatial metadata of the volume
+    :param array: numpy array holding the voxels
+    :return: generator function to be returned from a REST endpoint
+    """
+    length, stream = rle_volume_body(header, array)
+    setResponseHeader('Content-Type', 'application/octet-stream')
+    setResponseHeader('Content-Length', str(length))
+    return stream
+
+
+def bundle_response(header, parts):
+    """
+    Build a binary response holding several volumes, so they are sent in a
+    single round trip.
+
+    The body is the header prefix built by :func:`encode_header`, whose
+    'parts' list gives the name, offset and length of each volume, followed
+    by the body of each volume padded to 8 bytes. Offsets are counted from
+    the end of the prefix, and stay 8-byte aligned so the client can view
+    each voxel buffer as a typed array directly.
+
+    :param header: dict with the metadata shared by the volumes
+    :param parts: list of (name, (length, generator function)) tuples, as
+        returned by :func:`binary_volume_body` or :func:`rle_volume_body`
+    :return: generator function to be returned from a REST endpoint
+    """
+    offset = 0
+    descriptions = []
+    for name, (length, _) in parts:
+        descriptions.append({'name': name, 'offset': offset, 'length': length})
+        offset += length + (-length % 8)
+    prefix = encode_header(dict(header, parts=descriptions))
+
+    setResponseHeader('Content-Type', 'application/octet-stream')
+    setResponseHeader('Content-Length', str(len(prefix) + offset))
+
+    def stream():
+        yield prefix
+        for _, (length, part_stream) in parts:
+            yield from part_stream()
+            yield b'\0' * (-length % 8)
+
+    return stream
+
+
+def json_volume_response(header, array):
+    """
+    Build a streamed JSON response for a volume, one flat list of voxels per
+    slice. Slices are serialized one at a time instead of building the nested
+    lists of the whole volume.
+
+    :param header: dict with the spatial metadata of the volume
+    :param array: numpy array or memory map holding the voxels
+    :return: generator function to be returned from a REST endpoint
+    """
+    prefix = json.dumps(header, cls=JsonEncoder)[:-1]
+    setResponseHeader('Content-Type', 'application/json')
+
+    def stream():
+        yield (prefix + (', ' if header else '') + '"data": [').encode('utf8')
+        for k, array_slice in enumerate(_volume_planes(array)):
+            separator = ', ' if k else ''
+            yield (separator + json.dumps(array_slice.reshape(-1).tolist())).encode('utf8')
+        yield b']}'
+
+    return stream
+
+
+def volume_response(header, array, response_format='json'):
+    """
+    Build the response of a volume route in the requested format.
+
+    :param header: dict with the spatial metadata of the volume
+    :param array: numpy array holding the voxels
+    :param response_format: either 'json', 'binary' or 'rle'
+    :return: value to be returned from a REST endpoint
+    """
+    if response_format == 'binary':
+        return binary_volume_response(header, array)
+    if response_format == 'rle':
+        return rle_volume_response(header, array)
+    return json_volume_response(header, array)
@@ -8,7 +8,9 @@ import { restRequest } from '@girder/core/rest';
 import events from '@girder/core/events';
 import { wrap } from '@girder/core/utilities/PluginUtils';
 import { ItemView } from '@girder/core/views/body';
+import HierarchyWidget from '@girder/core/views/widgets/HierarchyWidget';
 
+import DetectImagesFolderTemplate from './templates/detectImagesFolder.pug';
 import DetectImagesItemTemplate from './templates/detectImagesItem.pug';
 import ItemBaseImageWidgetTemplate from './templates/itemBaseImageWidget.pug';
 
@@ -78,3 +80,42 @@ ItemView.prototype.events['click .g-detect-images-item'] = function () {
             });
         });
 };
+
+wrap(HierarchyWidget, 'render', function (render) {
+    render.call(this);
+
+    if (this.parentModel.resourceName === 'folder' &&
+            this.parentModel.getAccessLevel() >= AccessType.WRITE) {
+        this.$('.g-folder-actions-menu').append(DetectImagesFolderTemplate());
+    }
+    return this;
+});
+
+HierarchyWidget.prototype.events['click .g-detect-images-folder'] = function () {
+    restRequest({
+        method: 'POST',
+        url: 'segmentation/detect_images',
+        data: {
+            parentType: this.parentModel.resourceName,
+            parentId: this.parentModel.id
+        },
+        error: null
+    })
+        .done((summary) => {
+            events.trigger('g:alert', {
+                icon: 'ok',
+                text: `Found ${summary.images} images in ${summary.items} items ` +
+                    `(${summary.probed} files probed, ${summary.skipped} already known).`,
+                type: 'success',
+                timeout: 4000
+            });
+        })
+        .fail((resp) => {
+            events.trigger('g:alert', {
+                icon: 'cancel',
+                text: 'Could not detect images.',
+                type: 'danger',
+                timeout: 4000
+            });
+        });
+};
@@ -16,63 +16,408 @@ import View from '@girder/core/views/View';
 import SegItemTemplate from '../templates/segItem.pug';
 import '../stylesheets/segItem.styl';
 
-const ImageFileModel = FileModel.extend({
-    getImage: function (slice, isSeg, diffInfo, itemID) {
-        if (!this._image) {
-            // Cache the slice on the model
-            if (isSeg) {
-                return restRequest({
-                    url: `/segmentation/${this.id}/segmentation_data`,
-                    method: 'GET',
-                })
-                    .then((resp) => {
-                        console.log('[ImageFileModel::getImage] seg called with response of length: ', resp);
-                        this._image = resp;
-                        const slicedResp = Object.assign({}, resp);
-                        slicedResp.data = resp.data[slice];
-                        return slicedResp;
-                    });
-            } else if (diffInfo) {
-                // diffInfo should contain seg1_id and seg2_id
-                return restRequest({
-                    url: `/segmentation/diff_data/?seg1_id=${diffInfo.seg1_id}&seg2_id=${diffInfo.seg2_id}`,
-                    method: 'GET',
-                })
-                    .then((resp) => {
-                        console.log('[ImageFileModel::getImage] diff called with response: ', resp);
-                        this._image = resp;
-                        const slicedResp = Object.assign({}, resp);
-                        slicedResp.data = resp.data[slice];
-                        return slicedResp;
-                    });
-            } else {
-                return restRequest({
-                    url: `/segmentation/${itemID}/base_image_data`,
-                    method: 'GET',
-                })
-                    .then((resp) => {
-                        console.log('[ImageFileModel::getImage] base called with response of length: ', resp);
-                        this._image = resp;
-                        const slicedResp = Object.assign({}, resp);
-                        slicedResp.data = resp.data[slice];
-                        return slicedResp;
-                    });
+/**
+ * Build the decoders of binary responses. Everything they use is defined
+ * inside, so that their source also runs on its own in the decoding worker,
+ * which is why they avoid syntax compiled into shared helpers, such as
+ * destructuring.
+ */
+function volumeDecoders() {
+    const TYPED_ARRAYS = {
+        uint8: Uint8Array,
+        int8: Int8Array,
+        uint16: Uint16Array,
+        int16: Int16Array,
+        uint32: Uint32Array,
+        int32: Int32Array,
+        float32: Float32Array,
+        float64: Float64Array
+    };
+
+    /**
+     * Decode the run-length encoded voxels of an "rle" volume response: the
+     * uint32 index of the first run of each slice, the uint32 length of each
+     * run and the value of each run, each padded to 8 bytes.
+     */
+    function decodeRuns(header, buffer, offset, sliceSize, sliceCount) {
+        const TypedArray = TYPED_ARRAYS[header.dtype];
+        const sliceRuns = new Uint32Array(buffer, offset, sliceCount + 1);
+        offset += Math.ceil(sliceRuns.byteLength / 8) * 8;
+        const lengths = new Uint32Array(buffer, offset, header.runs);
+        offset += Math.ceil(lengths.byteLength / 8) * 8;
+        const values = new TypedArray(buffer, offset, header.runs);
+
+        // Typed arrays start zeroed, so only the runs of other values are filled
+        const voxels = new TypedArray(sliceSize * sliceCount);
+        for (let k = 0; k < sliceCount; k += 1) {
+            let position = k * sliceSize;
+            for (let run = sliceRuns[k]; run < sliceRuns[k + 1]; run += 1) {
+                if (values[run] !== 0) {
+                    voxels.fill(values[run], position, position + lengths[run]);
+                }
+                position += lengths[run];
+            }
+        }
+        return voxels;
+    }
+
+    /**
+     * Decode the JSON header at the start of a binary response.
+     *
+     * @returns {Object} The header, and the offset of what follows it.
+     */
+    function decodeHeader(buffer, offset) {
+        const headerLength = new DataView(buffer).getUint32(offset, true);
+        const header = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, offset + 4, headerLength)));
+        return { header: header, offset: offset + 4 + headerLength };
+    }
+
+    /**
+     * Decode a binary volume response: a little-endian uint32 with the length
+     * of a JSON header, the header itself, and then the raw voxel buffer, or
+     * its runs for "rle" responses.
+     *
+     * The voxel buffer is wrapped in a typed array without being copied, and
+     * `data` holds a view of it per slice so it can be indexed like the JSON
+     * response.
+     */
+    function decodeVolume(buffer, offset) {
+        const decoded = decodeHeader(buffer, offset || 0);
+        const header = decoded.header;
+        const sliceSize = header.shape[0] * header.shape[1];
+        const sliceCount = header.shape[2] || 1;
+        const voxels = header.encoding === 'rle'
+            ? decodeRuns(header, buffer, decoded.offset, sliceSize, sliceCount)
+            : new TYPED_ARRAYS[header.dtype](buffer, decoded.offset, sliceSize * sliceCount);
+
+        header.data = [];
+        for (let k = 0; k < sliceCount; k += 1) {
+            header.data.push(voxels.subarray(k * sliceSize, (k + 1) * sliceSize));
+        }
+        return header;
+    }
+
+    /**
+     * Decode a response holding several volumes: a JSON header listing the
+     * name, offset and length of each one, followed by the volumes.
+     *
+     * @returns {Object} The header, with `volumes` mapping names to decoded volumes.
+     */
+    function decodeBundle(buffer) {
+        const decoded = decodeHeader(buffer, 0);
+        const header = decoded.header;
+        header.volumes = {};
+        header.parts.forEach((part) => {
+            header.volumes[part.name] = decodeVolume(buffer, decoded.offset + part.offset);
+        });
+        return header;
+    }
+
+    return { decodeVolume: decodeVolume, decodeBundle: decodeBundle };
+}
+
+const decoders = volumeDecoders();
+
+// The worker decodes a response and hands back the buffers holding the voxels
+// of its volumes without copying them
+const DECODE_WORKER_SOURCE = `
+const decoders = (${volumeDecoders.toString()})();
+self.onmessage = function (event) {
+    const request = event.data;
+    try {
+        const decoded = request.bundle
+            ? decoders.decodeBundle(request.buffer) : decoders.decodeVolume(request.buffer);
+        const volumes = request.bundle
+            ? Object.keys(decoded.volumes).map(function (name) { return decoded.volumes[name]; })
+            : [decoded];
+        const buffers = [];
+        volumes.forEach(function (volume) {
+            if (buffers.indexOf(volume.data[0].buffer) < 0) {
+                buffers.push(volume.data[0].buffer);
             }
+        });
+        self.postMessage({ id: request.id, decoded: decoded }, buffers);
+    } catch (err) {
+        self.postMessage({ id: request.id, error: err.message });
+    }
+};
+`;
+
+let decodeWorker;
+let decodeCount = 0;
+const pendingDecodes = {};
+
+/**
+ * Get the worker decoding responses, or null when workers are unavailable,
+ * in which case responses are decoded on the main thread.
+ */
+function getDecodeWorker() {
+    if (decodeWorker !== undefined) {
+        return decodeWorker;
+    }
+    decodeWorker = null;
+    if (typeof Worker === 'undefined') {
+        return decodeWorker;
+    }
+    try {
+        const url = URL.createObjectURL(new Blob([DECODE_WORKER_SOURCE], { type: 'text/javascript' }));
+        decodeWorker = new Worker(url);
+    } catch (err) {
+        // Workers from blobs may be forbidden by the content security policy
+        return decodeWorker;
+    }
+    decodeWorker.onmessage = (event) => {
+        const pending = pendingDecodes[event.data.id];
+        delete pendingDecodes[event.data.id];
+        if (event.data.error) {
+            pending.reject(new Error(event.data.error));
+        } else {
+            pending.resolve(event.data.decoded);
+        }
+    };
+    decodeWorker.onerror = () => {
+        // Decode on the main thread from now on, the pending responses are
+        // lost with the worker and requested again
+        decodeWorker.terminate();
+        decodeWorker = null;
+        Object.keys(pendingDecodes).forEach((id) => {
+            pendingDecodes[id].reject(new Error('The decoding worker failed'));
+            delete pendingDecodes[id];
+        });
+    };
+    return decodeWorker;
+}
+
+/**
+ * Decode a binary response off the main thread. The buffer is transferred to
+ * the worker, so it must not be used afterwards.
+ */
+function decodeResponse(buffer, bundle) {
+    const worker = getDecodeWorker();
+    if (!worker) {
+        return bundle ? decoders.decodeBundle(buffer) : decoders.decodeVolume(buffer);
+    }
+    return new Promise((resolve, reject) => {
+        const id = decodeCount;
+        decodeCount += 1;
+        pendingDecodes[id] = { resolve: resolve, reject: reject };
+        worker.postMessage({ id: id, buffer: buffer, bundle: bundle }, [buffer]);
+    });
+}
+
+function requestBundle(url, params) {
+    return restRequest({
+        url: url,
+        method: 'GET',
+        data: params,
+        dataType: 'binary',
+        xhrFields: { responseType: 'arraybuffer' }
+    }).then((buffer) => decodeResponse(buffer, true));
+}
+
+function requestVolume(url, params) {
+    return restRequest({
+        url: url,
+        method: 'GET',
+        data: Object.assign({ format: 'binary' }, params),
+        dataType: 'binary',
+        xhrFields: { responseType: 'arraybuffer' }
+    }).then((buffer) => decodeResponse(buffer, false));
+}
+
+// Number of slices fetched per request, and how many slabs are kept around the current one
+const SLAB_SIZE = 8;
+const SLAB_RETENTION = 2;
+
+// Pyramid level painted while the full resolution slab of a slice loads, fetched by slabs
+// covering as many slices
+const PREVIEW_LEVEL = 2;
+const PREVIEW_SLAB_SIZE = Math.max(SLAB_SIZE >> PREVIEW_LEVEL, 1);
+
+// Rows of cohort comparisons shown per page, and how often running comparisons are polled
+const COHORT_PAGE_SIZE = 20;
+const COHORT_POLL_INTERVAL = 1000;
+
+// Window preset of the base image levels, spanning percentiles of the whole volume
+const DEFAULT_WINDOW_PRESET = '1-99';
+
+const ImageFileModel = FileModel.extend({
+    // Format of the volume responses
+    volumeFormat: 'binary',
+    // Whether the slabs come with the intensity histogram and window presets
+    histogram: true,
+
+    getImage: function (slice, onPreview) {
+        return this.getSlice(slice, onPreview);
+    },
+    /**
+     * Get a single axial slice, fetching only the slab that contains it.
+     *
+     * When the slab is not loaded yet and `onPreview` is given, it is called
+     * with the slice from a coarse level of the pyramid if that arrives first.
+     */
+    getSlice: function (slice, onPreview) {
+        const slab = Math.floor(slice / SLAB_SIZE);
+        this._loadedSlabs = this._loadedSlabs || {};
+        if (onPreview && !this._loadedSlabs[slab]) {
+            this._getPreview(slice)
+                .then((preview) => {
+                    if (!this._loadedSlabs[slab]) {
+                        onPreview(preview);
+                    }
+                }, () => {});
+        }
+        return this._getSlab(slab)
+            .then((slab) => {
+                const slicedResp = Object.assign({}, slab);
+                slicedResp.data = slab.data[slice - slab.start];
+                if (slab.histogram && slab.histogram.slices) {
+                    const slices = slab.histogram.slices;
+                    slicedResp.sliceWindow = slices.windows[slice - slices.start];
+                }
+                return slicedResp;
+            });
+    },
+    /**
+     * Fetch the slabs next to the one containing a slice and drop those far from it.
+     */
+    prefetch: function (slice) {
+        if (!this._slabs) {
+            return;
         }
-        
-        // When image is cached, return a resolved Promise to maintain consistency
-        console.log('[ImageFileModel::getImage] this._image: ', this._image);
-        const slicedResp = Object.assign({}, this._image);
-        slicedResp.data = this._image.data[slice];
-        return Promise.resolve(slicedResp);
+        const current = Math.floor(slice / SLAB_SIZE);
+        [current - 1, current + 1].forEach((slab) => {
+            if (slab >= 0 && (this._sliceCount === undefined || slab * SLAB_SIZE < this._sliceCount)) {
+                this._getSlab(slab);
+            }
+        });
+        Object.keys(this._slabs).forEach((slab) => {
+            if (Math.abs(slab - current) > SLAB_RETENTION) {
+                delete this._slabs[slab];
+                delete this._loadedSlabs[slab];
+            }
+        });
     },
     getSliceCount: function () {
-        return this._image.data.length;
+        return this._sliceCount;
+    },
+    /**
+     * Use a slab fetched along with other volumes, unless it was already
+     * requested. The slab is requested on its own if that fails.
+     */
+    seedSlab: function (slab, request) {
+        this._slabs = this._slabs || {};
+        if (!this._slabs[slab]) {
+            this._trackSlab(slab, request.then(null, () => this._requestSlab(slab)));
+        }
+    },
+    _getSlab: function (slab) {
+        this._slabs = this._slabs || {};
+        if (!this._slabs[slab]) {
+            this._trackSlab(slab, this._requestSlab(slab));
+        }
+        return this._slabs[slab];
+    },
+    _requestSlab: function (slab) {
+        return requestVolume(`/segmentation/${this.id}/slab`, {
+            start: slab * SLAB_SIZE,
+            stop: (slab + 1) * SLAB_SIZE,
+            axis: 'axial',
+            format: this.volumeFormat,
+            histogram: this.histogram
+        });
+    },
+    _trackSlab: function (slab, request) {
+        this._slabs[slab] = request
+            .then((resp) => {
+                this._sliceCount = resp.volume_shape[2] || 1;
+                this._loadedSlabs = this._loadedSlabs || {};
+                this._loadedSlabs[slab] = true;
+                return resp;
+            }, (err) => {
+                // Allow the slab to be requested again
+                delete this._slabs[slab];
+                throw err;
+            });
+    },
+    /**
+     * Get a slice from a coarse level of the pyramid. Coarse slabs are small
+     * and kept for as long as the model.
+     */
+    _getPreview: function (slice) {
+        const previewSlab = Math.floor((slice >> PREVIEW_LEVEL) / PREVIEW_SLAB_SIZE);
+        this._previews = this._previews || {};
+        if (!this._previews[previewSlab]) {
+            this._previews[previewSlab] = requestVolume(`/segmentation/${this.id}/slab`, {
+                start: previewSlab * PREVIEW_SLAB_SIZE,
+                stop: (previewSlab + 1) * PREVIEW_SLAB_SIZE,
+                axis: 'axial',
+                level: PREVIEW_LEVEL,
+                format: this.volumeFormat,
+                histogram: this.histogram
+            })
+                .then(null, (err) => {
+                    delete this._previews[previewSlab];
+                    throw err;
+                });
+        }
+        return this._previews[previewSlab]
+            .then((preview) => {
+                // A finer level is returned until the pyramid is built
+                const plane = Math.min((slice >> preview.level) - preview.start, preview.data.length - 1);
+                const slicedResp = Object.assign({}, preview);
+                slicedResp.data = preview.data[plane];
+                return slicedResp;
+            });
+    },
+    /**
+     * Get the quantification of a segmentation, computed over the whole volume.
+     */
+    getQuantification: function () {
+        if (!this._quantification) {
+            this._quantification = requestVolume(`/segmentation/${this.id}/segmentation_data`, { format: 'rle' })
+                .then((resp) => resp.quantification);
+        }
+        return this._quantification;
+    },
+    /**
+     * Use a quantification fetched along with other volumes, unless it was
+     * already requested.
+     */
+    seedQuantification: function (request) {
+        if (!this._quantification) {
+            this._quantification = request.then(null, () => {
+                delete this._quantification;
+                return this.getQuantification();
+            });
+        }
+    }
+});
+
+// Label volumes are mostly background, so they are sent run-length encoded
+const LabelFileModel = ImageFileModel.extend({
+    volumeFormat: 'rle',
+    histogram: false
+});
+
+/**
+ * The categorical difference of two segmentations, `seg1_id` and `seg2_id`,
+ * fetched by slabs like the files.
+ */
+const DiffFileModel = LabelFileModel.extend({
+    _requestSlab: function (slab) {
+        return requestVolume('/segmentation/diff_data', {
+            seg1_id: this.get('seg1_id'),
+            seg2_id: this.get('seg2_id'),
+            start: slab * SLAB_SIZE,
+            stop: (slab + 1) * SLAB_SIZE,
+            format: this.volumeFormat
+        });
     }
 });
 
 const ImageFileCollection = FileCollection.extend({
-    model: ImageFileModel,
+    model: LabelFileModel,
     initialize: function () {
         FileCollection.prototype.initialize.apply(this, arguments);
 
@@ -97,14 +442,20 @@ const SegImageWidget = View.extend({
         console.log('[SegImageWidget::initialize] settings: ', settings);
         this._image = null;
         this._slice = 0;
+        this._renderFrame = null;
         this.vtk = {
             renderer: null,
             actor: null,
+            mapper: null,
+            imageData: null,
             camera: null,
             interactor: null
         };
     },
     destroy: function () {
+        if (this._renderFrame) {
+            window.cancelAnimationFrame(this._renderFrame);
+        }
         if (this.vtk.interactor) {
             this.vtk.interactor.unbindEvents(this.el);
         }
@@ -139,12 +490,15 @@ const SegImageWidget = View.extend({
         this.vtk.actor = vtkImageSlice.newInstance();
         this.vtk.renderer.addActor(this.vtk.actor);
 
+        // The image data and mapper are kept for the life of the view, slices
+        // are copied into the scalars of the image data
+        this.vtk.imageData = vtkImageData.newInstance();
+        this.vtk.imageData.setOrigin(0, 0, 0);
+        this.vtk.mapper = vtkImageMapper.newInstance();
+        this.vtk.mapper.setInputData(this.vtk.imageData);
+
         if (this._image) {
-            const mapper = vtkImageMapper.newInstance();
-            mapper.setInputData(this._getImageData());
-            console.log('[SegImageWidget::render] mapper: ', mapper);
-            this.vtk.actor.setMapper(mapper);
-            console.log('[SegImageWidget::render] this.vtk.actor: ', this.vtk.actor);
+            this._updateImageData();
         }
 
         this.vtk.camera = this.vtk.renderer.getActiveCameraAndResetIfCreated();
@@ -162,28 +516,58 @@ const SegImageWidget = View.extend({
         return this;
     },
     /**
-     * Cheaply update the rendering, usually after `setSlice` is called.
+     * Cheaply update the rendering, usually after `setImage` is called.
      */
     rerenderSlice: function () {
         if (this.vtk.renderer) {
             if (this._image) {
-                const mapper = vtkImageMapper.newInstance();
-                mapper.setInputData(this._getImageData());
-                this.vtk.actor.setMapper(mapper);
+                this._updateImageData();
             }
-            this.vtk.interactor.render();
+            this.requestRender();
         } else {
             this.render();
         }
         return this;
     },
+    /**
+     * Render on the next animation frame, once however many times this is
+     * called before it.
+     */
+    requestRender: function () {
+        if (!this._renderFrame) {
+            this._renderFrame = window.requestAnimationFrame(() => {
+                this._renderFrame = null;
+                this.vtk.interactor.render();
+            });
+        }
+        return this;
+    },
     /**
      * Requires `render` to be called first.
      */
     autoLevels: function (rerender = true) {
-        const range = this._getImageData().getPointData().getScalars().getRange();
-        const ww = range[1] - range[0];
-        const wc = (range[0] + range[1]) / 2;
+        const scalars = this.vtk.imageData.getPointData().getScalars();
+        if (!scalars) {
+            return this;
+        }
+        // Images with a histogram get the same window on every slice and at
+        // every level, 'slice' fits the window to the current slice instead
+        const histogram = this._image && this._image.histogram;
+        let levels = null;
+        if (this.windowPreset === 'slice') {
+            levels = this._image && this._image.sliceWindow;
+        } else if (histogram) {
+            levels = histogram.windows[this.windowPreset || DEFAULT_WINDOW_PRESET];
+        }
+        let ww, wc;
+        if (levels) {
+            ww = levels.width;
+            wc = levels.level;
+        } else {
+            const range = scalars.getRange();
+            ww = range[1] - range[0];
+            wc = (range[0] + range[1]) / 2;
+        }
         this.vtk.actor.getProperty().setColorWindow(ww);
         this.vtk.actor.getProperty().setColorLevel(wc);
 
@@ -226,37 +610,34 @@ const SegImageWidget = View.extend({
         this.vtk.interactor.render();
         return this;
     },
-    _getImageData: function () {
-        let tags;
-        if (!SegImageWidget.imageDataCache.has(this._image)) {
-            tags = this._extractImageData();
-            SegImageWidget.imageDataCache.set(this._image, tags);
+    /**
+     * Copy the current slice into the image data, only allocating its
+     * scalars again when the type or size of the slices changes.
+     */
+    _updateImageData: function () {
+        const image = this._image;
+        const imageData = this.vtk.imageData;
+        const scalars = imageData.getPointData().getScalars();
+        const values = scalars && scalars.getData();
+        if (values && values.constructor === image.data.constructor &&
+                values.length === image.data.length) {
+            values.set(image.data);
+            // Setting the same array again drops the cached range of the scalars
+            scalars.setData(values, 1);
         } else {
-            return SegImageWidget.imageDataCache.get(this._image);
-        }
-        return tags;
-    },
-    _extractImageData: function () {
-        console.log('[SegImageWidget::_extractImageData] this._image: ', this._image);
-
-        const imageData = vtkImageData.newInstance();
-        // imageData.setOrigin(this._image.origin);
-        // imageData.setOrigin(0, 0);
-        imageData.setOrigin(0, 0, 0);
-        // imageData.setSpacing([1, 1, 1]); // Default spacing, can be overridden
-        imageData.setSpacing(this._image.spacing);
-        imageData.setExtent(0, this._image.shape[0] -1, 0, this._image.shape[1] - 1, 0, 1);
-        const dataArray = vtkDataArray.newInstance({ 
-            values: this._image.data,
-            // numberOfComponents: this._image.shape[3] || 1 // Handle grayscale or RGB images
-        });
+            imageData.getPointData().setScalars(vtkDataArray.newInstance({
+                name: 'scalars',
+                values: new image.data.constructor(image.data)
+            }));
+        }
+        imageData.setSpacing(image.spacing);
+        imageData.setExtent(0, image.shape[0] - 1, 0, image.shape[1] - 1, 0, 0);
+        imageData.modified();
 
-        console.log('[SegImageWidget::_extractImageData] number of components: ', this._image.shape);
-        imageData.getPointData().setScalars(dataArray);
-        return imageData;
+        if (!this.vtk.actor.getMapper()) {
+            this.vtk.actor.setMapper(this.vtk.mapper);
+        }
     }
-}, {
-    imageDataCache: new WeakMap()
 });
 
 const SegItemView = View.extend({
@@ -278,7 +659,7 @@ const SegItemView = View.extend({
             const slice = parseInt($(event.target).val());
             this._slice = slice;
             this.$('.g-slice-value').val(slice);
-            this._rerender();
+            this._scheduleRerender();
         },
         'change .g-slice-value': function (event) {
             let slice = parseInt($(event.target).val());
@@ -289,7 +670,7 @@ const SegItemView = View.extend({
             this._slice = slice;
             this.$('.g-slice-slider').val(slice);
             this.$('.g-slice-value').val(slice);
-            this._rerender();
+            this._scheduleRerender();
         },
         'click .g-seg-zoom-in': function (event) {
             event.preventDefault();
@@ -312,12 +693,37 @@ const SegItemView = View.extend({
             this._baseImageView.autoZoom();
             this._diffView.autoZoom();
         },
+        'change .g-seg-window-preset': function (event) {
+            this._baseImageView.windowPreset = $(event.target).val();
+            this._baseImageView.autoLevels();
+        },
         'click .g-seg-auto-levels': function (event) {
             event.preventDefault();
             this._seg1View.autoLevels();
             this._seg2View.autoLevels();
             this._baseImageView.autoLevels();
             this._diffView.autoLevels();
+        },
+        'click .g-seg-cohort-start': function (event) {
+            event.preventDefault();
+            this._startCohort();
+        },
+        'click .g-seg-cohort-cancel': function (event) {
+            event.preventDefault();
+            restRequest({
+                url: `segmentation/cohort/${this._cohort._id}/cancel`,
+                method: 'PUT'
+            });
+        },
+        'click .g-seg-cohort-previous': function (event) {
+            event.preventDefault();
+            this._cohortPage = Math.max(this._cohortPage - 1, 0);
+            this._loadCohortPage();
+        },
+        'click .g-seg-cohort-next': function (event) {
+            event.preventDefault();
+            this._cohortPage += 1;
+            this._loadCohortPage();
         }
     },
     /**
@@ -332,6 +738,8 @@ const SegItemView = View.extend({
         this._seg1Index = 0;
         this._seg2File = null;
         this._seg2Index = 1;
+        this._diffFile = null;
+        this._metricsPair = null;
 
         this._seg1View = null;
         this._baseImageView = null;
@@ -340,6 +748,11 @@ const SegItemView = View.extend({
 
         this._sliceCount = null;
         this._slice = 0;
+        this._sliceFrame = null;
+
+        this._cohort = null;
+        this._cohortPage = 0;
+        this._cohortTimeout = null;
 
         this.listenTo(this._files, 'g:selected-seg-1', this._onSeg1SelectionChanged);
         this.listenTo(this._files, 'g:selected-seg-2', this._onSeg2SelectionChanged);
@@ -354,6 +767,9 @@ const SegItemView = View.extend({
         // Populate dropdowns with segmentation files
         this._populateDropdowns();
 
+        // Fetch the first slab of every view in one request
+        this._loadBatch();
+
         this._seg1View = new SegImageWidget({
             el: this.$('.g-seg-1'),
             parentView: this
@@ -388,11 +804,18 @@ const SegItemView = View.extend({
 
         return this;
     },
+    destroy: function () {
+        if (this._sliceFrame) {
+            window.cancelAnimationFrame(this._sliceFrame);
+        }
+        window.clearTimeout(this._cohortTimeout);
+        View.prototype.destroy.apply(this, arguments);
+    },
     _onSeg1SelectionChanged: function (selectedFile) {
         const mockValues = [100, 500, 240, 17, 12000];
         // this._toggleControls(false);
         this._seg1File = selectedFile;
-        selectedFile.getImage(this._slice, true)
+        selectedFile.getImage(this._slice, this._previewer(this._seg1View))
             .then((image) => {
                 this._seg1View.$('.g-filename').text(selectedFile.name()).attr('title', selectedFile.name());
                 this._seg1View
@@ -402,20 +825,22 @@ const SegItemView = View.extend({
                 this._updateDiffImageIfReady();
                 // console.log('[SegItemView::_onSeg1SelectionChanged] called');
                 // this._toggleControls(true);
-
-                // update seg quantification
-                this.$('.g-quant1-min').text(image['quantification']['min']);
-                this.$('.g-quant1-max').text(image['quantification']['max']);
-                this.$('.g-quant1-mean').text(image['quantification']['mean']);
-                this.$('.g-quant1-sd').text(image['quantification']['sd']);
-                this.$('.g-quant1-volume').text(image['quantification']['volume']);
+            });
+        // update seg quantification, fetched once per file
+        selectedFile.getQuantification()
+            .then((quantification) => {
+                this.$('.g-quant1-min').text(quantification['min']);
+                this.$('.g-quant1-max').text(quantification['max']);
+                this.$('.g-quant1-mean').text(quantification['mean']);
+                this.$('.g-quant1-sd').text(quantification['sd']);
+                this.$('.g-quant1-volume').text(quantification['volume']);
             });
     },
     _onSeg2SelectionChanged: function (selectedFile) {
         const mockValues = [105, 498, 244, 16, 11998];
         // this._toggleControls(false);
         this._seg2File = selectedFile;
-        selectedFile.getImage(this._slice, true)
+        selectedFile.getImage(this._slice, this._previewer(this._seg2View))
             .then((image) => {
                 this._seg2View.$('.g-filename').text(selectedFile.name()).attr('title', selectedFile.name());
                 this._seg2View
@@ -425,18 +850,20 @@ const SegItemView = View.extend({
                 this._updateDiffImageIfReady();
                 // console.log('[SegItemView::_onSeg2SelectionChanged] called');
                 // this._toggleControls(true);
-
-                // update seg quantification
-                this.$('.g-quant2-min').text(image['quantification']['min']);
-                this.$('.g-quant2-max').text(image['quantification']['max']);
-                this.$('.g-quant2-mean').text(image['quantification']['mean']);
-                this.$('.g-quant2-sd').text(image['quantification']['sd']);
-                this.$('.g-quant2-volume').text(image['quantification']['volume']);
+            });
+        // update seg quantification, fetched once per file
+        selectedFile.getQuantification()
+            .then((quantification) => {
+                this.$('.g-quant2-min').text(quantification['min']);
+                this.$('.g-quant2-max').text(quantification['max']);
+                this.$('.g-quant2-mean').text(quantification['mean']);
+                this.$('.g-quant2-sd').text(quantification['sd']);
+                this.$('.g-quant2-volume').text(quantification['volume']);
             });
     },
     _setBaseImage: function () {
         // this._toggleControls(false);
-        this._baseImageFile.getImage(this._slice, false, false, this._id)
+        this._baseImageFile.getImage(this._slice, this._previewer(this._baseImageView))
             .then((image) => {
                 this._baseImageView.$('.g-filename').text(this._baseImageFile.name()).attr('title', this._baseImageFile.name());
                 this._baseImageView
@@ -447,6 +874,58 @@ const SegItemView = View.extend({
                 this._setSliceCount();
             });
     },
+    /**
+     * Get a callback painting the preview of the current slice in a view,
+     * unless the slice changed since.
+     */
+    _previewer: function (view) {
+        const slice = this._slice;
+        return (preview) => {
+            if (this._slice === slice) {
+                view.setImage(preview).rerenderSlice();
+            }
+        };
+    },
+    /**
+     * Fetch the slab of the current slice of the base image, the selected
+     * segmentations and their difference at once, along with the
+     * quantifications, so the views find them when they request them.
+     */
+    _loadBatch: function () {
+        const seg1 = this._files.at(this._seg1Index);
+        const seg2 = this._files.at(this._seg2Index);
+        if (!this._baseImageFile.id || !seg1) {
+            return;
+        }
+        const slab = Math.floor(this._slice / SLAB_SIZE);
+        const params = {
+            seg1_id: seg1.id,
+            start: slab * SLAB_SIZE,
+            stop: (slab + 1) * SLAB_SIZE
+        };
+        if (seg2) {
+            params.seg2_id = seg2.id;
+        }
+        const batch = requestBundle(`/segmentation/${this._id}/batch`, params);
+        this._baseImageFile.seedSlab(slab, batch.then((bundle) => bundle.volumes.base));
+        seg1.seedSlab(slab, batch.then((bundle) => bundle.volumes.seg1));
+        seg1.seedQuantification(batch.then((bundle) => bundle.quantification.seg1));
+        if (seg2) {
+            seg2.seedSlab(slab, batch.then((bundle) => bundle.volumes.seg2));
+            seg2.seedQuantification(batch.then((bundle) => bundle.quantification.seg2));
+            this._getDiffFile(seg1, seg2).seedSlab(slab, batch.then((bundle) => bundle.volumes.diff));
+        }
+    },
+    /**
+     * Get the difference of two segmentations, kept until another pair is selected.
+     */
+    _getDiffFile: function (seg1, seg2) {
+        if (!this._diffFile || this._diffFile.get('seg1_id') !== seg1.id ||
+                this._diffFile.get('seg2_id') !== seg2.id) {
+            this._diffFile = new DiffFileModel({ seg1_id: seg1.id, seg2_id: seg2.id });
+        }
+        return this._diffFile;
+    },
     _setDiffImage: function () {
         // Initial call - will be updated when both segmentations are selected
         this._updateDiffImageIfReady();
@@ -459,14 +938,7 @@ const SegItemView = View.extend({
         }
 
         // this._toggleControls(false);
-        const diffInfo = {
-            seg1_id: this._seg1File.id,
-            seg2_id: this._seg2File.id
-        };
-
-        // Create a temporary file model to handle the diff request
-        const diffFileModel = new ImageFileModel();
-        diffFileModel.getImage(this._slice, false, diffInfo)
+        this._getDiffFile(this._seg1File, this._seg2File).getImage(this._slice)
             .then((diffImage) => {
                 this.$('.g-seg-diff-filename').text('Difference').attr('title', 'Difference');
                 this._diffView
@@ -475,11 +947,118 @@ const SegItemView = View.extend({
                 console.log('[SegItemView::_updateDiffImageIfReady] called');
 
                 // this._toggleControls(true);
-
-                // update metrics
-                this.$('.g-seg-metrics-dice').text('0.804');
-                this.$('.g-seg-metrics-hausdorff').text('1.3');
-                this.$('.g-seg-metrics-assd').text('0.2');
+            });
+        this._updateMetrics();
+    },
+    _updateMetrics: function () {
+        // Metrics only depend on the selected pair, not on the slice
+        const pair = `${this._seg1File.id}:${this._seg2File.id}`;
+        if (this._metricsPair === pair) {
+            return;
+        }
+        this._metricsPair = pair;
+        this.$('.g-seg-metrics-content span').text('…');
+        restRequest({
+            url: '/segmentation/metrics',
+            method: 'GET',
+            data: {
+                seg1_id: this._seg1File.id,
+                seg2_id: this._seg2File.id
+            }
+        })
+            .done((metrics) => {
+                if (this._metricsPair !== pair) {
+                    return;
+                }
+                const format = (value) => value === null ? '-' : value.toFixed(3);
+                this.$('.g-seg-metrics-dice').text(format(metrics.overall.dice));
+                this.$('.g-seg-metrics-jaccard').text(format(metrics.overall.jaccard));
+                this.$('.g-seg-metrics-hausdorff').text(format(metrics.overall.hausdorff));
+                this.$('.g-seg-metrics-hd95').text(format(metrics.overall.hd95));
+                this.$('.g-seg-metrics-assd').text(format(metrics.overall.assd));
+            });
+    },
+    /**
+     * Compare every segmentation of the item with the first selected one, in
+     * the background.
+     */
+    _startCohort: function () {
+        if (!this._seg1File) {
+            return;
+        }
+        window.clearTimeout(this._cohortTimeout);
+        restRequest({
+            url: 'segmentation/cohort',
+            method: 'POST',
+            data: {
+                reference_id: this._seg1File.id,
+                parentType: 'item',
+                parentId: this._id
+            }
+        })
+            .done((comparison) => {
+                this._cohort = comparison;
+                this._cohortPage = 0;
+                this._pollCohort();
+            });
+    },
+    /**
+     * Show the progress of the comparison and its metrics as they are stored,
+     * until it stops.
+     */
+    _pollCohort: function () {
+        const id = this._cohort._id;
+        restRequest({ url: `segmentation/cohort/${id}` })
+            .done((comparison) => {
+                if (!this._cohort || this._cohort._id !== id) {
+                    return;
+                }
+                this._cohort = comparison;
+                const running = comparison.status === 'queued' || comparison.status === 'running';
+                const failures = comparison.failures.length ? `, ${comparison.failures.length} failed` : '';
+                this.$('.g-seg-cohort-status').text(
+                    `${comparison.status}: ${comparison.progress.current} / ${comparison.progress.total}${failures}`);
+                this.$('.g-seg-cohort-cancel').toggleClass('hidden', !running);
+                this._loadCohortPage();
+                if (running) {
+                    this._cohortTimeout = window.setTimeout(() => this._pollCohort(), COHORT_POLL_INTERVAL);
+                }
+            });
+    },
+    /**
+     * Show a page of the overall metrics of each segmentation of the comparison.
+     */
+    _loadCohortPage: function () {
+        const id = this._cohort._id;
+        const page = this._cohortPage;
+        restRequest({
+            url: `segmentation/cohort/${id}/rows`,
+            data: {
+                overall: true,
+                limit: COHORT_PAGE_SIZE,
+                offset: page * COHORT_PAGE_SIZE,
+                sort: 'fileName'
+            }
+        })
+            .done((resp) => {
+                if (this._cohort._id !== id || this._cohortPage !== page) {
+                    return;
+                }
+                const format = (value) => value === null ? '-' : value.toFixed(3);
+                this.$('.g-seg-cohort-table tbody').empty().append(resp.rows.map((row) => $('<tr>').append(
+                    $('<td>').text(row.fileName),
+                    $('<td>').text(format(row.dice)),
+                    $('<td>').text(format(row.jaccard)),
+                    $('<td>').text(format(row.hausdorff)),
+                    $('<td>').text(format(row.hd95)),
+                    $('<td>').text(format(row.assd))
+                )));
+                const pageCount = Math.max(Math.ceil(resp.total / COHORT_PAGE_SIZE), 1);
+                this.$('.g-seg-cohort-table').toggleClass('hidden', !resp.total);
+                this.$('.g-seg-cohort-pages').toggleClass('hidden', pageCount < 2);
+                this.$('.g-seg-cohort-page').text(`${page + 1} / ${pageCount}`);
+                this.$('.g-seg-cohort-previous').prop('disabled', page === 0);
+                this.$('.g-seg-cohort-next').prop('disabled', page + 1 >= pageCount);
             });
     },
     _setSliceCount: function () {
@@ -498,11 +1077,55 @@ const SegItemView = View.extend({
         this.$('.g-slice-slider').attr('max', this._sliceCount - 1).val(this._slice);
         this.$('.g-slice-value').attr('max', this._sliceCount - 1).val(this._slice);
     },
+    _prefetch: function () {
+        this._baseImageFile.prefetch(this._slice);
+        if (this._seg1File) {
+            this._seg1File.prefetch(this._slice);
+        }
+        if (this._seg2File) {
+            this._seg2File.prefetch(this._slice);
+        }
+        if (this._diffFile) {
+            this._diffFile.prefetch(this._slice);
+        }
+    },
+    /**
+     * Show the current slice on the next animation frame, so that slider
+     * events firing faster than frames are drawn only once per frame.
+     */
+    _scheduleRerender: function () {
+        if (!this._sliceFrame) {
+            this._sliceFrame = window.requestAnimationFrame(() => {
+                this._sliceFrame = null;
+                this._rerender();
+                this._prefetch();
+            });
+        }
+    },
+    /**
+     * Show the current slice in every view, requesting it once per view.
+     */
     _rerender: function () {
-        this._files.selectSeg1Index(this._files._selectedSeg1);
-        this._files.selectSeg2Index(this._files._selectedSeg2);
-        this._setBaseImage();
-        this._updateDiffImageIfReady();
+        const slice = this._slice;
+        const show = (file, view) => {
+            file.getImage(slice, this._previewer(view))
+                .then((image) => {
+                    // Slices arriving after the slider moved on are not drawn
+                    if (this._slice === slice) {
+                        view.setImage(image).rerenderSlice();
+                    }
+                });
+        };
+        show(this._baseImageFile, this._baseImageView);
+        if (this._seg1File) {
+            show(this._seg1File, this._seg1View);
+        }
+        if (this._seg2File) {
+            show(this._seg2File, this._seg2View);
+        }
+        if (this._seg1File && this._seg2File) {
+            show(this._getDiffFile(this._seg1File, this._seg2File), this._diffView);
+        }
     },
     _populateDropdowns: function () {
         // Clear existing options
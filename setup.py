@@ -22,6 +22,9 @@ setup(
     ],
     description='A plugin for visualizing segmentations within girder items',
     install_requires=requirements,
+    extras_require={
+        'webp': ['Pillow']
+    },
     license='Apache Software License 2.0',
     long_description=readme,
     long_description_content_type='text/x-rst',
@@ -0,0 +1,130 @@
+import inspect
+import os
+
+import pytest
+import SimpleITK as sitk
+
+from girder.exceptions import FilePathException
+
+import girder_segmentation_viewer as plugin
+from girder_segmentation_viewer.cache import volume_cache
+
+
+class FakeFileModel:
+    """
+    Stands in for the Girder File model, serving images written to a
+    temporary directory. Files are either read in place, like in a filesystem
+    assetstore, or only through ``open``, like in GridFS or S3 assetstores.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.files = {}
+        self.paths = {}
+        self.local = {}
+        self.item = {'_id': 'item', 'segmentation': {}}
+        self.scheduled = []
+
+    def add(self, name, image, local=True, stored_name=None):
+        """
+        Write an image and add it as a file of the item.
+
+        :param name: name of the file, whose extension picks the format
+        :param image: SimpleITK image
+        :param local: whether the file has a path on the local disk
+        :param stored_name: name of the file on the disk, like the hash
+            filesystem assetstores name files after, the file name by default
+        :return: Girder file object
+        """
+        path = os.path.join(self.directory, name)
+        sitk.WriteImage(image, path)
+        if stored_name is not None:
+            os.rename(path, os.path.join(self.directory, stored_name))
+            path = os.path.join(self.directory, stored_name)
+        self.paths[name] = path
+        self.local[name] = local
+        self.files[name] = {
+            '_id': name,
+            'name': name,
+            'exts': name.split('.')[1:],
+            'itemId': 'item',
+            'size': os.path.getsize(path),
+            'sha512': name,
+        }
+        return self.files[name]
+
+    def load(self, id, **kwargs):
+        return self.files.get(str(id))
+
+    def open(self, file):
+        return open(self.paths[file['_id']], 'rb')
+
+    def getLocalFilePath(self, file):
+        if not self.local[file['_id']]:
+            raise FilePathException('File is not on the local disk')
+        return self.paths[file['_id']]
+
+
+class FakeItemModel:
+    def __init__(self, item):
+        self.item = item
+
+    def load(self, id, **kwargs):
+        return self.item
+
+
+class FakeResultModel:
+    """
+    Stands in for the stored results, keeping them in memory.
+    """
+
+    def __init__(self):
+        self.values = {}
+
+    def get(self, kind, files):
+        return self.values.get((kind,) + tuple(file['_id'] for file in files))
+
+    def put(self, kind, files, value):
+        self.values[(kind,) + tuple(file['_id'] for file in files)] = value
+
+    def get_or_compute(self, kind, files, compute):
+        value = self.get(kind, files)
+        if value is None:
+            value = compute()
+            self.put(kind, files, value)
+        return value
+
+
+@pytest.fixture
+def girder_files(tmp_path, monkeypatch):
+    """
+    Replace the Girder models used by the plugin with stand-ins serving the
+    files added to a FakeFileModel, and start from an empty volume cache.
+    """
+    files = FakeFileModel(str(tmp_path))
+    monkeypatch.setattr(plugin, 'File', lambda: files)
+    monkeypatch.setattr(plugin, 'Item', lambda: FakeItemModel(files.item))
+    results = FakeResultModel()
+    monkeypatch.setattr(plugin, 'SegmentationResult', lambda: results)
+    monkeypatch.setattr(plugin, '_schedule_pyramid', files.scheduled.append)
+    # The budget is only set from the settings when the plugin loads
+    monkeypatch.setattr(volume_cache, 'max_bytes', 64 * 1024 ** 2)
+    volume_cache.clear()
+    plugin._histograms.clear()
+    yield files
+    volume_cache.clear()
+    plugin._histograms.clear()
+
+
+@pytest.fixture
+def route():
+    """
+    Get route handlers without their access and parameter decorators, bound
+    to a resource.
+    """
+    resource = plugin.SegmentationItem()
+
+    def handler(name):
+        return inspect.unwrap(getattr(plugin.SegmentationItem, name)).__get__(resource)
+
+    return handler
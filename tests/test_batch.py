@@ -0,0 +1,72 @@
+import collections
+import json
+import struct
+
+import numpy as np
+import SimpleITK as sitk
+
+import girder_segmentation_viewer as plugin
+
+
+def _split(body):
+    # Header and payload of a volume body
+    header_length = struct.unpack('<I', body[:4])[0]
+    return json.loads(body[4:4 + header_length]), body[4 + header_length:]
+
+
+def _body(stream):
+    return b''.join(bytes(chunk) for chunk in stream())
+
+
+def _bundle_parts(stream):
+    header, payload = _split(_body(stream))
+    return header, {part['name']: payload[part['offset']:part['offset'] + part['length']]
+                    for part in header['parts']}
+
+
+def test_batch_decodes_each_file_once_and_matches_the_volume_routes(
+        girder_files, route, monkeypatch):
+    shape = (6, 5, 4)
+    base = np.arange(np.prod(shape), dtype=np.int16).reshape(shape)
+    seg1 = np.zeros(shape, dtype=np.uint8)
+    seg1[1:5, 1:4, 1:3] = 1
+    seg2 = np.roll(seg1, 1, axis=0)
+    seg2[0, 0, 0] = 2
+    for name, array in (('base.mha', base), ('seg1.nrrd', seg1), ('seg2.nrrd', seg2)):
+        girder_files.add(name, sitk.GetImageFromArray(array))
+    girder_files.item['segmentation']['base_image'] = {'_id': 'base.mha'}
+
+    reads = collections.Counter()
+    read_image = sitk.ReadImage
+
+    def counted_read_image(path, *args, **kwargs):
+        reads[path.rsplit('.', 1)[-1]] += 1
+        return read_image(path, *args, **kwargs)
+
+    monkeypatch.setattr(sitk, 'ReadImage', counted_read_image)
+    header, parts = _bundle_parts(
+        route('get_batch')(girder_files.item, 'seg1.nrrd', 'seg2.nrrd', 1, 4))
+    # The base image is decoded once for its slices, histogram and both overlays
+    assert reads == {'mha': 1, 'nrrd': 2}
+    assert set(header['quantification']) == {'seg1', 'seg2'}
+    assert list(parts) == ['base', 'seg1', 'seg2', 'diff']
+
+    base_header, base_payload = _split(parts['base'])
+    assert (base_header['start'], base_header['stop']) == (1, 4)
+    assert base_header['histogram']['slices']['start'] == 1
+    slab = _split(_body(route('get_slab')(
+        girder_files.files['base.mha'], 1, 4, 'axial', 'binary', 0, False)))[1]
+    assert base_payload == slab
+    np.testing.assert_array_equal(
+        np.frombuffer(base_payload, '<i2').reshape(3, 5, 4), base[1:4])
+
+    for name in ('seg1', 'seg2'):
+        slab = _split(_body(route('get_slab')(
+            girder_files.files[name + '.nrrd'], 1, 4, 'axial', 'rle', 0, False)))[1]
+        assert _split(parts[name])[1] == slab
+
+    diff_header, diff_payload = _split(parts['diff'])
+    assert diff_header['categories'] == plugin.DIFF_CATEGORIES
+    diff = _split(_body(route('get_seg_diff_data_json')(
+        'seg1.nrrd', 'seg2.nrrd', 'rle', 0, 'categories', None, False, 1, 4)))[1]
+    assert diff_payload == diff
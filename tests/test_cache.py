@@ -0,0 +1,70 @@
+import gc
+
+import numpy as np
+import SimpleITK as sitk
+
+from girder_segmentation_viewer.cache import VolumeCache, image_array
+
+
+def _volume(file_id, value=0, sha512='abc'):
+    image = sitk.GetImageFromArray(np.full((4, 4, 4), value, dtype=np.uint8))
+    return {'_id': file_id, 'sha512': sha512}, image, image_array(image)
+
+
+def test_image_array_keeps_image_alive():
+    image = sitk.GetImageFromArray(np.arange(8, dtype=np.int16).reshape(2, 2, 2))
+    array = image_array(image)
+    del image
+    gc.collect()
+
+    assert not array.flags.writeable
+    np.testing.assert_array_equal(array.ravel(), np.arange(8))
+
+
+def test_lru_eviction_and_counters():
+    cache = VolumeCache(max_bytes=2 * 64)
+    for file_id in ('a', 'b'):
+        cache.put(*_volume(file_id))
+
+    assert cache.get({'_id': 'a', 'sha512': 'abc'}) is not None
+    cache.put(*_volume('c'))
+
+    assert cache.get({'_id': 'b', 'sha512': 'abc'}) is None
+    assert cache.get({'_id': 'a', 'sha512': 'abc'}) is not None
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['evictions']) == (2, 1, 1)
+    assert stats['bytes'] == 2 * 64
+
+
+def test_new_contents_and_invalidation():
+    cache = VolumeCache(max_bytes=1024)
+    cache.put(*_volume('a', sha512='old'))
+    cache.put(*_volume('a', value=1, sha512='new'))
+
+    assert cache.get({'_id': 'a', 'sha512': 'old'}) is None
+    assert cache.get({'_id': 'a', 'sha512': 'new'})[1][0, 0, 0] == 1
+
+    cache.invalidate('a')
+    assert cache.stats()['entries'] == 0
+    assert cache.stats()['bytes'] == 0
+
+
+def test_derived_volumes_are_invalidated_with_their_files():
+    cache = VolumeCache(max_bytes=1024)
+    cache.put(*_volume('resampled:a:b:0123'))
+    cache.put(*_volume('resampled:c:b:0123'))
+    cache.put(*_volume('c'))
+
+    cache.invalidate('a')
+    assert cache.get({'_id': 'resampled:a:b:0123', 'sha512': 'abc'}) is None
+    assert cache.stats()['entries'] == 2
+    cache.invalidate('b')
+    assert cache.get({'_id': 'resampled:c:b:0123', 'sha512': 'abc'}) is None
+    assert cache.get({'_id': 'c', 'sha512': 'abc'}) is not None
+
+    # Saving new contents of a file drops the volumes derived from the old ones
+    cache.put(*_volume('resampled:c:d:0123', sha512='old:abc'))
+    cache.put(*_volume('resampled:e:c:0123', sha512='abc:new'))
+    cache.invalidate('c', keep_content='new')
+    assert cache.get({'_id': 'resampled:e:c:0123', 'sha512': 'abc:new'}) is not None
+    assert cache.stats()['entries'] == 1
@@ -0,0 +1,99 @@
+import contextlib
+
+import numpy as np
+import pytest
+import SimpleITK as sitk
+
+from girder_segmentation_viewer.cohort import compare_cohort
+from girder_segmentation_viewer.metrics import compare_segmentations
+
+
+def _write(array, path, spacing=(1.0, 1.0, 1.0)):
+    image = sitk.GetImageFromArray(array)
+    image.SetSpacing(spacing)
+    sitk.WriteImage(image, str(path))
+    return image
+
+
+@pytest.fixture
+def cohort(tmp_path):
+    reference = np.zeros((12, 12, 12), dtype=np.uint8)
+    reference[2:8, 2:8, 2:8] = 1
+    reference[9:11, 9:11, 9:11] = 2
+    reference_image = _write(reference, tmp_path / 'reference.nrrd')
+
+    candidates = {}
+    for shift in range(3):
+        candidate = np.roll(reference, shift, axis=2)
+        _write(candidate, tmp_path / ('shift%d.nrrd' % shift))
+        candidates['shift%d' % shift] = candidate
+    return reference_image, reference, candidates
+
+
+def test_candidates_are_compared_in_worker_processes(tmp_path, cohort):
+    reference_image, reference, candidates = cohort
+    # Half the resolution, resampled onto the grid of the reference
+    _write(reference[::2, ::2, ::2], tmp_path / 'coarse.nrrd', spacing=(2.0, 2.0, 2.0))
+    results = {}
+
+    def on_result(key, metrics, error):
+        results[key] = (metrics, error)
+
+    paths = [(name, contextlib.nullcontext(str(tmp_path / ('%s.nrrd' % name))))
+             for name in list(candidates) + ['coarse', 'missing']]
+    assert compare_cohort(reference_image, reference, paths, on_result, lambda: False, workers=2)
+
+    assert set(results) == set(candidates) | {'coarse', 'missing'}
+    for name, candidate in candidates.items():
+        metrics, error = results[name]
+        assert error is None
+        assert metrics == compare_segmentations(reference, candidate, (1.0, 1.0, 1.0))
+    assert results['shift0'][0]['overall']['dice'] == 1
+    assert results['coarse'][0]['overall']['dice'] > 0.5
+    assert results['missing'][0] is None
+    assert isinstance(results['missing'][1], RuntimeError)
+
+
+def test_canceled_comparisons_stop_queuing_candidates(tmp_path, cohort):
+    reference_image, reference, candidates = cohort
+    results = []
+    opened = []
+
+    @contextlib.contextmanager
+    def path(name):
+        opened.append(name)
+        yield str(tmp_path / ('%s.nrrd' % name))
+
+    def on_result(key, metrics, error):
+        results.append(key)
+
+    names = list(candidates) * 4
+    completed = compare_cohort(
+        reference_image, reference, ((name, path(name)) for name in names), on_result,
+        lambda: len(results) >= 1, workers=1)
+    assert not completed
+    # One candidate is queued per worker on top of the one being compared
+    assert 1 <= len(results) < len(names)
+    assert len(opened) <= 1 + len(results)
+
+
+def test_canceled_comparisons_queue_nothing(tmp_path, cohort):
+    reference_image, reference, candidates = cohort
+    opened = []
+
+    @contextlib.contextmanager
+    def path(name):
+        opened.append(name)
+        yield str(tmp_path / ('%s.nrrd' % name))
+
+    completed = compare_cohort(
+        reference_image, reference, ((name, path(name)) for name in candidates),
+        lambda *args: None, lambda: True, workers=1)
+    assert not completed
+    assert not opened
+
+
+def test_metrics_are_the_same_without_threads(cohort):
+    _, reference, candidates = cohort
+    assert compare_segmentations(reference, candidates['shift1'], (1.0, 1.0, 1.0)) == \
+        compare_segmentations(reference, candidates['shift1'], (1.0, 1.0, 1.0), parallel=False)
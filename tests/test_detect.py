@@ -0,0 +1,91 @@
+import io
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+import SimpleITK as sitk
+from pymongo import UpdateOne
+
+from girder.models.folder import Folder
+from girder.models.item import Item
+from girder.models.upload import Upload
+from pytest_girder.assertions import assertStatusOk
+
+import girder_segmentation_viewer as plugin
+
+
+def _upload(item, name, data, user):
+    return Upload().uploadFromFile(
+        io.BytesIO(data), len(data), name, parentType='item', parent=item, user=user)
+
+
+@pytest.mark.plugin('girder_segmentation_viewer')
+def test_detect_images_in_hierarchy(server, admin, fsAssetstore, tmp_path):
+    path = os.path.join(tmp_path, 'image.nrrd')
+    sitk.WriteImage(sitk.GetImageFromArray(np.zeros((2, 3, 4), dtype=np.uint8)), path)
+    with open(path, 'rb') as fp:
+        image = fp.read()
+
+    parent = Folder().createFolder(admin, 'studies', parentType='user', creator=admin)
+    child = Folder().createFolder(parent, 'study', creator=admin)
+    items = [Item().createItem(name, admin, folder) for name, folder in
+             (('a', parent), ('b', child))]
+    for item in items:
+        _upload(item, 'image.nrrd', image, admin)
+        _upload(item, 'notes.txt', b'not an image', admin)
+
+    params = {'parentType': 'folder', 'parentId': str(parent['_id'])}
+    resp = server.request('/segmentation/detect_images', method='POST', user=admin, params=params)
+    assertStatusOk(resp)
+    assert resp.json['items'] == 2
+    assert resp.json['images'] == 2
+    for item in items:
+        images = Item().load(item['_id'], force=True)['segmentation']['images']
+        assert [image['name'] for image in images] == ['image.nrrd']
+
+    # Files keep their probe results until their contents change, and images
+    # added by uploads meanwhile are kept
+    uploaded = {'name': 'uploaded.nrrd', '_id': items[0]['_id']}
+    Item().update({'_id': items[0]['_id']}, {'$push': {'segmentation.images': uploaded}})
+    resp = server.request('/segmentation/detect_images', method='POST', user=admin, params=params)
+    assert resp.json['probed'] == 0
+    assert resp.json['skipped'] == 4
+    assert resp.json['updated'] == 0
+    images = Item().load(items[0]['_id'], force=True)['segmentation']['images']
+    assert [image['name'] for image in images] == ['image.nrrd', 'uploaded.nrrd']
+
+
+class _FakeCollection:
+    def __init__(self):
+        self.requests = []
+
+    def bulk_write(self, requests, ordered=True):
+        self.requests += requests
+        return SimpleNamespace(modified_count=len(requests))
+
+
+def test_files_failing_to_be_probed_are_not_images(monkeypatch):
+    files = SimpleNamespace(collection=_FakeCollection())
+    items = SimpleNamespace(collection=_FakeCollection())
+    monkeypatch.setattr(plugin, 'File', lambda: files)
+    monkeypatch.setattr(plugin, 'Item', lambda: items)
+
+    def probe_image(file, store=True):
+        raise OSError('Assetstore is unavailable')
+
+    monkeypatch.setattr(plugin, '_probe_image', probe_image)
+    # Probed as an image before its contents changed
+    changed = {'_id': 'a', 'name': 'image.nrrd', 'sha512': 'new',
+               'image_info': {'readable': True, 'content': 'old'}}
+    new = {'_id': 'b', 'name': 'other.nrrd', 'sha512': 'new'}
+    summary = Counter()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        plugin._detect_batch_images([({'_id': 'item'}, [changed, new])], executor, summary)
+
+    assert (summary['failed'], summary['images'], summary['updated']) == (2, 0, 0)
+    assert 'image_info' not in changed
+    assert files.collection.requests == [UpdateOne({'_id': 'a'}, {'$unset': {'image_info': ''}})]
+    assert items.collection.requests == []
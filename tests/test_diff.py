@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from girder_segmentation_viewer.diff import (
+    AGREEMENT, BACKGROUND, MISMATCH, ONLY_SEG1, ONLY_SEG2, diff_volume)
+
+
+def test_categories():
+    seg1 = np.array([[[0, 1, 1, 3, 0]]], dtype=np.uint8)
+    seg2 = np.array([[[0, 1, 0, 1, 2]]], dtype=np.uint8)
+
+    np.testing.assert_array_equal(
+        diff_volume(seg1, seg2),
+        [[[BACKGROUND, AGREEMENT, ONLY_SEG1, MISMATCH, ONLY_SEG2]]])
+    # Restricted to a label, other labels are background
+    np.testing.assert_array_equal(
+        diff_volume(seg1, seg2, label=1),
+        [[[BACKGROUND, AGREEMENT, ONLY_SEG1, ONLY_SEG2, BACKGROUND]]])
+
+
+def test_modes_keep_native_types_across_chunks():
+    rng = np.random.default_rng(0)
+    seg1 = rng.integers(0, 5, (7, 4, 4)).astype(np.uint16)
+    seg2 = rng.integers(0, 5, (7, 4, 4)).astype(np.uint16)
+
+    absolute = diff_volume(seg1, seg2, 'absolute', chunk_slices=2)
+    assert absolute.dtype == np.uint16
+    np.testing.assert_array_equal(absolute, np.abs(seg1.astype(int) - seg2.astype(int)))
+
+    mismatch = diff_volume(seg1, seg2, 'mismatch', chunk_slices=3)
+    assert mismatch.dtype == np.uint8
+    np.testing.assert_array_equal(mismatch, seg1 != seg2)
+
+    np.testing.assert_array_equal(
+        diff_volume(seg1, seg2, 'absolute', label=2), (seg1 == 2) != (seg2 == 2))
+    with pytest.raises(ValueError):
+        diff_volume(seg1, seg2, 'relative')
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from girder_segmentation_viewer.histogram import (
+    HISTOGRAM_BINS, SLICE_HISTOGRAM_BINS, histogram_header, intensity_histogram)
+from girder_segmentation_viewer.overlay import CHUNK_SLICES, overlay_quantification
+
+
+def test_histogram_matches_the_volume_and_its_slices():
+    rng = np.random.default_rng(0)
+    # Spans several chunks
+    base = rng.normal(1000, 400, (CHUNK_SLICES * 2 + 3, 48, 40)).astype(np.int16)
+    histogram = intensity_histogram(base)
+
+    assert histogram['range'] == [base.min(), base.max()]
+    counts, _ = np.histogram(base, HISTOGRAM_BINS, (base.min(), base.max()))
+    np.testing.assert_array_equal(histogram['counts'], counts)
+
+    # Percentiles are interpolated within bins, a fraction of a bin off at most
+    bin_width = (base.max() - base.min()) / HISTOGRAM_BINS
+    lower, upper = np.percentile(base, [2, 98])
+    window = histogram['windows']['2-98']
+    assert window['width'] == pytest.approx(upper - lower, abs=2 * bin_width)
+    assert window['level'] == pytest.approx((upper + lower) / 2, abs=bin_width)
+    assert histogram['windows']['full'] == {
+        'width': float(base.max() - base.min()),
+        'level': (float(base.max()) + float(base.min())) / 2,
+    }
+
+    slices = histogram['slices']
+    assert len(slices['counts']) == len(slices['windows']) == len(base)
+    for k in (0, CHUNK_SLICES, len(base) - 1):
+        counts, _ = np.histogram(base[k], SLICE_HISTOGRAM_BINS, (base.min(), base.max()))
+        np.testing.assert_array_equal(slices['counts'][k], counts)
+        lower, upper = np.percentile(base[k], [1, 99])
+        assert slices['windows'][k]['level'] == pytest.approx((upper + lower) / 2, abs=bin_width)
+
+    header = histogram_header(histogram, 4, 7)
+    assert header['windows'] == histogram['windows']
+    assert header['slices'] == {
+        'start': 4,
+        'counts': slices['counts'][4:7],
+        'windows': slices['windows'][4:7],
+    }
+    assert 'slices' not in histogram_header(histogram)
+
+
+def test_constant_volume_and_stored_range():
+    base = np.full((3, 4, 4), 7, dtype=np.uint8)
+    histogram = intensity_histogram(base)
+    assert histogram['range'] == [7, 7]
+    assert histogram['counts'][0] == base.size
+    assert histogram['windows']['1-99'] == {'width': 0, 'level': 7}
+
+    rng = np.random.default_rng(1)
+    base = rng.integers(0, 4096, (10, 8, 8)).astype(np.uint16)
+    seg = rng.integers(0, 3, base.shape).astype(np.uint8)
+    assert overlay_quantification(base, seg, intensity_histogram(base)['range']) == \
+        overlay_quantification(base, seg)
@@ -0,0 +1,30 @@
+import threading
+
+from girder_segmentation_viewer.ingest import IngestionQueue
+
+
+def test_files_are_processed_in_order_off_the_calling_thread():
+    queue = IngestionQueue()
+    release = threading.Event()
+    processed = []
+
+    def task(file):
+        release.wait()
+        if file['name'] == 'broken':
+            raise RuntimeError('Not an image')
+        processed.append((file['name'], threading.current_thread().name))
+
+    for name in ('a', 'broken', 'b', 'c'):
+        queue.put(task, {'_id': name, 'name': name})
+    # Files are queued without waiting for them to be processed
+    assert processed == []
+
+    release.set()
+    queue.join()
+    assert [name for name, _ in processed] == ['a', 'b', 'c']
+    assert all(thread.startswith('segmentation_ingest') for _, thread in processed)
+
+    # A drained queue starts a new worker
+    queue.put(task, {'_id': 'd', 'name': 'd'})
+    queue.join()
+    assert processed[-1][0] == 'd'
@@ -0,0 +1,93 @@
+import json
+import struct
+
+import numpy as np
+import pytest
+
+from girder_segmentation_viewer.mesh import MIN_LABEL_TRIANGLES, label_meshes, mesh_body
+
+
+def _signed_volume(mesh):
+    """
+    Volume enclosed by a mesh, positive when its triangles face outward. Also
+    check that the mesh is closed, each edge being shared by two triangles
+    going through it in opposite directions.
+    """
+    triangles = mesh['triangles'].astype(np.int64)
+    edges = np.concatenate([triangles[:, [0, 1]], triangles[:, [1, 2]], triangles[:, [2, 0]]])
+    directed = set(map(tuple, edges.tolist()))
+    assert len(directed) == len(edges)
+    assert all((b, a) in directed for a, b in directed)
+    points = mesh['vertices'][triangles].astype(np.float64)
+    return np.einsum('ij,ij->i', points[:, 0], np.cross(points[:, 1], points[:, 2])).sum() / 6
+
+
+def _ball_and_box():
+    z, y, x = np.mgrid[:40, :36, :44]
+    seg = np.zeros((40, 36, 44), dtype=np.uint16)
+    seg[(z - 20) ** 2 + (y - 18) ** 2 + (x - 22) ** 2 < 14 ** 2] = 1
+    seg[3:8, 2:9, 30:40] = 300
+    return seg
+
+
+@pytest.mark.parametrize('direction', [
+    np.eye(3).ravel(),
+    # x along -y, y along x, z flipped
+    (0, 1, 0, -1, 0, 0, 0, 0, -1),
+])
+def test_meshes_are_closed_and_enclose_the_labels(direction):
+    seg = _ball_and_box()
+    spacing = (0.5, 2.0, 1.5)
+    meshes = label_meshes(seg, spacing, (10.0, -5.0, 3.0), direction)
+    assert [mesh['label'] for mesh in meshes] == [1, 300]
+
+    for mesh in meshes:
+        assert mesh['stride'] == 1
+        voxels = np.count_nonzero(seg == mesh['label'])
+        assert _signed_volume(mesh) == pytest.approx(voxels * 0.5 * 2.0 * 1.5, rel=0.1)
+
+    # The box spans its voxel centers, less half a voxel at each corner
+    box = meshes[1]['vertices']
+    points = np.array([[30, 2, 3], [39, 8, 7]]) * spacing
+    points = np.asarray((10.0, -5.0, 3.0)) + points @ np.reshape(direction, (3, 3)).T
+    np.testing.assert_allclose(box.min(axis=0), points.min(axis=0), atol=1.01 * max(spacing))
+    np.testing.assert_allclose(box.max(axis=0), points.max(axis=0), atol=1.01 * max(spacing))
+
+
+def test_budget_coarsens_the_largest_surfaces_and_body_layout():
+    seg = _ball_and_box()
+    meshes = label_meshes(seg, (1.0, 1.0, 1.0), (0.0, 0.0, 0.0), np.eye(3).ravel(), 1000)
+    assert sum(len(mesh['triangles']) for mesh in meshes) <= 1000
+    ball = meshes[0]
+    assert ball['stride'] > 1
+    assert _signed_volume(ball) == pytest.approx(np.count_nonzero(seg == 1), rel=0.2)
+
+    body = mesh_body(meshes)
+    length = struct.unpack('<I', body[:4])[0]
+    header = json.loads(body[4:4 + length])
+    assert [entry['label'] for entry in header['labels']] == [1, 300]
+    assert header['vertices'] == sum(len(mesh['vertices']) for mesh in meshes)
+
+    offset = 4 + length
+    assert offset % 8 == 0
+    vertices = np.frombuffer(body, '<f4', header['vertices'] * 3, offset)
+    offset += -(-vertices.nbytes // 8) * 8
+    triangles = np.frombuffer(body, '<u4', header['triangles'] * 3, offset)
+    assert offset + triangles.nbytes + (-triangles.nbytes % 8) == len(body)
+    np.testing.assert_array_equal(
+        vertices[:len(ball['vertices']) * 3], ball['vertices'].ravel())
+    np.testing.assert_array_equal(
+        triangles[len(ball['triangles']) * 3:], meshes[1]['triangles'].ravel())
+
+
+def test_small_labels_stay_within_the_budget():
+    seg = np.zeros((20, 20, 20), dtype=np.uint16)
+    seg[2:18, 2:18, 2:18] = 1
+    # Specks whose share of the surface rounds down to no triangles
+    for label, z in enumerate(range(3, 17, 2), 2):
+        seg[z, 5, 8] = label
+        seg[z, 11, 8] = label + 10
+    meshes = label_meshes(seg, (1.0, 1.0, 1.0), (0.0, 0.0, 0.0), np.eye(3).ravel(), 300)
+    assert len(meshes) == 15
+    assert all(len(mesh['triangles']) >= MIN_LABEL_TRIANGLES for mesh in meshes)
+    assert sum(len(mesh['triangles']) for mesh in meshes) <= 300
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from girder_segmentation_viewer.metrics import compare_segmentations, label_bounding_boxes
+from girder_segmentation_viewer.overlay import LabelIndex
+
+
+def test_label_bounding_boxes():
+    seg = np.zeros((5, 6, 7), dtype=np.uint8)
+    seg[1:3, 2:5, 3] = 4
+    seg[4, 0, 6] = 9
+
+    boxes = label_bounding_boxes(seg, LabelIndex(seg))
+    np.testing.assert_array_equal(boxes[4][0], [1, 2, 3])
+    np.testing.assert_array_equal(boxes[4][1], [2, 4, 3])
+    np.testing.assert_array_equal(boxes[9][0], [4, 0, 6])
+    np.testing.assert_array_equal(boxes[0][1], [4, 5, 6])
+
+
+def test_compare_shifted_cubes():
+    seg1 = np.zeros((20, 20, 20), dtype=np.uint8)
+    seg2 = np.zeros_like(seg1)
+    seg1[5:15, 5:15, 5:15] = 1
+    seg2[5:15, 5:15, 7:17] = 1
+    seg1[0:2, 0:2, 0:2] = 2
+
+    metrics = compare_segmentations(seg1, seg2, (0.5, 1.0, 1.0))
+    cube, missing = metrics['labels']
+
+    assert cube['label'] == 1
+    assert cube['dice'] == pytest.approx(0.8)
+    assert cube['jaccard'] == pytest.approx(8 / 12)
+    assert cube['volume1'] == cube['volume2'] == 500
+    # The cubes are shifted by 2 voxels of 0.5 along x
+    assert cube['hausdorff'] == pytest.approx(1.0)
+    assert cube['hd95'] == pytest.approx(1.0)
+    assert 0 < cube['assd'] < 1.0
+
+    assert missing['label'] == 2
+    assert missing['dice'] == 0
+    assert missing['volume_difference'] == -4
+    assert missing['hausdorff'] is None
+    assert metrics['overall']['volume1'] == 504
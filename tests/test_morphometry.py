@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from girder_segmentation_viewer.morphometry import label_morphometrics
+from girder_segmentation_viewer.overlay import CHUNK_SLICES
+
+
+def test_measures_match_per_label_masks():
+    rng = np.random.default_rng(0)
+    # Spans several chunks, with labels missing from the volume and large values
+    seg = rng.choice(np.array([0, 1, 2, 7, 300], dtype=np.uint16), (CHUNK_SLICES * 2 + 3, 9, 11))
+    seg[seg == 2] = 0
+    seg[5, 4, 2] = 2
+    base = rng.integers(-1000, 3000, seg.shape).astype(np.int16)
+    spacing = (0.5, 2.0, 1.5)
+    origin = (10.0, -5.0, 3.0)
+
+    measures = label_morphometrics(seg, spacing, origin, np.eye(3).ravel(), base)
+    assert [entry['label'] for entry in measures['labels']] == [1, 2, 7, 300]
+
+    for entry in measures['labels']:
+        mask = seg == entry['label']
+        z, y, x = np.nonzero(mask)
+        assert entry['voxels'] == mask.sum()
+        assert entry['volume'] == pytest.approx(mask.sum() * 0.5 * 2.0 * 1.5)
+        assert entry['centroid_index'] == pytest.approx([x.mean(), y.mean(), z.mean()])
+        assert entry['centroid'] == pytest.approx(
+            [10 + x.mean() * 0.5, -5 + y.mean() * 2.0, 3 + z.mean() * 1.5])
+        assert entry['bounding_box'] == {
+            'index': [x.min(), y.min(), z.min()],
+            'size': [x.max() - x.min() + 1, y.max() - y.min() + 1, z.max() - z.min() + 1],
+        }
+        values = base[mask].astype(np.float64)
+        assert entry['intensity']['mean'] == pytest.approx(values.mean())
+        assert entry['intensity']['sd'] == pytest.approx(values.std())
+        assert entry['intensity']['min'] == values.min()
+        assert entry['intensity']['max'] == values.max()
+
+    single = measures['labels'][1]
+    assert single['bounding_box'] == {'index': [2, 4, 5], 'size': [1, 1, 1]}
+    assert single['intensity']['sd'] == 0
+
+
+def test_centroids_follow_the_direction_and_intensities_are_optional():
+    seg = np.zeros((4, 4, 4), dtype=np.uint8)
+    seg[1, 2, 3] = 1
+    # x along -y, y along x
+    direction = (0, 1, 0, -1, 0, 0, 0, 0, 1)
+
+    measures = label_morphometrics(seg, (1.0, 2.0, 3.0), (0.0, 0.0, 0.0), direction)
+    (entry,) = measures['labels']
+    assert entry['centroid'] == pytest.approx([4.0, -3.0, 3.0])
+    assert 'intensity' not in entry
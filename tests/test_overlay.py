@@ -0,0 +1,39 @@
+import numpy as np
+
+from girder_segmentation_viewer.overlay import LabelIndex, overlay_chunks, overlay_quantification
+
+
+def _masked_overlay(base_array, seg_array):
+    # Label by label overlay the lookup table has to reproduce
+    overlay = base_array.astype(np.float32)
+    labels = np.unique(seg_array)
+    for i, label in enumerate(labels[labels != 0]):
+        mask = seg_array == label
+        alpha = 0.4 + (i % labels.size) * 0.05
+        overlay[mask] = overlay[mask] * (1 - alpha) + 255 * alpha
+    return np.clip(overlay, 0, 255).astype(np.uint8)
+
+
+def test_overlay_matches_masked_blending():
+    rng = np.random.default_rng(0)
+    base = rng.integers(0, 256, (20, 16, 16)).astype(np.uint8)
+    seg = rng.integers(0, 8, (20, 16, 16)).astype(np.uint16) * 3
+
+    overlay = np.concatenate(list(overlay_chunks(base, seg, chunk_slices=6)))
+    np.testing.assert_array_equal(overlay, _masked_overlay(base, seg))
+
+    quantification = overlay_quantification(base, seg)
+    assert quantification['min'] == overlay.min()
+    assert quantification['max'] == overlay.max()
+    assert np.isclose(quantification['mean'], overlay.mean())
+    assert np.isclose(quantification['sd'], overlay.std())
+    assert quantification['volume'] == overlay.size
+
+
+def test_label_index_fallback_for_float_labels():
+    seg = np.array([[0.0, 2.5], [2.5, -1.0]])
+    index = LabelIndex(seg)
+
+    np.testing.assert_array_equal(index.labels, [-1.0, 0.0, 2.5])
+    np.testing.assert_array_equal(index.counts, [1, 1, 2])
+    np.testing.assert_array_equal(index.rows(seg), [[1, 2], [2, 0]])
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+import SimpleITK as sitk
+
+from girder_segmentation_viewer.probe import (
+    HEADER_PROBE_SIZE, has_image_extension, has_image_signature, read_image_information,
+    supports_region_reading)
+
+
+def test_extension_filter():
+    assert has_image_extension('scan.nii.gz')
+    assert has_image_extension('labels.NRRD')
+    assert not has_image_extension('report.pdf')
+    assert not has_image_extension('archive.tar.gz')
+    assert not has_image_extension('README')
+
+
+def test_header_of_truncated_file(tmp_path):
+    image = sitk.GetImageFromArray(np.random.randint(0, 1000, (20, 64, 64), dtype=np.int16))
+    image.SetSpacing((0.5, 0.5, 2.0))
+    path = str(tmp_path / 'scan.nii.gz')
+    sitk.WriteImage(image, path)
+
+    with open(path, 'rb') as fp:
+        head = fp.read(HEADER_PROBE_SIZE)
+    truncated = tmp_path / 'truncated.nii.gz'
+    truncated.write_bytes(head[:1024])
+
+    assert has_image_signature(head)
+    info = read_image_information(str(truncated))
+    assert info['size'] == [64, 64, 20]
+    assert info['spacing'] == [0.5, 0.5, 2.0]
+    assert info['pixel_type'] == '16-bit signed integer'
+
+
+def test_unreadable_file(tmp_path):
+    path = tmp_path / 'notes.nii'
+    path.write_bytes(b'not an image')
+
+    assert not has_image_signature(b'not an image')
+    assert read_image_information(str(path)) is None
+
+
+@pytest.mark.parametrize('extension', ['nii', 'nrrd', 'mha'])
+def test_only_uncompressed_files_are_read_by_region(tmp_path, extension):
+    image = sitk.GetImageFromArray(np.zeros((4, 5, 6), dtype=np.int16))
+    for compressed in (False, True):
+        path = str(tmp_path / ('scan.%s%s' % (extension, '.gz' if compressed and
+                                              extension == 'nii' else '')))
+        sitk.WriteImage(image, path, useCompression=compressed)
+        with open(path, 'rb') as fp:
+            assert supports_region_reading(fp.read(HEADER_PROBE_SIZE)) is not compressed
+
+    assert not supports_region_reading(b'\x89PNG')
@@ -0,0 +1,88 @@
+import json
+import struct
+
+import numpy as np
+import SimpleITK as sitk
+
+import girder_segmentation_viewer as plugin
+from girder_segmentation_viewer.cache import volume_key
+from girder_segmentation_viewer.pyramid import (
+    area_average, downsample_volume, label_mode, level_count, level_header)
+from girder_segmentation_viewer.store import VolumeStore
+
+
+def test_area_average_pads_odd_sizes():
+    array = np.arange(3 * 4 * 5, dtype=np.uint16).reshape(3, 4, 5)
+    average = area_average(array, (2, 2, 2))
+
+    assert average.shape == (2, 2, 3)
+    assert average.dtype == np.uint16
+    assert average[0, 0, 0] == np.rint(array[:2, :2, :2].mean())
+    # The last block along each axis repeats the last voxels
+    assert average[1, 1, 2] == np.rint(array[2, 2:4, 4].mean())
+
+
+def test_label_mode_keeps_the_most_frequent_label():
+    labels = np.zeros((2, 2, 4), dtype=np.uint8)
+    labels[:, :, 2:] = 7
+    labels[0, 0, 2] = 3
+    labels[1, 1, 1] = 5
+
+    np.testing.assert_array_equal(label_mode(labels, (2, 2, 2)), [[[0, 7]]])
+
+
+def test_downsampled_volume_stays_aligned():
+    image = sitk.Image(9, 6, 5, sitk.sitkUInt8)
+    image.SetSpacing((0.5, 1.0, 2.0))
+    image.SetOrigin((10.0, 20.0, 30.0))
+    array = np.random.default_rng(0).integers(0, 4, (5, 6, 9)).astype(np.uint8)
+
+    header, downsampled = downsample_volume(image, array, labels=True, chunk_slices=1)
+    _, unchunked = downsample_volume(image, array, labels=True, chunk_slices=len(array))
+
+    np.testing.assert_array_equal(downsampled, unchunked)
+    assert downsampled.shape == (3, 3, 5)
+    assert header.GetSize() == (5, 3, 3)
+    assert header.GetSpacing() == (1.0, 2.0, 4.0)
+    # Voxels are centered on the blocks they cover
+    assert header.GetOrigin() == (10.25, 20.5, 31.0)
+
+
+def test_level_count():
+    assert level_count((1, 64, 64)) == 1
+    assert level_count((200, 512, 512)) == 4
+    assert level_header(sitk.Image(2, 1, sitk.sitkUInt8), (1, 2)).GetSize() == (1, 1)
+
+
+def _header(stream):
+    body = b''.join(bytes(chunk) for chunk in stream())
+    return json.loads(body[4:4 + struct.unpack('<I', body[:4])[0]])
+
+
+def test_downsampled_levels_never_decode_the_volume_for_the_histogram(
+        girder_files, route, tmp_path, monkeypatch):
+    store = VolumeStore(str(tmp_path / 'store'), 64 * 1024 ** 2)
+    monkeypatch.setattr(plugin, 'volume_store', store)
+    monkeypatch.setattr('girder_segmentation_viewer.pyramid.MIN_LEVEL_SIZE', 4)
+    array = np.arange(8 * 8 * 8, dtype=np.int16).reshape(8, 8, 8)
+    image = sitk.GetImageFromArray(array)
+    base = girder_files.add('base.mha', image)
+    girder_files.item['segmentation']['base_image'] = {'_id': 'base.mha'}
+    store.put(base, *downsample_volume(image, array, labels=False), level=1)
+
+    # Reading the file would fail
+    path = girder_files.paths.pop('base.mha')
+    header = _header(route('get_base_image_data_json')(girder_files.item, 'binary', 1))
+    assert (header['level'], header['histogram']) == (1, None)
+    header = _header(route('get_slab')(base, 0, 2, 'axial', 'binary', 1, True))
+    assert (header['level'], header['histogram']) == (1, None)
+
+    # The pyramid build stores it along with the levels
+    girder_files.paths['base.mha'] = path
+    plugin._build_pyramid(base, volume_key(base))
+    girder_files.paths.pop('base.mha')
+    header = _header(route('get_base_image_data_json')(girder_files.item, 'binary', 1))
+    assert (header['level'], header['histogram']['range']) == (1, [0, 511])
+    assert 'slices' not in header['histogram']
+    header = _header(route('get_base_image_data_json')(girder_files.item, 'binary', 0))
+    assert len(header['histogram']['slices']['counts']) == 8
@@ -0,0 +1,33 @@
+import os
+
+import numpy as np
+import pytest
+import SimpleITK as sitk
+
+import girder_segmentation_viewer as plugin
+
+
+@pytest.mark.parametrize('local,stored_name,read_path', [
+    (True, None, 'local'),
+    (True, '0f3a9c', 'symlink'),
+    (False, None, 'copy'),
+])
+def test_local_image_paths(girder_files, local, stored_name, read_path):
+    array = np.arange(2 * 3 * 4, dtype=np.uint8).reshape(2, 3, 4)
+    file = girder_files.add('image.nii.gz', sitk.GetImageFromArray(array), local, stored_name)
+    before = plugin.read_paths.copy()
+
+    with plugin._local_image_path(file) as path:
+        assert path.endswith('.nii.gz')
+        np.testing.assert_array_equal(sitk.GetArrayFromImage(sitk.ReadImage(path)), array)
+        if read_path == 'local':
+            assert path == girder_files.paths['image.nii.gz']
+        elif read_path == 'symlink':
+            assert os.path.realpath(path) == girder_files.paths['image.nii.gz']
+        else:
+            assert not os.path.islink(path)
+
+    assert plugin.read_paths - before == {read_path: 1}
+    # Links and copies are removed, the file itself is kept
+    assert os.path.exists(path) == (read_path == 'local')
+    assert os.path.exists(girder_files.paths['image.nii.gz'])
@@ -0,0 +1,68 @@
+import cherrypy
+import numpy as np
+import SimpleITK as sitk
+
+from girder_segmentation_viewer.histogram import intensity_histogram
+from girder_segmentation_viewer.render import (apply_window, auto_window, blend,
+                                               cached_response, encode_png, label_colors,
+                                               render_etag)
+
+
+def _decode_png(tmp_path, body):
+    path = tmp_path / 'plane.png'
+    path.write_bytes(body)
+    return sitk.GetArrayFromImage(sitk.ReadImage(str(path)))
+
+
+def test_png_round_trip(tmp_path):
+    gray = np.arange(30 * 40, dtype=np.uint32).reshape(30, 40).astype(np.uint8)
+    np.testing.assert_array_equal(_decode_png(tmp_path, encode_png(gray)), gray)
+
+    rgb = label_colors(np.arange(30 * 40).reshape(30, 40) % 7)
+    np.testing.assert_array_equal(_decode_png(tmp_path, encode_png(rgb)), rgb)
+
+
+def test_window_defaults_to_the_preset_of_the_volume():
+    rng = np.random.default_rng(0)
+    volume = rng.normal(1000, 400, (6, 32, 32)).astype(np.int16)
+    histogram = intensity_histogram(volume)
+    # The web client levels base images with the same preset on every slice
+    preset = histogram['windows']['1-99']
+    for plane in volume[[0, 5]]:
+        assert auto_window(plane, histogram) == (preset['width'], preset['level'])
+
+    # Without a histogram, the window spans the range of the plane
+    plane = np.array([[-100, 0], [100, 300]], dtype=np.int16)
+    width, level = auto_window(plane)
+    assert (width, level) == (400, 100)
+    np.testing.assert_array_equal(apply_window(plane, width, level), [[0, 64], [128, 255]])
+    # Values outside the window are clamped
+    np.testing.assert_array_equal(apply_window(plane, 100, 50), [[0, 0], [255, 255]])
+
+
+def test_labels_are_blended_over_the_image():
+    labels = np.array([[0, 1], [2, 1]])
+    colors = label_colors(labels)
+    assert not colors[0, 0].any()
+    np.testing.assert_array_equal(colors[0, 1], colors[1, 1])
+    assert (colors[0, 1] != colors[1, 0]).any()
+
+    gray = np.full((2, 2), 100, dtype=np.uint8)
+    rgb = blend(gray, colors, labels != 0, 0.5)
+    np.testing.assert_array_equal(rgb[0, 0], [100, 100, 100])
+    np.testing.assert_array_equal(rgb[0, 1], np.rint(colors[0, 1] * 0.5 + 50))
+
+
+def test_conditional_requests_are_answered_without_rendering():
+    etag = render_etag(('abc', '0123'), 12, 'axial', 'png')
+    assert etag != render_etag(('abc', '4567'), 12, 'axial', 'png')
+
+    cherrypy.request.headers['If-None-Match'] = ''
+    assert cached_response(etag) is None
+    assert cherrypy.response.headers['ETag'] == etag
+    assert cherrypy.response.headers['Cache-Control'].startswith('public, max-age=')
+    assert 'Girder-Token' in cherrypy.response.headers['Vary']
+
+    cherrypy.request.headers['If-None-Match'] = '"other", %s' % etag
+    assert list(cached_response(etag)()) == [b'']
+    assert cherrypy.response.status == 304
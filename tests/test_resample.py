@@ -0,0 +1,68 @@
+import numpy as np
+import SimpleITK as sitk
+
+from girder_segmentation_viewer.resample import (crop, overlap_region, resample_volume,
+                                                 same_grid)
+from girder_segmentation_viewer.store import VolumeHeader
+
+
+def _image(array, spacing=(1.0, 1.0, 1.0), origin=(0.0, 0.0, 0.0)):
+    image = sitk.GetImageFromArray(array)
+    image.SetSpacing(spacing)
+    image.SetOrigin(origin)
+    return image
+
+
+def test_same_grid_tolerates_rounding():
+    image = _image(np.zeros((4, 5, 6), dtype=np.uint8))
+    header = VolumeHeader.from_image(image)
+    assert same_grid(image, header)
+    assert same_grid(image, VolumeHeader(header.size, (1.0, 1.0, 1.0 + 1e-9), header.origin,
+                                         header.direction))
+    assert not same_grid(image, VolumeHeader(header.size, (1.0, 1.0, 2.0), header.origin,
+                                             header.direction))
+    assert not same_grid(image, header.region((0, 0, 0), (6, 5, 3)))
+
+
+def test_labels_are_resampled_with_nearest_neighbor():
+    labels = np.zeros((8, 8, 8), dtype=np.uint8)
+    labels[2:6, 2:6, 2:6] = 3
+    labels[4:6, 4:6, 4:6] = 7
+    moving = _image(labels)
+    # Half the resolution, voxels centered on blocks of 2x2x2 moving voxels
+    target = VolumeHeader((4, 4, 4), (2.0, 2.0, 2.0), (0.5, 0.5, 0.5), moving.GetDirection())
+
+    resampled = resample_volume(moving, sitk.GetArrayViewFromImage(moving), target, labels=True)
+    assert resampled.dtype == np.uint8
+    assert set(np.unique(resampled)) <= {0, 3, 7}
+
+    expected = sitk.Resample(moving, (4, 4, 4), sitk.Transform(), sitk.sitkNearestNeighbor,
+                             target.GetOrigin(), target.GetSpacing(), target.GetDirection())
+    np.testing.assert_array_equal(resampled, sitk.GetArrayViewFromImage(expected))
+
+
+def test_intensities_are_interpolated_and_zero_outside():
+    ramp = np.broadcast_to(np.arange(8, dtype=np.float32), (4, 4, 8)).copy()
+    moving = _image(ramp)
+    target = VolumeHeader((8, 4, 4), (1.0, 1.0, 1.0), (0.5, 0.0, 0.0), moving.GetDirection())
+
+    resampled = resample_volume(moving, ramp, target, labels=False)
+    np.testing.assert_allclose(resampled[..., :7], ramp[..., :7] + 0.5)
+    # The last voxel is past the center of the last moving voxel
+    assert np.all(resampled[..., 7] == 0)
+
+
+def test_overlap_region_crops_to_the_moving_extent():
+    reference = _image(np.arange(10 * 10 * 10, dtype=np.int16).reshape(10, 10, 10))
+    moving = VolumeHeader((4, 3, 40), (1.0, 1.0, 1.0), (2.0, 5.0, -20.0),
+                          reference.GetDirection())
+
+    region = overlap_region(reference, moving)
+    assert region == ([2, 5, 0], [4, 3, 10])
+    header, array = crop(reference, sitk.GetArrayViewFromImage(reference), region)
+    assert header.GetOrigin() == (2.0, 5.0, 0.0)
+    assert array.shape == (10, 3, 4)
+    assert array[0, 0, 0] == 5 * 10 + 2
+
+    far = VolumeHeader((4, 4, 4), (1.0, 1.0, 1.0), (50.0, 0.0, 0.0), reference.GetDirection())
+    assert overlap_region(reference, far) is None
@@ -0,0 +1,43 @@
+import pytest
+from bson import ObjectId
+
+from girder_segmentation_viewer.results import SegmentationResult, result_key
+
+
+def _file(sha512):
+    return {'_id': ObjectId(), 'sha512': sha512}
+
+
+def test_result_key_depends_on_order_and_contents():
+    seg1, seg2 = _file('a'), _file('b')
+
+    assert result_key('metrics', [seg1, seg2]) != result_key('metrics', [seg2, seg1])
+    assert result_key('metrics', [seg1, seg2]) != result_key('quantification', [seg1, seg2])
+    key = result_key('metrics', [seg1, seg2])
+    seg2['sha512'] = 'c'
+    assert result_key('metrics', [seg1, seg2]) != key
+
+
+@pytest.mark.plugin('girder_segmentation_viewer')
+def test_results_are_invalidated_with_their_files(server):
+    seg1, seg2, other = _file('a'), _file('b'), _file('c')
+    results = SegmentationResult()
+    results.put('metrics', [seg1, seg2], {'dice': 0.5})
+    results.put('metrics', [seg1, other], {'dice': 0.25})
+
+    calls = []
+    assert results.get_or_compute('metrics', [seg1, seg2], calls.append) == {'dice': 0.5}
+    assert not calls
+
+    # Saving a file without changing its contents keeps its results
+    results.invalidate(seg2, keep_content=True)
+    assert results.get('metrics', [seg1, seg2]) == {'dice': 0.5}
+
+    seg2['sha512'] = 'd'
+    results.invalidate(seg2, keep_content=True)
+    seg2['sha512'] = 'b'
+    assert results.get('metrics', [seg1, seg2]) is None
+    assert results.get('metrics', [seg1, other]) == {'dice': 0.25}
+
+    results.invalidate(seg1)
+    assert results.get('metrics', [seg1, other]) is None
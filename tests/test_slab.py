@@ -0,0 +1,100 @@
+import json
+import struct
+
+import numpy as np
+import pytest
+import SimpleITK as sitk
+
+from girder.exceptions import ValidationException
+
+import girder_segmentation_viewer as plugin
+from girder_segmentation_viewer.cache import volume_cache
+
+
+def _volume(shape=(6, 5, 4)):
+    # A numpy shape (z, y, x), each voxel holding its own index
+    return np.arange(np.prod(shape), dtype=np.int16).reshape(shape)
+
+
+def _decode(stream):
+    body = b''.join(bytes(chunk) for chunk in stream())
+    header_length = struct.unpack('<I', body[:4])[0]
+    header = json.loads(body[4:4 + header_length])
+    data = np.frombuffer(body, dtype=np.dtype(header['dtype']).newbyteorder('<'),
+                         offset=4 + header_length)
+    return header, data
+
+
+# Planes of the volume along each axis, planes first like the slab responses
+_AXIS_PLANES = {
+    'axial': lambda volume: volume,
+    'coronal': lambda volume: np.moveaxis(volume, 1, 0),
+    'sagittal': lambda volume: np.moveaxis(volume, 2, 0),
+}
+
+
+@pytest.mark.parametrize('name', ['region.mha', 'decoded.nii.gz'])
+def test_planes_along_each_axis(girder_files, route, name):
+    volume = _volume()
+    image = sitk.GetImageFromArray(volume)
+    image.SetSpacing((0.5, 1.0, 2.0))
+    file = girder_files.add(name, image)
+
+    for axis, planes in _AXIS_PLANES.items():
+        expected = planes(volume)
+        header, data = _decode(route('get_slice')(file, 1, axis, 'binary', 0))
+        assert header['shape'][-1] == 1
+        np.testing.assert_array_equal(data.reshape(expected[1:2].shape), expected[1:2])
+
+        # Ranges are clamped to the planes of the volume
+        header, data = _decode(route('get_slab')(file, -2, 100, axis, 'binary', 0, False))
+        assert (header['start'], header['stop']) == (0, len(expected))
+        assert header['shape'] == list(expected.shape[:0:-1]) + [len(expected)]
+        assert header['volume_shape'] == [4, 5, 6]
+        np.testing.assert_array_equal(data.reshape(expected.shape), expected)
+
+        for start, stop in ((len(expected), len(expected) + 2), (2, 2), (3, 1), (-3, 0)):
+            with pytest.raises(ValidationException, match='out of the image bounds'):
+                route('get_slab')(file, start, stop, axis, 'binary', 0, False)
+
+    # Uncompressed files only decode the planes, the others are decoded once
+    assert volume_cache.stats()['entries'] == (0 if name == 'region.mha' else 1)
+
+
+def test_planes_are_sliced_from_decoded_volumes(girder_files, route):
+    volume = _volume()
+    file = girder_files.add('base.nrrd', sitk.GetImageFromArray(volume))
+    plugin._read_image_with_sitk(file)
+    # The file is no longer read once decoded
+    girder_files.paths['base.nrrd'] = None
+
+    for axis, planes in _AXIS_PLANES.items():
+        expected = planes(volume)[2:4]
+        header, data = _decode(route('get_slab')(file, 2, 4, axis, 'binary', 0, False))
+        assert header['spacing'] == [1.0, 1.0, 1.0]
+        np.testing.assert_array_equal(data.reshape(expected.shape), expected)
+
+
+def test_negative_levels_are_rejected(girder_files, route):
+    base = girder_files.add('base.mha', sitk.GetImageFromArray(_volume()))
+    girder_files.item['segmentation']['base_image'] = {'_id': 'base.mha'}
+
+    calls = [
+        lambda: route('get_base_image_data_json')(girder_files.item, 'binary', -1),
+        lambda: route('get_seg_data_json')(base, 'binary', False, -1, False),
+        lambda: route('get_seg_diff_data_json')(
+            'base.mha', 'base.mha', 'binary', -1, 'categories', None, False, None, None),
+        lambda: route('get_slice')(base, 0, 'axial', 'binary', -1),
+        lambda: route('get_slab')(base, 0, 2, 'axial', 'binary', -1, False),
+    ]
+    for call in calls:
+        with pytest.raises(ValidationException, match='level'):
+            call()
+    assert girder_files.scheduled == []
+
+    # Below the routes, they read the full resolution instead of looping
+    level, start, image, array, volume_size = plugin._read_slab_level(base, 1, 3, 2, -1)
+    assert (level, start, volume_size) == (0, 1, (4, 5, 6))
+    np.testing.assert_array_equal(array, _volume()[1:3])
+    assert plugin._read_image_level(base, -1)[0] == 0
+    assert girder_files.scheduled == []
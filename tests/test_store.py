@@ -0,0 +1,120 @@
+import errno
+import time
+
+import numpy as np
+import SimpleITK as sitk
+
+from girder_segmentation_viewer.store import TEMPORARY_SUFFIX, VolumeHeader, VolumeStore
+
+
+def _image():
+    image = sitk.GetImageFromArray(np.arange(4 * 5 * 6, dtype=np.int16).reshape(4, 5, 6))
+    image.SetSpacing((0.5, 1.0, 2.0))
+    image.SetOrigin((10.0, -5.0, 3.0))
+    image.SetDirection((0.0, 1.0, 0.0, -1.0, 0.0, 0.0, 0.0, 0.0, 1.0))
+    return image
+
+
+def test_round_trip_through_memory_map(tmp_path):
+    store = VolumeStore(str(tmp_path))
+    image = _image()
+    file = {'_id': 'abc', 'sha512': '0123'}
+    store.put(file, image, sitk.GetArrayViewFromImage(image))
+
+    header, array = store.get(file)
+    assert isinstance(array, np.memmap)
+    assert header.GetSize() == image.GetSize()
+    assert header.GetDirection() == image.GetDirection()
+    np.testing.assert_array_equal(array, sitk.GetArrayViewFromImage(image))
+
+    assert store.get({'_id': 'abc', 'sha512': '4567'}) is None
+    store.invalidate('abc')
+    assert store.get(file) is None
+    assert not list(tmp_path.iterdir())
+
+
+def test_region_matches_simpleitk():
+    image = _image()
+    region = sitk.RegionOfInterest(image, (6, 2, 4), (0, 3, 0))
+
+    header = VolumeHeader.from_image(image).region((0, 3, 0), (6, 2, 4))
+    np.testing.assert_allclose(header.GetOrigin(), region.GetOrigin())
+    assert header.GetSize() == region.GetSize()
+
+
+def test_levels_are_replaced_with_the_full_resolution(tmp_path):
+    store = VolumeStore(str(tmp_path))
+    image = _image()
+    array = sitk.GetArrayViewFromImage(image)
+    file = {'_id': 'abc', 'sha512': '0123'}
+    store.put(file, image, array)
+    store.put(file, image, array[::2, ::2, ::2], level=1)
+
+    assert store.get(file, level=1)[1].shape == (2, 3, 3)
+    assert store.get(file) is not None
+
+    store.put({'_id': 'abc', 'sha512': '4567'}, image, array)
+    assert store.get(file, level=1) is None
+
+
+def test_least_recently_used_volumes_are_removed_past_the_budget(tmp_path):
+    store = VolumeStore(str(tmp_path))
+    image = _image()
+    array = sitk.GetArrayViewFromImage(image)
+    files = [{'_id': name, 'sha512': '0123'} for name in ('a', 'b', 'c')]
+    store.put(files[0], image, array)
+    entry_bytes = sum(path.stat().st_size for path in tmp_path.iterdir())
+    store.resize(int(entry_bytes * 2.5))
+
+    # Timestamps of the files order the volumes, keep them apart
+    time.sleep(0.05)
+    store.put(files[1], image, array)
+    time.sleep(0.05)
+    assert store.get(files[0]) is not None
+    time.sleep(0.05)
+    store.put(files[2], image, array)
+
+    assert store.get(files[1]) is None
+    assert store.get(files[0]) is not None
+    assert store.get(files[2]) is not None
+    assert store.evictions == 1
+    assert sum(path.stat().st_size for path in tmp_path.iterdir()) <= entry_bytes * 2.5
+
+    store.resize(0)
+    assert not list(tmp_path.iterdir())
+    store.put(files[0], image, array)
+    assert store.get(files[0]) is None
+
+
+def test_disabled_store_ignores_its_files(tmp_path):
+    store = VolumeStore(str(tmp_path))
+    image = _image()
+    file = {'_id': 'abc', 'sha512': '0123'}
+    store.put(file, image, sitk.GetArrayViewFromImage(image))
+    assert VolumeStore(str(tmp_path), 0).get(file) is None
+
+
+def test_failed_writes_leave_no_files(tmp_path, monkeypatch):
+    store = VolumeStore(str(tmp_path))
+    image = _image()
+    file = {'_id': 'abc', 'sha512': '0123'}
+
+    def full_disk(*args, **kwargs):
+        raise OSError(errno.ENOSPC, 'No space left on device')
+
+    monkeypatch.setattr(np, 'save', full_disk)
+    store.put(file, image, sitk.GetArrayViewFromImage(image))
+    assert store.get(file) is None
+    assert not list(tmp_path.iterdir())
+
+
+def test_files_being_written_are_not_evicted(tmp_path):
+    store = VolumeStore(str(tmp_path), 1)
+    # Another request writing a volume
+    writing = tmp_path / ('tmp1234.npy' + TEMPORARY_SUFFIX)
+    writing.write_bytes(b'\0' * 4096)
+    image = _image()
+    store.put({'_id': 'abc', 'sha512': '0123'}, image, sitk.GetArrayViewFromImage(image))
+
+    assert store.evictions == 1
+    assert list(tmp_path.iterdir()) == [writing]
@@ -0,0 +1,67 @@
+import logging
+
+import cherrypy
+
+from girder_segmentation_viewer import telemetry
+from girder_segmentation_viewer.telemetry import span, timed_route, timing_registry
+
+
+@timed_route('example')
+def _route(chunks):
+    with span('decode'):
+        pass
+
+    def stream():
+        yield from chunks
+
+    return stream
+
+
+def test_stages_are_logged_and_totaled(caplog):
+    timing_registry.clear()
+    with span('ignored'):
+        pass
+
+    with caplog.at_level(logging.INFO, logger=telemetry.__name__):
+        assert list(_route([b'abc', b'de'])()) == [b'abc', b'de']
+
+    timing = caplog.records[-1].segmentation_viewer_timing
+    assert timing['route'] == 'example'
+    assert set(timing['stages']) == {'decode', 'serialization', 'total'}
+    assert timing['response_bytes'] == 5
+
+    text = timing_registry.render({'segmentation_viewer_volume_cache_bytes': 7})
+    assert 'segmentation_viewer_stage_seconds_count{route="example",stage="decode"} 1' in text
+    assert 'segmentation_viewer_response_bytes_sum{route="example"} 5' in text
+    assert 'segmentation_viewer_volume_cache_bytes 7' in text
+    assert 'ignored' not in text
+
+
+def test_requests_are_profiled_on_demand(tmp_path, monkeypatch):
+    monkeypatch.setattr(telemetry, 'profile_path', str(tmp_path))
+    cherrypy.request.headers.pop(telemetry.PROFILE_HEADER, None)
+    list(_route([b'abc'])())
+    assert not list(tmp_path.iterdir())
+
+    cherrypy.request.headers[telemetry.PROFILE_HEADER] = '1'
+    try:
+        list(_route([b'abc'])())
+    finally:
+        del cherrypy.request.headers[telemetry.PROFILE_HEADER]
+    assert [path.suffix for path in tmp_path.iterdir()] == ['.prof']
+
+
+def test_concurrent_requests_skip_profiling(tmp_path, monkeypatch):
+    monkeypatch.setattr(telemetry, 'profile_path', str(tmp_path))
+    cherrypy.request.headers[telemetry.PROFILE_HEADER] = '1'
+    try:
+        # The first response is being sent, with its profiler active
+        first = _route([b'abc', b'def'])()
+        assert next(first) == b'abc'
+        assert list(_route([b'ghi'])()) == [b'ghi']
+        assert not list(tmp_path.iterdir())
+        assert list(first) == [b'def']
+    finally:
+        del cherrypy.request.headers[telemetry.PROFILE_HEADER]
+    # Only the first request was profiled
+    assert len(list(tmp_path.iterdir())) == 1
@@ -0,0 +1,109 @@
+import json
+import struct
+
+import numpy as np
+
+from girder_segmentation_viewer.transport import (
+    binary_volume_body, binary_volume_response, bundle_response, json_volume_response,
+    rle_volume_body, rle_volume_response, to_transport_array)
+
+
+def _decode(body):
+    header_length = struct.unpack('<I', body[:4])[0]
+    header = json.loads(body[4:4 + header_length])
+    data = np.frombuffer(body, dtype=np.dtype(header['dtype']).newbyteorder('<'),
+                         offset=4 + header_length)
+    return header, data
+
+
+def test_binary_volume_round_trip():
+    array = np.arange(2 * 3 * 4, dtype=np.int16).reshape(2, 3, 4)
+    stream = binary_volume_response({'shape': (4, 3, 2), 'spacing': (1.0, 1.0, 2.5)}, array)
+    body = b''.join(bytes(chunk) for chunk in stream())
+
+    header, data = _decode(body)
+    assert header['shape'] == [4, 3, 2]
+    assert header['dtype'] == 'int16'
+    assert (4 + struct.unpack('<I', body[:4])[0]) % 8 == 0
+    np.testing.assert_array_equal(data.reshape(array.shape), array)
+
+
+def test_transport_array_avoids_copies():
+    array = np.zeros((2, 3, 4), dtype=np.float32)
+    assert np.shares_memory(to_transport_array(array), array)
+
+    assert to_transport_array(array.astype(np.int64)).dtype == np.int32
+    assert to_transport_array(array.astype('>u2')).dtype.byteorder in '<='
+
+
+def _decode_runs(body):
+    # Mirrors the decoder of the web client
+    header_length = struct.unpack('<I', body[:4])[0]
+    header = json.loads(body[4:4 + header_length])
+    offset = 4 + header_length
+    slice_count = header['shape'][2] if len(header['shape']) > 2 else 1
+    parts = []
+    for dtype, count in (('<u4', slice_count + 1), ('<u4', header['runs']),
+                         (np.dtype(header['dtype']).newbyteorder('<'), header['runs'])):
+        part = np.frombuffer(body, dtype=dtype, count=count, offset=offset)
+        offset += -(-part.nbytes // 8) * 8
+        parts.append(part)
+    slice_runs, lengths, values = parts
+
+    slices = []
+    for k in range(slice_count):
+        runs = slice(slice_runs[k], slice_runs[k + 1])
+        slices.append(np.repeat(values[runs], lengths[runs]))
+    return header, np.concatenate(slices)
+
+
+def test_rle_volume_round_trip():
+    array = np.zeros((5, 40, 30), dtype=np.int64)
+    array[1:4, 10:30, 5:20] = 3
+    array[2, 15:20, 10:12] = 70000
+    stream = rle_volume_response({'shape': (30, 40, 5)}, array)
+    body = b''.join(bytes(chunk) for chunk in stream())
+
+    header, data = _decode_runs(body)
+    assert header['encoding'] == 'rle'
+    assert header['dtype'] == 'int32'
+    np.testing.assert_array_equal(data.reshape(array.shape), array)
+    # Runs restart on every slice and row change of value
+    assert header['runs'] == 5 + 3 * 20 * 2 + 5 * 2
+    # Against 4 bytes per voxel for the raw int32 buffer
+    assert len(body) < array.size * 4 // 10
+
+
+def test_streamed_json_volume_matches_nested_lists():
+    array = np.arange(2 * 3 * 4, dtype=np.uint8).reshape(2, 3, 4)
+    stream = json_volume_response({'shape': (4, 3, 2), 'type': 'difference'}, array)
+    chunks = list(stream())
+
+    # One chunk per slice besides the opening and closing ones
+    assert len(chunks) == 2 + len(array)
+    body = json.loads(b''.join(chunks))
+    assert body['type'] == 'difference'
+    assert body['data'] == [array_slice.reshape(-1).tolist() for array_slice in array]
+
+
+def test_bundle_parts_are_aligned_volume_bodies():
+    image = np.arange(3 * 5 * 7, dtype=np.int16).reshape(3, 5, 7)
+    labels = np.zeros((3, 5, 7), dtype=np.uint8)
+    labels[1, 2:4, 3:] = 2
+    stream = bundle_response({'quantification': {'seg1': None}}, [
+        ('base', binary_volume_body({'shape': (7, 5, 3)}, image)),
+        ('seg1', rle_volume_body({'shape': (7, 5, 3)}, labels)),
+    ])
+    body = b''.join(bytes(chunk) for chunk in stream())
+
+    header_length = struct.unpack('<I', body[:4])[0]
+    header = json.loads(body[4:4 + header_length])
+    assert [part['name'] for part in header['parts']] == ['base', 'seg1']
+    parts = {}
+    for part in header['parts']:
+        offset = 4 + header_length + part['offset']
+        assert offset % 8 == 0
+        parts[part['name']] = body[offset:offset + part['length']]
+
+    np.testing.assert_array_equal(_decode(parts['base'])[1].reshape(image.shape), image)
+    np.testing.assert_array_equal(_decode_runs(parts['seg1'])[1].reshape(labels.shape), labels)